@@ -1,3 +1,5 @@
+import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -29,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.metrics.RequestMetricsMiddleware',  # first, so latency covers every other middleware
     'corsheaders.middleware.CorsMiddleware',  # Moved to TOP
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,22 +102,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'myapp.User'
 
+# EmailBackend resolves email logins with one lookup.
+AUTHENTICATION_BACKENDS = [
+    'django.contrib.auth.backends.ModelBackend',
+    'myapp.authentication.EmailBackend',
+]
+
+# Login throttle buckets live in a file-based cache so every worker on the
+# host shares them (myapp.throttling).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'lab_system_throttle',
+    },
+}
+LOGIN_THROTTLE_CACHE = 'throttle'
+# scope: (burst capacity, attempts refilled per second)
+LOGIN_THROTTLE_RATES = {
+    'login-ip': (20, 0.5),
+    'login-account-ip': (5, 1 / 60),
+    'login-account': (50, 1 / 60),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'myapp.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Proxies in front of Django that append to X-Forwarded-For (nginx), so
+    # get_ident() (login throttles) sees the client, not loopback. Set to 0
+    # when nothing proxies, or clients could pick their own address.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 1)),
 }
 
+# Request metrics (myapp.metrics). Server-Timing: 'off', 'admin' or 'all'.
+# /api/metrics accepts Admin users and "Authorization: Token <METRICS_TOKEN>".
+REQUEST_METRICS_SERVER_TIMING = 'admin'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Signed link lifetimes in seconds (myapp.tokens)
+PASSWORD_RESET_TIMEOUT = 60 * 60
+EMAIL_VERIFICATION_TIMEOUT = 60 * 60 * 24
+
+# Keyset pagination (myapp.pagination)
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_OBTAIN_SERIALIZER': 'myapp.authentication.LabTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'myapp.authentication.LabTokenRefreshSerializer',
 }
 
+# Claims-based JWT auth (myapp.authentication): how stale a role change may be
+AUTH_USER_CACHE_SECONDS = 5
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
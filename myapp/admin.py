@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Department, Division, Customer, Sample, Test, Payment, Result, Ingredient
+from .models import User, Department, Division, Customer, Sample, Test, Payment, Result, Ingredient, OutboxEmail
 
 class CustomUserAdmin(UserAdmin):
     model = User
@@ -31,7 +31,10 @@ class TestAdmin(admin.ModelAdmin):
 class SampleAdmin(admin.ModelAdmin):
     list_display = ('control_number', 'customer', 'registrar', 'status', 'date_received')
     list_filter = ('status', 'date_received', 'registrar')
-    search_fields = ('control_number', 'customer__name')
+    search_fields = (
+        'control_number', 'laboratory_number', 'sample_name',
+        'customer__first_name', 'customer__last_name', 'customer__organization_name',
+    )
     readonly_fields = ('control_number', 'date_received')
 
 @admin.register(Payment)
@@ -46,6 +49,13 @@ class ResultAdmin(admin.ModelAdmin):
     list_filter = ('confirmed_by_hod', 'confirmed_by_director', 'sent_to_dpf')
     search_fields = ('sample__control_number', 'test__ingredient__name')
 
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Department)
 admin.site.register(Division)
@@ -1,22 +1,22 @@
-from django.http import JsonResponse
-from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import serializers, viewsets, status
+from rest_framework.decorators import action, api_view, permission_classes, renderer_classes, throttle_classes
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db import transaction
+from rest_framework_simplejwt import views as jwt_views
+import json
 import logging
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from datetime import timedelta
 from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated, AllowAny, BasePermission
 from rest_framework.views import APIView
 import random
 from django.contrib.auth.hashers import make_password
 from decimal import Decimal
-from django.core.mail import send_mail
 from django.db.models import Q
-from django.utils.crypto import get_random_string
 from django.urls import reverse
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -28,8 +28,20 @@ from rest_framework.permissions import IsAuthenticated
 
 
 from .models import (
-    User, Department, Division, Customer, Sample, Test, Payment, Result, Ingredient, VerificationToken
+    User, Department, Division, Customer, Sample, Test, Payment, Result, Ingredient,
+    TECHNICIAN_QUEUE_STATUSES,
 )
+from . import (
+    assignments, authentication, bookkeeping, counters, events, exports, metrics, outbox, progress, queues, scheduler,
+    scoping,
+    throttling, tokens, transitions,
+)
+from .authentication import LabRefreshToken
+from .catalog import get_catalog
+from .pagination import (
+    KeysetPagination, SamplePagination, SearchPagination, TestPagination, WorkQueuePagination,
+)
+from .search import search_samples
 from .serializers import (
     LoginSerializer, UserSerializer, DepartmentSerializer, DivisionSerializer,
     CustomerSerializer, SampleDashboardSerializer, TestSerializer, PaymentSerializer, ResultSerializer,
@@ -43,6 +55,31 @@ logger = logging.getLogger(__name__)
 class IsAdmin(BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.role == 'Admin'
+
+
+class EagerLoadingViewSetMixin:
+    """
+    Applies the serializer's declared select/prefetch plan to the ViewSet
+    queryset, so list and detail responses cost a fixed number of queries.
+    """
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        setup_eager_loading = getattr(self.get_serializer_class(), "setup_eager_loading", None)
+        if setup_eager_loading is None:
+            return queryset
+        return setup_eager_loading(queryset)
+
+
+class ScopedViewSetMixin:
+    """
+    Narrows the ViewSet queryset to the rows the caller's role may see with
+    ``scope`` (a myapp.scoping function), so lists, lookups and writes all
+    stay inside that slice.
+    """
+    scope = None
+
+    def get_queryset(self):
+        return self.scope(self.request.user, super().get_queryset())
     
 
     # Add get_current_user view
@@ -65,6 +102,7 @@ def get_current_user(request):
 class CustomerSubmitSampleAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @bookkeeping.atomic()
     def post(self, request):
         customer_data = request.data.get("customer", {})
         samples_data = request.data.get("samples", [])
@@ -73,6 +111,52 @@ class CustomerSubmitSampleAPIView(APIView):
         customer_data.pop("submission_date", None)
         customer_data.pop("submission_time", None)
 
+        # Normalise parameter ids; prices come from the cached catalog. A
+        # string is not a list of ids ("12" would otherwise read as [1, 2]).
+        parameters_field = serializers.ListField(child=serializers.IntegerField())
+        selections = []
+        for sample_data in samples_data:
+            try:
+                selections.append(list(dict.fromkeys(
+                    parameters_field.run_validation(sample_data.get("selected_parameters", []))
+                )))
+            except serializers.ValidationError:
+                selections.append(None)
+        catalog = {
+            ingredient.id: (ingredient.price, ingredient.test_type)
+            for ingredient in get_catalog().ingredients.values()
+        }
+
+        # Validate every sample before writing anything.
+        outcomes = []
+        planned = []
+        for index, (sample_data, parameter_ids) in enumerate(zip(samples_data, selections)):
+            errors = []
+            if parameter_ids is None:
+                errors.append("selected_parameters must be a list of ids.")
+                parameter_ids = []
+            unknown = [ing_id for ing_id in parameter_ids if ing_id not in catalog]
+            if unknown:
+                errors.append(f"Unknown parameters: {unknown}")
+            try:
+                marking_fee = Decimal(str(sample_data.get("marking_label_fee") or 0))
+            except ArithmeticError:
+                errors.append("marking_label_fee must be a number.")
+                marking_fee = Decimal("0")
+
+            if errors:
+                outcomes.append({"index": index, "status": "rejected", "errors": errors})
+                continue
+            amount_due = marking_fee + sum((catalog[ing_id][0] for ing_id in parameter_ids), Decimal("0"))
+            planned.append((index, sample_data, parameter_ids, amount_due))
+            outcomes.append({"index": index, "status": "accepted"})
+
+        if not samples_data or len(planned) != len(samples_data):
+            return Response(
+                {"success": False, "message": "Submission rejected; no samples were saved.", "samples": outcomes},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         email = customer_data.get("email")
         phone = customer_data.get("phone_number")
 
@@ -93,42 +177,62 @@ class CustomerSubmitSampleAPIView(APIView):
                     setattr(customer, field, value)
             customer.save()
 
-        saved_samples = []
-        for sample_data in samples_data:
-            sample = Sample.objects.create(
+        samples = Sample.objects.bulk_create([
+            Sample(
                 customer=customer,
                 sample_name=sample_data.get("name", ""),
                 sample_details=sample_data.get("sample_details", ""),
                 status="Awaiting Registrar Approval",
-                date_received=timezone.now()
-            )
-
-            # Related tests
-            for ing_id in sample_data.get("selected_parameters", []):
-                Test.objects.create(sample=sample, ingredient_id=ing_id)
-
-            # Payment
-            Payment.objects.create(
-                sample=sample,
-                amount_due=sample_data.get("marking_label_fee", 0) + sum(
-                    Ingredient.objects.filter(id__in=sample_data.get("selected_parameters", []))
-                    .values_list("price", flat=True)
-                ),
-                status="Pending",
+                # Every test below starts Pending.
+                tests_total=len(parameter_ids),
+                tests_open=len(parameter_ids),
             )
+            for _, sample_data, parameter_ids, _ in planned
+        ])
+        tests = Test.objects.bulk_create([
+            Test(sample=sample, ingredient_id=ing_id, price=catalog[ing_id][0])
+            for sample, (_, _, parameter_ids, _) in zip(samples, planned)
+            for ing_id in parameter_ids
+        ])
+        Payment.objects.bulk_create([
+            Payment(sample=sample, amount_due=amount_due, status="Pending")
+            for sample, (_, _, _, amount_due) in zip(samples, planned)
+        ])
+
+        counters.apply(
+            counters.created(counters.SAMPLE, [(sample.status, '') for sample in samples]),
+            counters.created(counters.TEST, [(test.status, catalog[test.ingredient_id][1]) for test in tests]),
+        )
+        queues.touch_samples(*samples)
+        events.record_many(
+            events.build(events.SAMPLE_SUBMITTED, sample, to_status=sample.status, actor=request.user)
+            for sample in samples
+        )
 
-            saved_samples.append(sample)
+        for sample, (index, _, parameter_ids, amount_due) in zip(samples, planned):
+            outcomes[index] = {
+                "index": index,
+                "status": "created",
+                "sample_id": sample.id,
+                "tests": len(parameter_ids),
+                "amount_due": str(amount_due),
+            }
 
         return Response(
-            {"success": True, "message": "Sample submitted successfully. Awaiting Registrar approval."},
+            {
+                "success": True,
+                "message": "Sample submitted successfully. Awaiting Registrar approval.",
+                "samples": outcomes,
+            },
             status=status.HTTP_201_CREATED
         )
-    
+
 
 
 # ------------------- Forgot Password -------------------
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@bookkeeping.atomic()
 def forgot_password_api(request):
     email = request.data.get("email")
     if not email:
@@ -139,13 +243,8 @@ def forgot_password_api(request):
     except User.DoesNotExist:
         return Response({"error": "No account found with this email"}, status=404)
 
-    # Generate reset token
-    token = get_random_string(50)
-    VerificationToken.objects.create(
-        user=user,
-        token=token,
-        expires_at=timezone.now() + timedelta(hours=1)  # token valid for 1 hour
-    )
+    # Signed reset token, valid for PASSWORD_RESET_TIMEOUT (see myapp/tokens.py)
+    token = tokens.make_reset_token(user)
 
     reset_url = request.build_absolute_uri(
         reverse("reset-password", kwargs={"token": token})
@@ -153,12 +252,11 @@ def forgot_password_api(request):
 
     subject = "Reset Your Password - Zafiri Lab"
     message = f"Hello {user.username},\n\nClick the link below to reset your password:\n{reset_url}\n\nIf you didn’t request this, please ignore."
-    send_mail(
+    outbox.enqueue(
         subject,
         message,
         settings.EMAIL_HOST_USER,   # ✅ send using configured Gmail
         [email],
-        fail_silently=False,
     )
 
     return Response({"message": "Password reset instructions sent to your email."}, status=200)
@@ -167,32 +265,35 @@ def forgot_password_api(request):
 # ------------------- Reset Password -------------------
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@bookkeeping.atomic()
 def reset_password_api(request, token):
     new_password = request.data.get("password")
     if not new_password:
         return Response({"error": "Password is required"}, status=400)
 
-    try:
-        reset_token = VerificationToken.objects.get(token=token, expires_at__gt=timezone.now())
-    except VerificationToken.DoesNotExist:
+    user = tokens.read_reset_token(token)
+    legacy = None if user else tokens.legacy_token(token)
+    if legacy:
+        user = legacy.user
+    if user is None:
         return Response({"error": "Invalid or expired token"}, status=400)
 
-    user = reset_token.user
+    # The new password hash invalidates the signed token.
     user.password = make_password(new_password)
     user.save()
 
-    # Remove token so it cannot be reused
-    reset_token.delete()
+    if legacy:
+        # Remove token so it cannot be reused
+        legacy.delete()
 
     # Send confirmation email
     subject = "Your Password Has Been Reset"
     message = f"Hello {user.username},\n\nYour password was successfully reset. If this wasn’t you, please contact support immediately."
-    send_mail(
+    outbox.enqueue(
         subject,
         message,
         settings.EMAIL_HOST_USER,
         [user.email],
-        fail_silently=False,
     )
 
     return Response({"message": "Password reset successfully. You can now log in."}, status=200)
@@ -206,11 +307,14 @@ def reset_password_api(request, token):
 # -------------------------------------------------------
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes(throttling.LOGIN_THROTTLES)
 def login_api(request):
+    # The throttles run first, so a throttled attempt costs no lookup or hash.
     serializer = LoginSerializer(data=request.data, context={'request': request})
     serializer.is_valid(raise_exception=True)
     user = serializer.validated_data['user']
-    refresh = RefreshToken.for_user(user)
+    throttling.login_succeeded(request)
+    refresh = LabRefreshToken.for_user(user)
     return Response({
         'success': True,
         'message': 'Login successful',
@@ -219,6 +323,17 @@ def login_api(request):
     })
 
 
+class TokenObtainPairView(jwt_views.TokenObtainPairView):
+    """simplejwt's token endpoint behind the same login throttles as login_api."""
+    throttle_classes = throttling.LOGIN_THROTTLES
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        if response.status_code == 200:
+            throttling.login_succeeded(request)
+        return response
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_api(request):
@@ -233,6 +348,7 @@ def logout_api(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@bookkeeping.atomic()
 def register_api(request):
     username = request.data.get('username')
     email = request.data.get('email')
@@ -246,13 +362,12 @@ def register_api(request):
 
     user = User.objects.create_user(username=username, email=email, password=password, role='Customer')
 
-    token = get_random_string(32)
-    VerificationToken.objects.create(user=user, token=token, expires_at=timezone.now() + timedelta(days=1))
+    token = tokens.make_verification_token(user)
 
     verification_url = request.build_absolute_uri(reverse('verify-email', kwargs={'token': token}))
     subject = 'Verify Your Email for Lab System'
     message = f'Click below to verify your email:\n{verification_url}'
-    send_mail(subject, message, 'no-reply@example.com', [email], fail_silently=True)
+    outbox.enqueue(subject, message, 'no-reply@example.com', [email])
 
     return Response({'message': 'Registration successful. Please check your email for verification.'}, status=201)
 
@@ -260,15 +375,19 @@ def register_api(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def verify_email_api(request, token):
-    try:
-        verification_token = VerificationToken.objects.get(token=token, expires_at__gt=timezone.now())
-        user = verification_token.user
+    verified = tokens.read_verification_token(token)
+    if verified:
+        # Idempotent, so the link needs no single-use marker; a changed email voids it.
+        user_id, email = verified
+        if User.objects.filter(pk=user_id, email=email).update(is_verified=True):
+            return Response({'message': 'Email verified successfully. You can now log in.'})
+    elif legacy := tokens.legacy_token(token):
+        user = legacy.user
         user.is_verified = True
         user.save()
-        verification_token.delete()
+        legacy.delete()
         return Response({'message': 'Email verified successfully. You can now log in.'})
-    except VerificationToken.DoesNotExist:
-        return Response({'error': 'Invalid or expired token.'}, status=400)
+    return Response({'error': 'Invalid or expired token.'}, status=400)
 
 
 # -------------------------------------------------------
@@ -279,23 +398,148 @@ def verify_email_api(request, token):
 def admin_dashboard(request):
     if request.user.role != 'Admin':
         return Response({'success': False, 'message': 'Access denied. Admin role required.'}, status=403)
+    totals = counters.totals()
     return Response({
         'success': True,
         'stats': {
             'total_users': User.objects.count(),
             'total_departments': Department.objects.count(),
-            'total_samples': Sample.objects.count(),
-            'total_tests': Test.objects.count(),
+            'total_samples': totals[counters.SAMPLE],
+            'total_tests': totals[counters.TEST],
         }
     })
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def metrics_api(request):
+    """
+    Request histograms of this worker in the Prometheus text format (see
+    myapp/metrics.py), for scrapers sending ``Authorization: Token
+    <METRICS_TOKEN>`` and for Admin users.
+    """
+    if not metrics.scrape_allowed(request):
+        return Response({"success": False, "message": "Access denied. Admin role required."}, status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def status_facets(request):
+    """
+    Number of samples/tests in each status, served from the status counters.
+    Optional filters: ?entity=sample|test and ?department=<test type>.
+    """
+    entity = request.GET.get('entity')
+    if entity not in (None, counters.SAMPLE, counters.TEST):
+        return Response({'success': False, 'message': "entity must be 'sample' or 'test'."}, status=400)
+
+    return Response({
+        'success': True,
+        **counters.facets(entity=entity, department=request.GET.get('department')),
+    })
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for text/event-stream; only errors are rendered through it."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode(self.charset)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
+def workflow_events(request):
+    """
+    Change feed of workflow transitions visible to the caller's role.
+    ?since=<cursor> returns the events after it (JSON); add ?wait=<seconds>
+    to long-poll for the first one. With Accept: text/event-stream the
+    events are pushed as Server-Sent Events (Last-Event-ID resumes).
+    ?department=<test type> narrows test events to one department.
+    Without a cursor the response only carries the current cursor.
+    Waiting and streaming need a threaded or async worker (see events.py).
+    """
+    since = request.GET.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = int(since) if since not in (None, '') else None
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return Response(
+            {'success': False, 'message': 'since must be an integer cursor and wait a number.'},
+            status=400
+        )
+
+    blocking = events.blocking_allowed(request)
+    visible = events.visible_to(request.user, department=request.GET.get('department'))
+    if isinstance(request.accepted_renderer, EventStreamRenderer):
+        if not blocking:
+            return Response(
+                {'success': False, 'message': 'Event streams are not served by this worker; poll with ?since.'},
+                status=503
+            )
+        response = StreamingHttpResponse(
+            events.stream(visible, events.current_cursor() if since is None else since),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    if since is None:
+        return Response({'success': True, 'cursor': events.current_cursor(), 'events': [], 'more': False})
+    batch, cursor, more = events.wait_for(visible, since, wait if blocking else 0)
+    return Response({
+        'success': True,
+        'cursor': cursor,
+        'events': [events.serialize(event) for event in batch],
+        'more': more,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_samples(request):
+    """
+    Stream every sample with its tests, prices, results and customer as CSV
+    (default) or NDJSON. Filters: ?date_from=YYYY-MM-DD, ?date_to=YYYY-MM-DD
+    (inclusive) and ?status=<sample status> (repeatable or comma separated).
+    Choose the encoding with ?output=csv|ndjson.
+    """
+    if request.user.role not in ('Admin', *User.DIRECTOR_ROLES):
+        return Response({'success': False, 'message': 'Access denied.'}, status=403)
+
+    output_format = request.GET.get('output', 'csv')
+    if output_format not in exports.FORMATS:
+        return Response({'success': False, 'message': "output must be 'csv' or 'ndjson'."}, status=400)
+    statuses = [s.strip() for value in request.GET.getlist('status') for s in value.split(',') if s.strip()]
+    try:
+        queryset = exports.export_queryset(
+            date_from=request.GET.get('date_from'),
+            date_to=request.GET.get('date_to'),
+            statuses=statuses,
+        )
+    except exports.ExportFilterError as exc:
+        return Response({'success': False, 'message': str(exc)}, status=400)
+
+    content_type = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(exports.stream(queryset, output_format), content_type=content_type)
+    filename = f"samples-{timezone.now():%Y%m%d-%H%M%S}.{output_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def registrar_dashboard(request):
     if request.user.role != 'Registrar':
         return Response({'success': False, 'message': 'Access denied. Registrar role required.'}, status=403)
-    my_samples = Sample.objects.filter(registrar=request.user)
+    my_samples = SampleDashboardSerializer.setup_eager_loading(
+        Sample.objects.filter(registrar=request.user)
+    )
     return Response({
         'success': True,
         'samples': SampleDashboardSerializer(my_samples, many=True).data
@@ -316,21 +560,34 @@ def registrar_samples_api(request):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    # unclaimed samples
-    unclaimed = Sample.objects.filter(
-        status='Awaiting Registrar Approval', registrar__isnull=True
-    ).order_by('-date_received')
+    def build_response():
+        # unclaimed samples
+        unclaimed = SampleDashboardSerializer.setup_eager_loading(
+            Sample.objects.filter(status='Awaiting Registrar Approval', registrar__isnull=True)
+        )
+        unclaimed_pages = SamplePagination(cursor_query_param='unclaimed_cursor')
+        unclaimed = unclaimed_pages.paginate_queryset(unclaimed, request)
 
-    # registrar’s claimed samples
-    my_samples = Sample.objects.filter(
-        registrar=request.user
-    ).order_by('-date_received')
+        # registrar’s claimed samples
+        my_samples = SampleDashboardSerializer.setup_eager_loading(
+            Sample.objects.filter(registrar=request.user)
+        )
+        my_pages = SamplePagination(cursor_query_param='cursor')
+        my_samples = my_pages.paginate_queryset(my_samples, request)
 
-    return Response({
-        'success': True,
-        'unclaimed_samples': SampleDashboardSerializer(unclaimed, many=True).data,
-        'my_samples': SampleDashboardSerializer(my_samples, many=True).data,
-    }, status=status.HTTP_200_OK)
+        return Response({
+            'success': True,
+            'unclaimed_samples': SampleDashboardSerializer(unclaimed, many=True).data,
+            'my_samples': SampleDashboardSerializer(my_samples, many=True).data,
+            'pagination': {
+                'unclaimed_samples': unclaimed_pages.get_links(),
+                'my_samples': my_pages.get_links(),
+            },
+        }, status=status.HTTP_200_OK)
+
+    return queues.conditional(
+        request, [queues.UNCLAIMED_QUEUE, queues.registrar_key(request.user.id)], build_response
+    )
 
 
 @api_view(['POST'])
@@ -348,6 +605,9 @@ def registrar_register_sample(request):
     serializer = RegisterSampleSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         samples = serializer.save()
+        samples = SampleDashboardSerializer.setup_eager_loading(
+            Sample.objects.filter(id__in=[sample.id for sample in samples])
+        ).order_by('id')
         return Response({
             "success": True,
             "message": "Samples submitted to HOD successfully.",
@@ -364,18 +624,19 @@ def registrar_submit_to_hod(request, sample_id):
     if request.user.role != 'Registrar':
         return Response({'success': False, 'message': 'Access denied. Registrar role required.'}, status=403)
 
-    try:
-        sample = Sample.objects.get(id=sample_id, registrar=request.user, status='Registrar Claimed')
-        sample.status = 'Submitted to HOD'
-        sample.date_submitted_to_hod = timezone.now()
-        sample.save()
-        return Response({
-            'success': True,
-            'message': f"Sample {sample.id} submitted to HOD successfully.",
-            'sample': SampleDashboardSerializer(sample).data
-        }, status=200)
-    except Sample.DoesNotExist:
+    with bookkeeping.atomic():
+        sample = transitions.transition_sample(
+            sample_id, 'Registrar Claimed', 'Submitted to HOD',
+            kind=events.SAMPLE_SUBMITTED_TO_HOD, actor=request.user,
+            guards={'registrar': request.user},
+        )
+    if sample is None:
         return Response({'success': False, 'message': 'Sample not found or not claimed by this registrar.'}, status=404)
+    return Response({
+        'success': True,
+        'message': f"Sample {sample.id} submitted to HOD successfully.",
+        'sample': SampleDashboardSerializer(SampleDashboardSerializer.reload_eagerly(sample)).data
+    }, status=200)
 
 
 
@@ -390,45 +651,84 @@ def registrar_claim_sample(request, sample_id):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    try:
-        sample = Sample.objects.get(
-            id=sample_id,
-            status='Awaiting Registrar Approval',
-            registrar__isnull=True
+    # One conditional UPDATE: of two registrars claiming at once, exactly one wins.
+    with bookkeeping.atomic():
+        sample = transitions.transition_sample(
+            sample_id, 'Awaiting Registrar Approval', 'Registrar Claimed',   # 👈 FIXED (was "Submitted to HOD")
+            kind=events.SAMPLE_CLAIMED, actor=request.user,
+            guards={'registrar__isnull': True},
+            registrar=request.user,
         )
-        sample.registrar = request.user
-        sample.status = 'Registrar Claimed'   # 👈 FIXED (was "Submitted to HOD")
-        sample.save()
-
-        return Response({
-            'success': True,
-            'message': f"Sample {sample.id} claimed successfully. Now waiting to be submitted to HOD.",
-            'sample': SampleDashboardSerializer(sample).data
-        }, status=status.HTTP_200_OK)
-
-    except Sample.DoesNotExist:
+    if sample is None:
         return Response(
             {'success': False, 'message': 'Sample not found or already claimed.'},
             status=status.HTTP_404_NOT_FOUND
         )
 
+    return Response({
+        'success': True,
+        'message': f"Sample {sample.id} claimed successfully. Now waiting to be submitted to HOD.",
+        'sample': SampleDashboardSerializer(SampleDashboardSerializer.reload_eagerly(sample)).data
+    }, status=status.HTTP_200_OK)
 
 
 
 
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def registrar_claim_next(request):
+    """
+    Claim the next ?n= (default 1) oldest unclaimed samples. Concurrent
+    registrars receive distinct samples instead of racing for the top of
+    the unclaimed list.
+    """
+    if request.user.role != 'Registrar':
+        return Response(
+            {'success': False, 'message': 'Access denied. Registrar role required.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    try:
+        limit = int(request.query_params.get('n', request.data.get('n', 1)))
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= transitions.CLAIM_NEXT_MAX_BATCH:
+        return Response(
+            {'success': False, 'message': f'n must be between 1 and {transitions.CLAIM_NEXT_MAX_BATCH}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    with bookkeeping.atomic():
+        samples = transitions.claim_next_samples(request.user, limit)
+
+    claimed = SampleDashboardSerializer.setup_eager_loading(
+        Sample.objects.filter(id__in=[sample.id for sample in samples])
+    ).order_by('date_received', 'id')
+    return Response({
+        'success': True,
+        'message': f"Claimed {len(samples)} sample(s).",
+        'samples': SampleDashboardSerializer(claimed, many=True).data,
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def unclaimed_samples(request):
     """
     Returns all samples that are not yet claimed by a Registrar.
     """
-    samples = Sample.objects.filter(
-        status='Awaiting Registrar Approval',   # ✅ ensures customer-submitted samples are shown
-        registrar__isnull=True
-    ).select_related('customer').prefetch_related('payment', 'test_set__ingredient')
+    def build_response():
+        samples = UnclaimedSampleSerializer.setup_eager_loading(
+            Sample.objects.filter(
+                status='Awaiting Registrar Approval',   # ✅ ensures customer-submitted samples are shown
+                registrar__isnull=True
+            )
+        )
+
+        serializer = UnclaimedSampleSerializer(samples, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
-    serializer = UnclaimedSampleSerializer(samples, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return queues.conditional(request, [queues.UNCLAIMED_QUEUE], build_response)
 
 
 
@@ -439,24 +739,27 @@ def unclaimed_samples(request):
 @permission_classes([IsAuthenticated])
 def hod_dashboard(request):
     """
-    Head of Department dashboard – view all samples submitted by registrar.
+    Head of Department dashboard – view the samples submitted by registrar
+    within the caller's scope (their department, see myapp/scoping.py).
     Shows only samples with status 'Submitted to HOD' or 'Awaiting HOD Review'.
     """
-    samples = (
-        Sample.objects.filter(
-            Q(status__iexact="Submitted to HOD") |
-            Q(status__iexact="Awaiting HOD Review")
+    def build_response():
+        samples = FullSampleSerializer.setup_eager_loading(
+            scoping.samples(request.user, Sample.objects.filter(status__in=queues.HOD_QUEUE_STATUSES))
         )
-        .select_related("customer")
-        .prefetch_related("test_set__ingredient")
-    )
 
-    serializer = FullSampleSerializer(samples, many=True)
-    return Response(serializer.data)  
+        paginator = SamplePagination()
+        page = paginator.paginate_queryset(samples, request)
+        serializer = FullSampleSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # The scope follows the caller's department, which a user save can change.
+    return queues.conditional(request, [queues.HOD_QUEUE, authentication.USERS_KEY], build_response)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@bookkeeping.atomic()
 def hod_assign_technician(request, sample_id):
     """
     HOD assigns one or more technicians to specific tests in a sample.
@@ -475,6 +778,10 @@ def hod_assign_technician(request, sample_id):
     except Sample.DoesNotExist:
         return Response({"success": False, "message": "Sample not found."}, status=404)
 
+    test_changes = []
+    progress_changes = []
+    assigned_events = []
+
     # Loop through each selected technician
     for tech_id in technician_ids:
         try:
@@ -494,21 +801,109 @@ def hod_assign_technician(request, sample_id):
         )
 
         for test in tests:
+            test_changes.append((test.status, "In Progress", specialization))
+            progress_changes.append((sample.id, test.status, "In Progress"))
+            queues.touch_technicians(test.assigned_to_id, technician.id)
+            old_test_status = test.status
             test.assigned_to = technician
             test.status = "In Progress"
             test.save()
+            assigned_events.append(events.build(
+                events.TEST_ASSIGNED, sample, test, old_test_status, test.status, request.user
+            ))
 
+    counters.apply(
+        counters.moved(counters.TEST, test_changes),
+        counters.moved(counters.SAMPLE, [(sample.status, "In Progress", "")]),
+    )
+    progress.record(progress_changes)
+    old_status = sample.status
     sample.status = "In Progress"
-    sample.save()
+    sample.save(update_fields=["status"])
+    queues.touch_samples(
+        sample, old_status=old_status,
+        dg=any(old == queues.DG_REVIEW_STATUS for old, _, _ in test_changes),
+    )
+    events.record_many(assigned_events)
 
     return Response({
         "success": True,
         "message": "Technician(s) assigned successfully.",
-        "sample": FullSampleSerializer(sample).data
+        "sample": FullSampleSerializer(FullSampleSerializer.reload_eagerly(sample)).data
     }, status=200)
 
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def hod_assign_batch(request):
+    """
+    HOD assigns many tests at once:
+    {"assignments": [{"sample": 1, "test": 7, "technician": 3}, ...]}.
+    Either every row is applied or none is; the response summarises the
+    batch instead of returning the samples.
+    """
+    if request.user.role != 'HOD':
+        return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
+
+    items = request.data.get("assignments")
+    if not isinstance(items, list) or not items:
+        return Response({"success": False, "message": "assignments must be a non-empty list."}, status=400)
+    if len(items) > assignments.MAX_BATCH:
+        return Response(
+            {"success": False, "message": f"At most {assignments.MAX_BATCH} assignments per request."},
+            status=400
+        )
+    try:
+        rows = [(int(item["sample"]), int(item["test"]), int(item["technician"])) for item in items]
+    except (KeyError, TypeError, ValueError):
+        return Response(
+            {"success": False, "message": "Each assignment needs integer sample, test and technician ids."},
+            status=400
+        )
+
+    try:
+        with bookkeeping.atomic():
+            summary = assignments.assign_tests(rows, request.user)
+    except transitions.BatchRejected as exc:
+        return Response(
+            {"success": False, "message": "No tests were assigned.", "errors": exc.errors},
+            status=400
+        )
+    return Response({"success": True, "message": f"Assigned {summary['assigned']} test(s).", **summary}, status=200)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def hod_auto_assign(request):
+    """
+    Assign every unassigned test of the HOD queue to the least loaded
+    matching technician. Body (all optional): department, limit,
+    keep_samples_together (default true), dry_run (default false).
+    """
+    if request.user.role != 'HOD':
+        return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
+
+    options = request.data
+    try:
+        limit = int(options["limit"]) if options.get("limit") not in (None, "") else None
+    except (TypeError, ValueError):
+        limit = 0
+    if limit is not None and limit < 1:
+        return Response({"success": False, "message": "limit must be a positive integer."}, status=400)
+
+    with bookkeeping.atomic():
+        summary = scheduler.auto_assign(
+            request.user,
+            department=options.get("department") or None,
+            keep_samples_together=options.get("keep_samples_together", True) not in (False, "false", "0"),
+            limit=limit,
+            dry_run=options.get("dry_run", False) in (True, "true", "1"),
+        )
+    verb = "Would assign" if summary["dry_run"] else "Assigned"
+    return Response({"success": True, "message": f"{verb} {summary['planned']} test(s).", **summary}, status=200)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_technicians(request):
@@ -520,7 +915,7 @@ def list_technicians(request):
         return Response({"success": False, "message": "Access denied."}, status=403)
 
     specialization = request.GET.get("specialization")  # optional filter
-    technicians = User.objects.filter(role="Technician")
+    technicians = UserSerializer.setup_eager_loading(User.objects.filter(role="Technician"))
 
     if specialization:
         technicians = technicians.filter(specialization=specialization)
@@ -540,10 +935,48 @@ def technician_dashboard(request):
     if request.user.role != 'Technician':
         return Response({'success': False, 'message': 'Access denied. Technician role required.'}, status=403)
 
-    assigned = Test.objects.filter(assigned_to=request.user)
+    assigned = TechnicianDashboardSerializer.setup_eager_loading(
+        Test.objects.filter(assigned_to=request.user)
+    )
     return Response({'success': True, 'tests': TechnicianDashboardSerializer(assigned, many=True).data})
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def technician_queue(request):
+    """
+    The technician's actionable tests (Pending / In Progress, which includes
+    rejected results sent back for rework), highest priority first, then
+    oldest. Keyset-paginated; optional ?status= and ?priority= filters.
+    Send the returned ETag as If-None-Match to get a 304 while the queue is
+    unchanged.
+    """
+    if request.user.role != 'Technician':
+        return Response({'success': False, 'message': 'Access denied. Technician role required.'}, status=403)
+
+    tests = Test.objects.filter(assigned_to=request.user, status__in=TECHNICIAN_QUEUE_STATUSES)
+    status_filter = request.GET.get('status')
+    if status_filter:
+        if status_filter not in TECHNICIAN_QUEUE_STATUSES:
+            return Response(
+                {'success': False, 'message': f"status must be one of: {', '.join(TECHNICIAN_QUEUE_STATUSES)}."},
+                status=400
+            )
+        tests = tests.filter(status=status_filter)
+    priority = request.GET.get('priority')
+    if priority:
+        if priority not in {str(value) for value, _ in Test.PRIORITY_CHOICES}:
+            return Response({'success': False, 'message': 'Invalid priority.'}, status=400)
+        tests = tests.filter(priority=int(priority))
+
+    def build_response():
+        paginator = WorkQueuePagination()
+        page = paginator.paginate_queryset(TechnicianDashboardSerializer.setup_eager_loading(tests), request)
+        return paginator.get_paginated_response(TechnicianDashboardSerializer(page, many=True).data)
+
+    return queues.conditional(request, [queues.technician_key(request.user.id)], build_response)
+
+
 
 # api_views.py
 @api_view(['POST'])
@@ -558,14 +991,6 @@ def technician_submit_result(request, test_id):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    try:
-        test = Test.objects.get(id=test_id, assigned_to=request.user)
-    except Test.DoesNotExist:
-        return Response(
-            {"success": False, "message": "Test not found or not assigned to you."},
-            status=status.HTTP_404_NOT_FOUND
-        )
-
     results = request.data.get("results")
     if not results:
         return Response(
@@ -573,27 +998,73 @@ def technician_submit_result(request, test_id):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Save test result
-    test.results = results
-    test.status = "Awaiting HOD Review"
-    test.submitted_date = timezone.now()
-    test.save()
+    # Same path as a batch of one: the test is saved only if it is open and
+    # assigned to this technician, and the sample follows when this was its
+    # last open test (decided once, under the sample row lock).
+    try:
+        with bookkeeping.atomic():
+            tests, samples = transitions.submit_results(request.user, {test_id: results})
+    except transitions.BatchRejected:
+        return Response(
+            {"success": False, "message": "Test not found, not assigned to you or not open."},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    return Response({
+        "success": True,
+        "message": f"Results for test {tests[0].id} submitted to HOD successfully.",
+        "sample": FullSampleSerializer(FullSampleSerializer.reload_eagerly(samples[0])).data  # ✅ includes customer info & contact
+    }, status=status.HTTP_200_OK)
 
-    # Check if all tests for the sample are submitted
-    sample = test.sample
-    all_submitted = sample.test_set.filter(
-        status__in=["Pending", "In Progress"]
-    ).count() == 0
 
-    if all_submitted:
-        sample.status = "Awaiting HOD Review"
-        sample.save()
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def technician_submit_results(request):
+    """
+    Technician submits results for many tests at once:
+    {"results": [{"test": 7, "results": "..."}, ...]}. Either all are
+    recorded or none; the response is a short status summary.
+    """
+    if request.user.role != 'Technician':
+        return Response(
+            {"success": False, "message": "Access denied. Technician role required."},
+            status=status.HTTP_403_FORBIDDEN
+        )
 
+    items = request.data.get("results")
+    if not isinstance(items, list) or not items:
+        return Response({"success": False, "message": "results must be a non-empty list."}, status=400)
+    if len(items) > transitions.RESULTS_MAX_BATCH:
+        return Response(
+            {"success": False, "message": f"At most {transitions.RESULTS_MAX_BATCH} results per request."},
+            status=400
+        )
+    results_by_test = {}
+    for item in items:
+        try:
+            test_id = int(item["test"])
+        except (KeyError, TypeError, ValueError):
+            return Response({"success": False, "message": "Each entry needs an integer test id."}, status=400)
+        if not item.get("results"):
+            return Response({"success": False, "message": f"Results are required for test {test_id}."}, status=400)
+        if test_id in results_by_test:
+            return Response({"success": False, "message": f"Test {test_id} appears more than once."}, status=400)
+        results_by_test[test_id] = item["results"]
+
+    try:
+        with bookkeeping.atomic():
+            tests, samples = transitions.submit_results(request.user, results_by_test)
+    except transitions.BatchRejected as exc:
+        return Response(
+            {"success": False, "message": "No results were submitted.", "errors": exc.errors},
+            status=404
+        )
     return Response({
         "success": True,
-        "message": f"Results for test {test.id} submitted to HOD successfully.",
-        "sample": FullSampleSerializer(sample).data  # ✅ includes customer info & contact
-    }, status=status.HTTP_200_OK)
+        "message": f"Results for {len(tests)} test(s) submitted to HOD.",
+        "tests": [test.id for test in tests],
+        "samples": [{"id": sample.id, "status": sample.status} for sample in samples],
+    }, status=200)
 
 
 @api_view(['POST'])
@@ -608,62 +1079,108 @@ def hod_submit_to_director(request, sample_id):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    try:
-        sample = Sample.objects.get(id=sample_id, status="Awaiting HOD Review")
-    except Sample.DoesNotExist:
+    with bookkeeping.atomic():
+        sample = transitions.transition_sample(
+            sample_id, "Awaiting HOD Review", "Submitted to Director",
+            kind=events.SAMPLE_SUBMITTED_TO_DIRECTOR, actor=request.user,
+        )
+    if sample is None:
         return Response(
             {"success": False, "message": "Sample not found or not ready for submission."},
             status=status.HTTP_404_NOT_FOUND
         )
 
-    sample.status = "Submitted to Director"
-    sample.date_submitted_to_director = timezone.now()
-    sample.save()
-
     return Response({
         "success": True,
         "message": f"Sample {sample.id} submitted to Director successfully.",
-        "sample": FullSampleSerializer(sample).data
+        "sample": FullSampleSerializer(FullSampleSerializer.reload_eagerly(sample)).data
     }, status=status.HTTP_200_OK)
 
 
 
-@api_view(['GET'])
+def _bulk_review(request, stage):
+    """
+    Shared body of the bulk review endpoints:
+    {"action": "approve"|"reject", "test_ids": [...]} or
+    {"action": ..., "sample_id": N}.
+    """
+    action = request.data.get("action")
+    test_ids = request.data.get("test_ids")
+    sample_id = request.data.get("sample_id")
+    if action not in ("approve", "reject"):
+        return Response({"success": False, "message": "action must be approve or reject."}, status=400)
+    if (test_ids is None) == (sample_id is None):
+        return Response({"success": False, "message": "Send either test_ids or sample_id."}, status=400)
+    try:
+        if sample_id is not None:
+            sample_id = int(sample_id)
+        else:
+            if not isinstance(test_ids, list) or not test_ids:
+                raise ValueError
+            test_ids = [int(test_id) for test_id in test_ids]
+    except (TypeError, ValueError):
+        return Response(
+            {"success": False, "message": "test_ids must be a list of ids and sample_id an id."}, status=400
+        )
+    if test_ids and len(test_ids) > transitions.REVIEW_MAX_BATCH:
+        return Response(
+            {"success": False, "message": f"At most {transitions.REVIEW_MAX_BATCH} tests per request."},
+            status=400
+        )
+
+    with bookkeeping.atomic():
+        moved, skipped = transitions.review_tests(stage, action, request.user, test_ids, sample_id)
+    verb = "Approved" if action == "approve" else "Rejected"
+    return Response({
+        "success": True,
+        "message": f"{verb} {len(moved)} test(s); skipped {len(skipped)}.",
+        "approved" if action == "approve" else "rejected": moved,
+        "skipped": skipped,
+    }, status=200)
+
+
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def dg_dashboard(request):
-    if request.user.role != 'Director':
+def hod_bulk_review(request):
+    """HOD accepts (to DG review) or rejects (back to the technician) many tests."""
+    if request.user.role != 'HOD':
+        return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
+    return _bulk_review(request, 'hod')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def dg_bulk_review(request):
+    """Director approves or rejects (back to the HOD) many tests."""
+    if request.user.role not in User.DIRECTOR_ROLES:
         return Response({"success": False, "message": "Access denied. Director role required."}, status=403)
-    try:
-        samples = Sample.objects.prefetch_related('test_set').filter(test_set__status="Awaiting DG Review").distinct()
-        serializer = FullSampleSerializer(samples, many=True)
-        return Response(serializer.data, status=200)
-    except Exception as e:
-        return Response({"success": False, "message": str(e)}, status=500)
+    return _bulk_review(request, 'dg')
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def dg_approve_result(request, test_id):
-    if request.user.role not in ['Director', 'Director General']:
+    if request.user.role not in User.DIRECTOR_ROLES:
         return Response(
             {"success": False, "message": "Access denied. Director role required."},
             status=403
         )
 
-    try:
-        test = Test.objects.get(id=test_id, status="Awaiting DG Review")
-        test.status = "Approved"
-        test.approved_by = request.user
-        test.approved_date = timezone.now()
-        test.save()
-        return Response(
-            {"success": True, "message": "Test approved by Director."},
-            status=200
+    with bookkeeping.atomic():
+        test = transitions.transition_test(
+            test_id, "Awaiting DG Review", "Approved",
+            kind=events.TEST_APPROVED, actor=request.user,
+            approved_by=request.user, approved_date=timezone.now(),
         )
-    except Test.DoesNotExist:
+    if test is None:
         return Response(
             {"success": False, "message": "Test not found or not awaiting DG review."},
             status=404
         )
+    return Response(
+        {"success": True, "message": "Test approved by Director."},
+        status=200
+    )
  # Fixed: Removed extra )
 
 
@@ -673,20 +1190,28 @@ def hod_reject_result(request, test_id):
     if request.user.role != 'HOD':
         return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
     try:
-        test = Test.objects.get(id=test_id, status="Awaiting HOD Review")
-        reassigned_to_id = request.data.get("reassigned_to")
-        if not reassigned_to_id:
-            return Response({"success": False, "message": "Technician ID required for reassignment."}, status=400)
-        try:
-            technician = User.objects.get(id=reassigned_to_id, role="Technician", specialization=test.ingredient.test_type)
-        except User.DoesNotExist:
-            return Response({"success": False, "message": "Invalid technician or specialization mismatch."}, status=400)
-        test.status = "Pending"
-        test.assigned_to = technician
-        test.save()
-        return Response({"success": True, "message": "Test rejected and reassigned successfully."}, status=200)
+        test = Test.objects.only('ingredient_id', 'assigned_to_id').get(id=test_id, status="Awaiting HOD Review")
     except Test.DoesNotExist:
         return Response({"success": False, "message": "Test not found or not awaiting HOD review."}, status=404)
+    reassigned_to_id = request.data.get("reassigned_to")
+    if not reassigned_to_id:
+        return Response({"success": False, "message": "Technician ID required for reassignment."}, status=400)
+    try:
+        technician = User.objects.get(id=reassigned_to_id, role="Technician",
+                                      specialization=get_catalog().test_type(test.ingredient_id))
+    except User.DoesNotExist:
+        return Response({"success": False, "message": "Invalid technician or specialization mismatch."}, status=400)
+    with bookkeeping.atomic():
+        # Guarded by the assignee read above, so a concurrent rejection wins only once.
+        rejected = transitions.transition_test(
+            test_id, "Awaiting HOD Review", "Pending",
+            kind=events.TEST_REJECTED, actor=request.user,
+            guards={'assigned_to_id': test.assigned_to_id},
+            previous_assignee_id=test.assigned_to_id, assigned_to=technician,
+        )
+    if rejected is None:
+        return Response({"success": False, "message": "Test not found or not awaiting HOD review."}, status=404)
+    return Response({"success": True, "message": "Test rejected and reassigned successfully."}, status=200)
     
 
 @api_view(['POST'])
@@ -694,15 +1219,15 @@ def hod_reject_result(request, test_id):
 def hod_accept_result(request, test_id):
     if request.user.role != 'HOD':
         return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
-    try:
-        test = Test.objects.get(id=test_id, status="Awaiting HOD Review")
-        test.status = "Awaiting DG Review"
-        test.approved_by = request.user
-        test.approved_date = timezone.now()
-        test.save()
-        return Response({"success": True, "message": "Test approved and submitted to Director."}, status=200)
-    except Test.DoesNotExist:
+    with bookkeeping.atomic():
+        test = transitions.transition_test(
+            test_id, "Awaiting HOD Review", "Awaiting DG Review",
+            kind=events.TEST_ACCEPTED, actor=request.user,
+            approved_by=request.user, approved_date=timezone.now(),
+        )
+    if test is None:
         return Response({"success": False, "message": "Test not found or not awaiting HOD review."}, status=404)
+    return Response({"success": True, "message": "Test approved and submitted to Director."}, status=200)
     
 
 
@@ -717,14 +1242,21 @@ def hod_accept_result(request, test_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dg_dashboard(request):
-    if request.user.role != 'Director General':
+    if request.user.role not in User.DIRECTOR_ROLES:
         return Response({"success": False, "message": "Access denied. Director role required."}, status=403)
-    try:
-        samples = Sample.objects.prefetch_related('test_set').filter(test_set__status="Awaiting DG Review").distinct()
-        serializer = FullSampleSerializer(samples, many=True)
-        return Response(serializer.data, status=200)
-    except Exception as e:
-        return Response({"success": False, "message": str(e)}, status=500)
+    def build_response():
+        try:
+            samples = FullSampleSerializer.setup_eager_loading(
+                Sample.objects.filter(tests_awaiting_dg__gt=0)
+            )
+            paginator = SamplePagination()
+            page = paginator.paginate_queryset(samples, request)
+            serializer = FullSampleSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        except Exception as e:
+            return Response({"success": False, "message": str(e)}, status=500)
+
+    return queues.conditional(request, [queues.DG_QUEUE], build_response)
 
 
 
@@ -734,15 +1266,15 @@ def dg_dashboard(request):
 def submit_to_director(request, test_id):
     if request.user.role != 'HOD':
         return Response({"success": False, "message": "Access denied. HOD role required."}, status=403)
-    try:
-        test = Test.objects.get(id=test_id, status="Awaiting HOD Review")
-        test.status = "Awaiting DG Review"
-        test.approved_by = request.user
-        test.approved_date = timezone.now()
-        test.save()
-        return Response({"success": True, "message": "Test submitted to Director successfully."}, status=200)
-    except Test.DoesNotExist:
+    with bookkeeping.atomic():
+        test = transitions.transition_test(
+            test_id, "Awaiting HOD Review", "Awaiting DG Review",
+            kind=events.TEST_ACCEPTED, actor=request.user,
+            approved_by=request.user, approved_date=timezone.now(),
+        )
+    if test is None:
         return Response({"success": False, "message": "Test not found or not awaiting HOD review."}, status=404)
+    return Response({"success": True, "message": "Test submitted to Director successfully."}, status=200)
     
 
 
@@ -751,55 +1283,173 @@ def submit_to_director(request, test_id):
 
 # ViewSets
 # -------------------------------------------------------
-class SampleViewSet(viewsets.ModelViewSet):
+class SampleViewSet(ScopedViewSetMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Sample.objects.all()
+    scope = staticmethod(scoping.samples)
     serializer_class = SampleDashboardSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = SamplePagination
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked search: ?q= matches words of sample_name/sample_details and
+        fragments of control_number/laboratory_number.
+        """
+        terms = request.query_params.get('q', '').strip()
+        if not terms:
+            return Response({'success': False, 'message': 'q is required.'}, status=400)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(search_samples(self.get_queryset(), terms), request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @bookkeeping.atomic()
+    def perform_create(self, serializer):
+        sample = serializer.save()
+        counters.record_created(counters.SAMPLE, [(sample.status, '')])
+        queues.touch_samples(sample)
+
+    @bookkeeping.atomic()
+    def perform_update(self, serializer):
+        old_status, old_registrar_id = serializer.instance.status, serializer.instance.registrar_id
+        # save() writes every column; reload the progress columns under the
+        # row lock so test transitions since get_object() are not undone.
+        current = Sample.objects.select_for_update().values(*progress.FIELDS).get(pk=serializer.instance.pk)
+        for field, value in current.items():
+            setattr(serializer.instance, field, value)
+        sample = serializer.save()
+        counters.record_transition(counters.SAMPLE, old_status, sample.status)
+        # Work queue rows show sample details.
+        queues.touch_technicians(*sample.test_set.values_list('assigned_to', flat=True).distinct())
+        queues.touch_samples(sample, old_status=old_status, old_registrar_id=old_registrar_id, dg=True)
+
+    @bookkeeping.atomic()
+    def perform_destroy(self, instance):
+        # Deleting a sample cascades to its tests.
+        tests = instance.test_set.values_list('status', 'ingredient__test_type', 'assigned_to')
+        counters.apply(
+            counters.deleted(counters.SAMPLE, [(instance.status, '')]),
+            counters.deleted(counters.TEST, [(status, department) for status, department, _ in tests]),
+        )
+        queues.touch_technicians(*{assignee for _, _, assignee in tests})
+        queues.touch_samples(instance, dg=True)
+        instance.delete()
 
 
-class TestViewSet(viewsets.ModelViewSet):
+class TestViewSet(ScopedViewSetMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Test.objects.all()
+    scope = staticmethod(scoping.tests)
     serializer_class = TestSerializer
     permission_classes = [IsAuthenticated]
-
-
-class UserViewSet(viewsets.ModelViewSet):
+    pagination_class = TestPagination
+
+    @bookkeeping.atomic()
+    def perform_create(self, serializer):
+        test = serializer.save()
+        counters.record_created(counters.TEST, [(test.status, counters.test_department(test))])
+        progress.record([(test.sample_id, None, test.status)])
+        queues.touch_technicians(test.assigned_to_id)
+        queues.touch_test(test)
+
+    @bookkeeping.atomic()
+    def perform_update(self, serializer):
+        old_status, old_assignee = serializer.instance.status, serializer.instance.assigned_to_id
+        old_sample = serializer.instance.sample
+        test = serializer.save()
+        counters.record_transition(counters.TEST, old_status, test.status, counters.test_department(test))
+        if old_sample.id != test.sample_id:
+            progress.record([(old_sample.id, old_status, None), (test.sample_id, None, test.status)])
+        else:
+            progress.record([(test.sample_id, old_status, test.status)])
+        queues.touch_technicians(old_assignee, test.assigned_to_id)
+        queues.touch_test(test, old_status=old_status)
+        if old_sample.id != test.sample_id:
+            queues.touch_samples(old_sample, dg=True)
+
+    @bookkeeping.atomic()
+    def perform_destroy(self, instance):
+        counters.record_deleted(counters.TEST, [(instance.status, counters.test_department(instance))])
+        progress.record([(instance.sample_id, instance.status, None)])
+        queues.touch_technicians(instance.assigned_to_id)
+        queues.touch_test(instance)
+        instance.delete()
+
+
+class UserViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
 
-class DepartmentViewSet(viewsets.ModelViewSet):
+class DepartmentViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
     permission_classes = [IsAuthenticated]
 
 
-class DivisionViewSet(viewsets.ModelViewSet):
+class DivisionViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Division.objects.all()
     serializer_class = DivisionSerializer
     permission_classes = [IsAuthenticated]
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(ScopedViewSetMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
+    scope = staticmethod(scoping.customers)
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    # Dashboards embed the customer of each sample.
+    @bookkeeping.atomic()
+    def perform_update(self, serializer):
+        customer = serializer.save()
+        queues.touch_samples(*customer.samples.all(), dg=True)
+
+    @bookkeeping.atomic()
+    def perform_destroy(self, instance):
+        queues.touch_samples(*instance.samples.all(), dg=True)
+        instance.delete()
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(ScopedViewSetMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
+    scope = staticmethod(scoping.payments)
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
+    # Dashboards embed the payment of each sample.
+    @bookkeeping.atomic()
+    def perform_create(self, serializer):
+        queues.touch_samples(serializer.save().sample, dg=True)
 
-class ResultViewSet(viewsets.ModelViewSet):
+    @bookkeeping.atomic()
+    def perform_update(self, serializer):
+        old_sample = serializer.instance.sample
+        payment = serializer.save()
+        queues.touch_samples(old_sample, payment.sample, dg=True)
+
+    @bookkeeping.atomic()
+    def perform_destroy(self, instance):
+        queues.touch_samples(instance.sample, dg=True)
+        instance.delete()
+
+
+class ResultViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Result.objects.all()
     serializer_class = ResultSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny]
+
+    def list(self, request, *args, **kwargs):
+        # Served from the in-process catalog; no query unless it changed.
+        return Response(get_catalog().listing)
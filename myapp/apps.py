@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        from . import checks, search, signals  # noqa: F401
+        post_migrate.connect(search.install_sqlite_triggers, sender=self, dispatch_uid='myapp.search_triggers')
@@ -0,0 +1,116 @@
+# myapp/assignments.py
+"""
+Batch assignment of tests to technicians.
+
+``assign_tests()`` takes many (sample, test, technician) rows at once. The
+technician roster and the tests are each read in one query, every row is
+validated against them, and then the tests are written with one
+``update()`` per technician and the touched samples with one more,
+together with the counters, queue watermarks and workflow events. A batch
+is applied completely or not at all.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import counters, events, progress, queues
+from .catalog import get_catalog
+from .models import TEST_OPEN_STATUSES, Sample, Test, User
+from .transitions import BatchRejected
+
+ASSIGNED_STATUS = 'In Progress'
+MAX_BATCH = getattr(settings, 'ASSIGNMENT_MAX_BATCH', 500)
+
+
+def load_roster(technician_ids=None):
+    """{technician id: specialization} of active technicians, in one query."""
+    technicians = User.objects.filter(role='Technician', is_active=True, specialization__gt='')
+    if technician_ids is not None:
+        technicians = technicians.filter(id__in=technician_ids)
+    return dict(technicians.values_list('id', 'specialization'))
+
+
+def assign_tests(rows, actor, roster=None):
+    """
+    Assign tests to technicians. ``rows`` is a list of
+    (sample_id, test_id, technician_id). Raises BatchRejected if any row is
+    invalid, otherwise returns a summary. Must run inside
+    ``bookkeeping.atomic()``.
+    """
+    if roster is None:
+        roster = load_roster({technician_id for _, _, technician_id in rows})
+    tests = {
+        test.id: test
+        for test in Test.objects.select_for_update()
+        .filter(id__in=[test_id for _, test_id, _ in rows])
+        .only('id', 'status', 'sample_id', 'ingredient_id', 'assigned_to_id')
+    }
+    catalog = get_catalog()
+
+    errors = []
+    seen = set()
+    for index, (sample_id, test_id, technician_id) in enumerate(rows):
+        test = tests.get(test_id)
+        if test is None or test.sample_id != sample_id:
+            error = 'Test not found in this sample.'
+        elif test_id in seen:
+            error = 'Test appears more than once.'
+        elif test.status not in TEST_OPEN_STATUSES:
+            error = f'Test is {test.status}.'
+        elif technician_id not in roster:
+            error = 'Unknown or inactive technician.'
+        elif roster[technician_id] != catalog.test_type(test.ingredient_id):
+            error = 'Technician specialization does not match the test.'
+        else:
+            error = None
+        seen.add(test_id)
+        if error:
+            errors.append({'index': index, 'test': test_id, 'error': error})
+    if errors:
+        raise BatchRejected(errors)
+    if not rows:
+        return {'assigned': 0, 'samples': [], 'technicians': {}}
+
+    test_changes = []
+    previous_assignees = set()
+    left_dg_review = False
+    for sample_id, test_id, technician_id in rows:
+        test = tests[test_id]
+        test_changes.append((test.status, ASSIGNED_STATUS, catalog.test_type(test.ingredient_id)))
+        previous_assignees.add(test.assigned_to_id)
+        left_dg_review = left_dg_review or test.status == queues.DG_REVIEW_STATUS
+        test.assigned_to_id = technician_id
+        test.status = ASSIGNED_STATUS
+    assigned = [tests[test_id] for _, test_id, _ in rows]
+    # Every test gets the same status and one of few assignees, so one
+    # UPDATE per technician beats bulk_update()'s per-row CASE.
+    by_technician = defaultdict(list)
+    for test in assigned:
+        by_technician[test.assigned_to_id].append(test.id)
+    for technician_id, test_ids in by_technician.items():
+        Test.objects.filter(id__in=test_ids).update(assigned_to_id=technician_id, status=ASSIGNED_STATUS)
+
+    sample_ids = sorted({sample_id for sample_id, _, _ in rows})
+    before = list(Sample.objects.select_for_update().filter(id__in=sample_ids).only('id', 'status', 'registrar_id'))
+    Sample.objects.filter(id__in=sample_ids).exclude(status=ASSIGNED_STATUS).update(status=ASSIGNED_STATUS)
+    after = [Sample(id=sample.id, status=ASSIGNED_STATUS, registrar_id=sample.registrar_id) for sample in before]
+    samples = {sample.id: sample for sample in after}
+
+    counters.apply(
+        counters.moved(counters.TEST, test_changes),
+        counters.moved(counters.SAMPLE, [(sample.status, ASSIGNED_STATUS, '') for sample in before]),
+    )
+    progress.record(
+        (test.sample_id, old_status, ASSIGNED_STATUS) for test, (old_status, _, _) in zip(assigned, test_changes)
+    )
+    queues.touch_technicians(*previous_assignees, *{test.assigned_to_id for test in assigned})
+    # Old and new copies together cover every queue a sample left or entered.
+    queues.touch_samples(*before, *after, dg=left_dg_review)
+    events.record_many(
+        events.build(events.TEST_ASSIGNED, samples[test.sample_id], test, old_status, ASSIGNED_STATUS, actor,
+                     department)
+        for test, (old_status, _, department) in zip(assigned, test_changes)
+    )
+
+    per_technician = {technician_id: len(test_ids) for technician_id, test_ids in by_technician.items()}
+    return {'assigned': len(assigned), 'samples': sample_ids, 'technicians': per_technician}
@@ -0,0 +1,211 @@
+# myapp/authentication.py
+"""
+JWT authentication without a per-request User query.
+
+Tokens issued through ``LabRefreshToken`` carry the fields views actually
+read (``username``, ``role``, ``specialization``, ``department``) and a
+version stamp of them. ``ClaimsJWTAuthentication`` builds ``request.user``
+from those claims as a User instance whose other fields are deferred, so
+FK assignments and filters work and anything else (``email``, ...) is
+loaded on first access.
+
+Each worker keeps the current stamp of the users it has seen. User
+save/delete bumps the ``users`` watermark (see myapp/signals.py) and the
+watermark is re-checked at most every ``AUTH_USER_CACHE_SECONDS``, so a
+role change or deactivation reaches every worker within that window; a
+token whose stamp no longer matches is served from the current row.
+``LabTokenRefreshSerializer`` re-stamps the claims from the current row,
+so a refreshed token carries the new values again. Bulk ``update()`` on
+User bypasses the signals; call ``invalidate()`` after it. Tokens without
+a stamp (issued before this module) fall back to simplejwt's database
+lookup.
+
+``EmailBackend`` lets ``authenticate(email=..., password=...)`` resolve
+the user with a single query.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import watermarks
+from .models import User
+
+USERS_KEY = 'users'
+VERSION_CLAIM = 'ver'
+CACHE_SECONDS = getattr(settings, 'AUTH_USER_CACHE_SECONDS', 5)
+CACHE_MAX_USERS = getattr(settings, 'AUTH_USER_CACHE_MAX_USERS', 10000)
+
+# Fields carried in the token (claim name, User attname) and the ones the
+# stamp covers; saves touching none of them leave tokens valid.
+CLAIMS = (
+    ('username', 'username'),
+    ('role', 'role'),
+    ('specialization', 'specialization'),
+    ('department', 'department_id'),
+)
+STAMP_FIELDS = ('username', 'role', 'specialization', 'department', 'is_active')
+ROW_FIELDS = ('id', 'username', 'role', 'specialization', 'department_id', 'is_active')
+
+_lock = threading.Lock()
+_users = {}
+_version = None
+_checked_at = float('-inf')
+
+
+def stamp(row):
+    """Version stamp of a user's claim fields, from a ROW_FIELDS dict."""
+    raw = '\x1f'.join(str(row[field]) for field in ROW_FIELDS)
+    return hashlib.blake2s(raw.encode(), digest_size=8).hexdigest()
+
+
+def _row(user):
+    return {field: getattr(user, field) for field in ROW_FIELDS}
+
+
+def _set_claims(token, row):
+    for claim, attname in CLAIMS:
+        token[claim] = row[attname]
+    token[VERSION_CLAIM] = stamp(row)
+
+
+class LabRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's claims and stamp."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        _set_claims(token, _row(user))
+        return token
+
+
+class LabTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = LabRefreshToken
+
+
+def current_user(user_id):
+    """
+    The current ROW_FIELDS of ``user_id`` plus its stamp, or None if the
+    user does not exist. Served from the worker's cache while the ``users``
+    watermark is unchanged.
+    """
+    global _version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at >= CACHE_SECONDS:
+        version = watermarks.current(USERS_KEY)
+        with _lock:
+            if version != _version:
+                _users.clear()
+                _version = version
+            _checked_at = now
+
+    row = _users.get(user_id)
+    if row is None:
+        row = User.objects.filter(id=user_id).values(*ROW_FIELDS).first()
+        if row is None:
+            return None
+        row[VERSION_CLAIM] = stamp(row)
+        with _lock:
+            if len(_users) >= CACHE_MAX_USERS:
+                _users.clear()
+            _users[user_id] = row
+    return row
+
+
+class LabTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh that re-stamps the claims from the user's current row, so a
+    role change since login reaches the new access (and rotated refresh)
+    token instead of being copied from the old one.
+    """
+    token_class = LabRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        if VERSION_CLAIM not in access:
+            return data
+
+        row = current_user(int(access[api_settings.USER_ID_CLAIM]))
+        if row is None or not row['is_active']:
+            raise AuthenticationFailed(
+                self.error_messages['no_active_account'], 'no_active_account',
+            )
+        _set_claims(access, row)
+        data['access'] = str(access)
+        if 'refresh' in data:
+            refresh = LabRefreshToken(data['refresh'])
+            _set_claims(refresh, row)
+            data['refresh'] = str(refresh)
+        return data
+
+
+def invalidate(user_id=None):
+    """Mark a user (or all users) as changed, for this worker and all others."""
+    watermarks.bump(USERS_KEY)
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(user_id, None)
+
+
+def build_user(values):
+    """A User with ``values`` ({attname: value}) loaded and every other field deferred."""
+    # from_db() expects the loaded values in concrete field order.
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(router.db_for_read(User), names, [values[name] for name in names])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise AuthenticationFailed(_("Token contained no recognizable user identification"))
+
+        row = current_user(user_id)
+        if row is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not row['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if validated_token[VERSION_CLAIM] == row[VERSION_CLAIM]:
+            values = {attname: validated_token.get(claim) for claim, attname in CLAIMS}
+            values.update(id=user_id, is_active=True)
+        else:
+            # Stale claims (role changed since the token was issued).
+            values = {field: row[field] for field in ROW_FIELDS}
+        return build_user(values)
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticate by email (case-insensitive) in one lookup. Like
+    ModelBackend, a miss still runs the password hasher once, so response
+    times do not reveal which emails have accounts.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        users = list(User._default_manager.filter(email__iexact=email)[:2])
+        if len(users) != 1:
+            # Unknown, or ambiguous: never guess which account is meant.
+            User().set_password(password)
+            return None
+        user = users[0]
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,81 @@
+# myapp/bookkeeping.py
+"""
+Write-behind for the rows every workflow transaction shares: the Sample
+progress columns, the StatusCounter rows and the ChangeWatermark rows.
+
+A transaction body locks its own Test and Sample rows as it goes; the
+shared rows are then written once, at the end of the block, always in the
+same order:
+
+1. Sample progress columns, by sample id,
+2. status counters, by (entity, status, department),
+3. watermarks, by key.
+
+Two workflow transactions therefore take their shared locks in one global
+order and cannot deadlock on them, however their bodies interleave the
+calls. Run workflow writes in ``atomic()`` (a ``transaction.atomic()`` that
+also opens the collection); ``counters.apply()``, ``progress.record()`` and
+``watermarks.bump()`` collect into the innermost open block and write
+immediately outside one. A nested ``atomic()`` that is rolled back drops
+what it collected, like the savepoint it wraps.
+
+Values collected in a block are not visible to queries made inside it: read
+the progress columns under the row lock *before* recording a change (see
+``transitions.submit_results()``).
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import transaction
+
+PROGRESS = 'progress'
+COUNTERS = 'counters'
+WATERMARKS = 'watermarks'
+ORDER = (PROGRESS, COUNTERS, WATERMARKS)
+
+_state = threading.local()
+_writers = {}
+
+
+def writer(kind):
+    """Register the function that writes the collected changes of ``kind``."""
+    def register(function):
+        _writers[kind] = function
+        return function
+    return register
+
+
+def collect(kind, changes):
+    """
+    Add ``changes`` (a Counter) to the innermost open block and return
+    True, or return False if no block is open and the caller should write.
+    """
+    stack = getattr(_state, 'stack', None)
+    if not stack:
+        return False
+    stack[-1].setdefault(kind, Counter()).update(changes)
+    return True
+
+
+@contextmanager
+def atomic():
+    """``transaction.atomic()`` whose shared-row writes happen once, at the end, in ORDER."""
+    stack = getattr(_state, 'stack', None)
+    if stack is None:
+        stack = _state.stack = []
+    with transaction.atomic():
+        stack.append({})
+        try:
+            yield
+            pending = stack.pop()
+        except BaseException:
+            stack.pop()
+            raise
+        if stack:
+            for kind, changes in pending.items():
+                stack[-1].setdefault(kind, Counter()).update(changes)
+            return
+        for kind in ORDER:
+            if pending.get(kind):
+                _writers[kind](pending[kind])
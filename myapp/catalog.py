@@ -0,0 +1,83 @@
+# myapp/catalog.py
+"""
+Process-local cache of the Ingredient catalog.
+
+The catalog is small and rarely changes, so each worker keeps a copy and
+only checks the ``ingredient-catalog`` watermark once per request (one
+single-row lookup). Ingredient save/delete bumps the watermark (see
+myapp/signals.py), so every worker reloads on its next request after a
+price change. Bulk ``update()``/``delete()`` on Ingredient bypass the
+signals; call ``invalidate()`` after them.
+"""
+import threading
+
+from django.core.signals import request_started
+
+from . import watermarks
+from .models import Ingredient
+
+CATALOG_KEY = 'ingredient-catalog'
+
+_lock = threading.Lock()
+_cached = None
+_request_state = threading.local()
+
+
+class Catalog:
+    def __init__(self, version, ingredients):
+        from .serializers import IngredientSerializer
+
+        self.version = version
+        self.ingredients = {ingredient.id: ingredient for ingredient in ingredients}
+        self.listing = IngredientSerializer(ingredients, many=True).data
+        self.serialized = {item['id']: item for item in self.listing}
+
+    def get(self, ingredient_id):
+        return self.ingredients.get(ingredient_id)
+
+    def price(self, ingredient_id):
+        return self.ingredients[ingredient_id].price
+
+    def test_type(self, ingredient_id):
+        ingredient = self.ingredients.get(ingredient_id)
+        return ingredient.test_type if ingredient else ''
+
+
+def get_catalog():
+    """
+    The current catalog. The watermark is checked at most once per request
+    (and on every call outside the request cycle).
+    """
+    global _cached
+    catalog = _cached
+    if catalog is not None and getattr(_request_state, 'checked', False):
+        return catalog
+
+    version = watermarks.current(CATALOG_KEY)
+    if catalog is None or catalog.version != version:
+        with _lock:
+            catalog = _cached
+            if catalog is None or catalog.version != version:
+                catalog = Catalog(version, list(Ingredient.objects.order_by('id')))
+                _cached = catalog
+    _request_state.checked = _in_request()
+    return catalog
+
+
+def invalidate():
+    """Mark the catalog as changed, for this worker and all others."""
+    global _cached
+    watermarks.bump(CATALOG_KEY)
+    _cached = None
+
+
+def _in_request():
+    return getattr(_request_state, 'in_request', False)
+
+
+def _start_request(**kwargs):
+    _request_state.in_request = True
+    _request_state.checked = False
+
+
+request_started.connect(_start_request, dispatch_uid='myapp.catalog.request_started')
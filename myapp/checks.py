@@ -0,0 +1,34 @@
+# myapp/checks.py
+"""
+System checks that need the database (``manage.py check --database default``;
+``migrate`` runs them too).
+"""
+from django.core import checks
+from django.db import DatabaseError, connections
+
+
+@checks.register(checks.Tags.database)
+def check_department_names(app_configs, databases=None, **kwargs):
+    """
+    HOD scoping matches ``Ingredient.test_type`` against the department's
+    name, so a department named anything else gives its HOD an empty view.
+    """
+    from .models import Department, Ingredient
+
+    test_types = [value for value, _ in Ingredient.TEST_TYPE_CHOICES]
+    errors = []
+    for alias in databases or ():
+        if Department._meta.db_table not in connections[alias].introspection.table_names():
+            continue  # not migrated yet
+        try:
+            mismatched = list(Department.objects.using(alias).exclude(name__in=test_types).values_list('name', flat=True))
+        except DatabaseError:
+            continue
+        for name in mismatched:
+            errors.append(checks.Error(
+                f"Department {name!r} matches no Ingredient.test_type, so its HOD sees no tests.",
+                hint=f"Rename it to one of: {', '.join(test_types)}.",
+                obj=Department,
+                id='myapp.E001',
+            ))
+    return errors
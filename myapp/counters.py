@@ -0,0 +1,134 @@
+# myapp/counters.py
+"""
+Maintenance of the StatusCounter table.
+
+Every place that creates, deletes or moves a Sample/Test between statuses
+calls one of the helpers below inside the same transaction, so the
+counters always agree with the rows they describe. The
+``rebuild_status_counters`` command recomputes them if they ever drift
+(e.g. after edits through the Django admin).
+
+All writes go through ``apply()``. Inside ``bookkeeping.atomic()`` the
+deltas are collected and written at the end of the transaction, after the
+Sample progress columns and before the watermarks (see myapp/bookkeeping.py
+for why that order matters); the rows are updated in (entity, status,
+department) order.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from . import bookkeeping
+from .catalog import get_catalog
+from .models import StatusCounter
+
+SAMPLE = 'sample'
+TEST = 'test'
+
+
+def test_department(test):
+    """Counters group tests by the test type of their ingredient."""
+    return get_catalog().test_type(test.ingredient_id)
+
+
+def apply(*deltas):
+    """
+    Add ``deltas`` ({(entity, status, department): n} each) to the
+    counters. Must run inside the transaction that made the change.
+    """
+    merged = Counter()
+    for changes in deltas:
+        merged.update(changes)
+    if not bookkeeping.collect(bookkeeping.COUNTERS, merged):
+        _write(merged)
+
+
+@bookkeeping.writer(bookkeeping.COUNTERS)
+def _write(deltas):
+    for (entity, status, department), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        key = {'entity': entity, 'status': status, 'department': department or ''}
+        if StatusCounter.objects.filter(**key).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                StatusCounter.objects.create(count=delta, **key)
+        except IntegrityError:
+            # Another transaction created the row first.
+            StatusCounter.objects.filter(**key).update(count=F('count') + delta)
+
+
+def created(entity, rows):
+    """Deltas for new rows; ``rows`` is an iterable of (status, department)."""
+    return Counter((entity, status, department or '') for status, department in rows)
+
+
+def deleted(entity, rows):
+    """Deltas for deleted rows; ``rows`` is an iterable of (status, department)."""
+    deltas = Counter()
+    for status, department in rows:
+        deltas[(entity, status, department or '')] -= 1
+    return deltas
+
+
+def moved(entity, changes):
+    """Deltas for ``changes``, an iterable of (old_status, new_status, department)."""
+    deltas = Counter()
+    for old_status, new_status, department in changes:
+        if old_status == new_status:
+            continue
+        deltas[(entity, old_status, department or '')] -= 1
+        deltas[(entity, new_status, department or '')] += 1
+    return deltas
+
+
+def record_created(entity, rows):
+    apply(created(entity, rows))
+
+
+def record_deleted(entity, rows):
+    apply(deleted(entity, rows))
+
+
+def record_transitions(entity, changes):
+    apply(moved(entity, changes))
+
+
+def record_transition(entity, old_status, new_status, department=''):
+    record_transitions(entity, [(old_status, new_status, department)])
+
+
+def totals():
+    """Total number of samples and tests, read from the counters."""
+    rows = (
+        StatusCounter.objects.values('entity')
+        .annotate(total=Sum('count'))
+        .values_list('entity', 'total')
+    )
+    result = {SAMPLE: 0, TEST: 0}
+    result.update(rows)
+    return result
+
+
+def facets(entity=None, department=None):
+    """
+    Per-status counts: ``{'samples': {status: n}, 'tests': {status: {department: n}}}``.
+    Reads only the counter table, whose size does not depend on the amount
+    of lab history.
+    """
+    counters = StatusCounter.objects.filter(count__gt=0)
+    if entity:
+        counters = counters.filter(entity=entity)
+    if department is not None:
+        counters = counters.filter(department=department)
+
+    result = {'samples': {}, 'tests': {}}
+    for row in counters.values('entity', 'status', 'department', 'count'):
+        if row['entity'] == SAMPLE:
+            result['samples'][row['status']] = result['samples'].get(row['status'], 0) + row['count']
+        else:
+            by_department = result['tests'].setdefault(row['status'], {})
+            by_department[row['department']] = row['count']
+    return result
@@ -0,0 +1,220 @@
+# myapp/events.py
+"""
+Workflow change feed.
+
+Every status transition appends WorkflowEvent rows in the transaction that
+makes it. Clients read the deltas from /api/events/?since=<cursor> (JSON,
+optionally long-polled, or Server-Sent Events) instead of re-downloading
+whole dashboards.
+
+The cursor is the event id. Ids are handed out when a row is inserted,
+not when its transaction commits, so an event can become visible after
+one with a higher id. Writers take no shared lock for this; instead a
+reader only moves past an id once every id below it is visible, or the
+missing ones (rolled back, or still in flight) are older than
+``EVENTS_SETTLE_SECONDS``. A transaction that holds its events
+uncommitted for longer than that may be skipped by readers already past
+them, so transitions keep their transactions short. Waiting readers poll
+the newest id, a primary-key lookup.
+
+Long-polls and streams keep their worker busy for up to
+EVENTS_MAX_WAIT_SECONDS / EVENTS_STREAM_SECONDS, which would quickly use
+up a pool of synchronous workers. They are only served by threaded or
+async workers (``wsgi.multithread`` set, e.g. gunicorn ``--threads``,
+or ASGI); set ``EVENTS_BLOCKING_WORKERS = True`` for gevent/eventlet
+workers. Elsewhere ``?wait`` is ignored and streams are refused with 503.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .catalog import get_catalog
+from .models import User, WorkflowEvent
+
+BATCH_SIZE = getattr(settings, 'EVENTS_BATCH_SIZE', 200)
+POLL_SECONDS = getattr(settings, 'EVENTS_POLL_SECONDS', 1.0)
+MAX_WAIT_SECONDS = getattr(settings, 'EVENTS_MAX_WAIT_SECONDS', 25)
+# An SSE response ends after this long; EventSource reconnects with
+# Last-Event-ID, which keeps workers from being pinned forever.
+STREAM_SECONDS = getattr(settings, 'EVENTS_STREAM_SECONDS', 55)
+KEEPALIVE_SECONDS = 15
+SETTLE_SECONDS = getattr(settings, 'EVENTS_SETTLE_SECONDS', 10)
+# How many ids past the cursor one read checks for gaps.
+SETTLE_SCAN = 10 * BATCH_SIZE
+# None: decide from wsgi.multithread.
+BLOCKING_WORKERS = getattr(settings, 'EVENTS_BLOCKING_WORKERS', None)
+
+SAMPLE_SUBMITTED = 'sample.submitted'              # customer intake, unclaimed
+SAMPLE_REGISTERED = 'sample.registered'            # registrar intake, straight to HOD
+SAMPLE_CLAIMED = 'sample.claimed'
+SAMPLE_SUBMITTED_TO_HOD = 'sample.submitted_to_hod'
+SAMPLE_RESULTS_READY = 'sample.results_ready'      # every test has a result
+SAMPLE_SUBMITTED_TO_DIRECTOR = 'sample.submitted_to_director'
+SAMPLE_RETURNED_TO_HOD = 'sample.returned_to_hod'      # the Director rejected some of its tests
+TEST_ASSIGNED = 'test.assigned'
+TEST_RESULT_SUBMITTED = 'test.result_submitted'
+TEST_REJECTED = 'test.rejected'
+TEST_ACCEPTED = 'test.accepted'                    # HOD accepted, now awaiting DG
+TEST_APPROVED = 'test.approved'
+
+# Event kinds each role follows. Registrars additionally get every event of
+# their own samples, technicians only the events of tests assigned to them.
+ROLE_KINDS = {
+    'Registrar': (SAMPLE_SUBMITTED, SAMPLE_CLAIMED),
+    'HOD': (
+        SAMPLE_REGISTERED, SAMPLE_SUBMITTED_TO_HOD, SAMPLE_RESULTS_READY, SAMPLE_SUBMITTED_TO_DIRECTOR,
+        SAMPLE_RETURNED_TO_HOD, TEST_ASSIGNED, TEST_RESULT_SUBMITTED, TEST_REJECTED, TEST_ACCEPTED, TEST_APPROVED,
+    ),
+    'Director': (SAMPLE_SUBMITTED_TO_DIRECTOR, TEST_ACCEPTED, TEST_APPROVED),
+}
+ROLE_KINDS['HODv'] = ROLE_KINDS['HOD']
+for role in User.DIRECTOR_ROLES:
+    ROLE_KINDS[role] = ROLE_KINDS['Director']
+
+
+def build(kind, sample, test=None, from_status='', to_status='', actor=None, department=None):
+    """
+    An unsaved event for a transition of ``sample`` (or of ``test`` in it).
+    Batch callers that already know the test's department pass it to skip
+    the catalog lookup.
+    """
+    if department is None:
+        department = get_catalog().test_type(test.ingredient_id) if test else ''
+    return WorkflowEvent(
+        kind=kind,
+        sample_id=sample.id,
+        test_id=test.id if test else None,
+        from_status=from_status or '',
+        to_status=to_status or '',
+        department=department,
+        registrar_id=sample.registrar_id,
+        assignee_id=test.assigned_to_id if test else None,
+        actor_id=actor.id if actor is not None and actor.is_authenticated else None,
+    )
+
+
+def record_many(events):
+    """Append ``events``; call inside the transaction making the change."""
+    events = list(events)
+    if not events:
+        return []
+    return WorkflowEvent.objects.bulk_create(events)
+
+
+def record(kind, sample, test=None, from_status='', to_status='', actor=None):
+    return record_many([build(kind, sample, test, from_status, to_status, actor)])[0]
+
+
+def latest_id():
+    return WorkflowEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def visible_to(user, department=None):
+    """Events ``user`` may follow, optionally limited to one test type."""
+    events = WorkflowEvent.objects.all()
+    if user.role == 'Technician':
+        events = events.filter(assignee_id=user.id)
+    elif user.role == 'Registrar':
+        events = events.filter(Q(kind__in=ROLE_KINDS['Registrar']) | Q(registrar_id=user.id))
+    elif user.role in ROLE_KINDS:
+        events = events.filter(kind__in=ROLE_KINDS[user.role])
+    elif user.role != 'Admin':
+        return events.none()
+    if department:
+        # Sample-level events have no department and concern everyone.
+        events = events.filter(department__in=[department, ''])
+    return events
+
+
+def blocking_allowed(request):
+    """Whether this worker may hold ``request`` open to wait for events."""
+    if BLOCKING_WORKERS is not None:
+        return BLOCKING_WORKERS
+    return bool(request.META.get('wsgi.multithread'))
+
+
+def settled_through(since):
+    """
+    The highest id H such that no event in (since, H] can still appear:
+    every id up to H is visible or missing for longer than SETTLE_SECONDS.
+    """
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    horizon = since
+    rows = WorkflowEvent.objects.filter(id__gt=since).order_by('id').values_list('id', 'created_at')
+    for event_id, created_at in rows[:SETTLE_SCAN]:
+        if event_id != horizon + 1 and created_at > cutoff:
+            break  # a lower id may still commit
+        horizon = event_id
+    return horizon
+
+
+def read(events, since, limit):
+    """
+    Up to ``limit`` settled events after cursor ``since``, oldest first, and
+    the cursor to continue from.
+    """
+    horizon = settled_through(since)
+    batch = list(events.filter(id__gt=since, id__lte=horizon).order_by('id')[:limit])
+    cursor = batch[-1].id if len(batch) == limit else horizon
+    return batch, cursor
+
+
+def current_cursor():
+    """Cursor for a new reader: the settled end of the feed."""
+    return settled_through(max(latest_id() - SETTLE_SCAN, 0))
+
+
+def wait_for(events, since, wait_seconds):
+    """
+    Long-poll: events after ``since`` and the cursor to continue from,
+    waiting up to ``wait_seconds`` for the first one. While idle it only
+    re-reads the newest event id.
+    """
+    deadline = time.monotonic() + min(wait_seconds, MAX_WAIT_SECONDS)
+    batch, cursor = read(events, since, BATCH_SIZE)
+    while not batch and time.monotonic() < deadline:
+        if cursor == since:
+            time.sleep(POLL_SECONDS)
+            if latest_id() <= cursor:
+                continue
+        since = cursor
+        batch, cursor = read(events, since, BATCH_SIZE)
+    return batch, cursor, len(batch) == BATCH_SIZE
+
+
+def stream(events, since):
+    """Server-Sent Events after ``since`` for STREAM_SECONDS."""
+    yield 'retry: 2000\n\n'
+    deadline = time.monotonic() + STREAM_SECONDS
+    last_write = time.monotonic()
+    while time.monotonic() < deadline:
+        if latest_id() > since:
+            batch, cursor = read(events, since, BATCH_SIZE)
+            for event in batch:
+                yield f'id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(serialize(event))}\n\n'
+            if batch:
+                last_write = time.monotonic()
+            if cursor != since:
+                since = cursor
+                continue
+        if time.monotonic() - last_write >= KEEPALIVE_SECONDS:
+            yield ': keepalive\n\n'
+            last_write = time.monotonic()
+        time.sleep(POLL_SECONDS)
+
+
+def serialize(event):
+    return {
+        'id': event.id,
+        'kind': event.kind,
+        'sample': event.sample_id,
+        'test': event.test_id,
+        'from': event.from_status,
+        'to': event.to_status,
+        'department': event.department,
+        'at': event.created_at.isoformat(),
+    }
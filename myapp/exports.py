@@ -0,0 +1,116 @@
+# myapp/exports.py
+"""
+Flat exports of samples with their tests, prices, results and customer.
+
+Rows are produced from a ``values()`` queryset read through
+``iterator(chunk_size=...)`` (a server-side cursor on PostgreSQL) and
+encoded one at a time, so memory use does not depend on the size of the
+export. Used by the export API and the ``export_samples`` command.
+"""
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Sample
+
+CHUNK_SIZE = 2000
+
+# (column name, queryset lookup); one row per sample/test pair, samples
+# without tests appear once with empty test columns.
+COLUMNS = [
+    ('sample_id', 'id'),
+    ('control_number', 'control_number'),
+    ('laboratory_number', 'laboratory_number'),
+    ('sample_name', 'sample_name'),
+    ('sample_status', 'status'),
+    ('date_received', 'date_received'),
+    ('customer_id', 'customer_id'),
+    ('customer_first_name', 'customer__first_name'),
+    ('customer_last_name', 'customer__last_name'),
+    ('customer_organization', 'customer__organization_name'),
+    ('customer_email', 'customer__email'),
+    ('amount_due', 'payment__amount_due'),
+    ('payment_status', 'payment__status'),
+    ('test_id', 'test_set__id'),
+    ('parameter', 'test_set__ingredient__name'),
+    ('test_type', 'test_set__ingredient__test_type'),
+    ('test_price', 'test_set__price'),
+    ('test_status', 'test_set__status'),
+    ('results', 'test_set__results'),
+    ('submitted_date', 'test_set__submitted_date'),
+    ('approved_date', 'test_set__approved_date'),
+]
+FORMATS = ('csv', 'ndjson')
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def export_queryset(date_from=None, date_to=None, statuses=None):
+    """
+    ``date_from``/``date_to`` are inclusive ISO dates on date_received;
+    ``statuses`` limits the sample status.
+    """
+    queryset = Sample.objects.all()
+    if date_from:
+        queryset = queryset.filter(date_received__gte=_day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(date_received__lt=_day_start(date_to) + timedelta(days=1))
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return queryset.order_by('date_received', 'id', 'test_set__id').values_list(
+        *[lookup for _, lookup in COLUMNS]
+    )
+
+
+def _day_start(value):
+    try:
+        day = parse_date(value) if isinstance(value, str) else value
+    except ValueError:
+        day = None
+    if not isinstance(day, date):
+        raise ExportFilterError(f"Invalid date: {value!r} (expected YYYY-MM-DD).")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _plain(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer."""
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in COLUMNS])
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow([_plain(value) for value in row])
+
+
+def stream_ndjson(queryset):
+    names = [name for name, _ in COLUMNS]
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        record = {
+            name: value if value is None or isinstance(value, (int, bool)) else _plain(value)
+            for name, value in zip(names, row)
+        }
+        yield json.dumps(record) + '\n'
+
+
+def stream(queryset, output_format):
+    if output_format == 'csv':
+        return stream_csv(queryset)
+    if output_format == 'ndjson':
+        return stream_ndjson(queryset)
+    raise ExportFilterError(f"Unknown format {output_format!r}; use one of {', '.join(FORMATS)}.")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import bookkeeping, scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign the unassigned tests of the HOD queue to technicians of the "
+        "matching specialization, least loaded first. Suitable for cron; "
+        "concurrent runs skip each other's tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--department', help='Only tests of this test type.')
+        parser.add_argument('--limit', type=int, help='At most this many tests per run.')
+        parser.add_argument('--split-samples', action='store_true',
+                            help="Balance test by test instead of keeping a sample's tests together.")
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without saving it.')
+
+    def handle(self, *args, **options):
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be positive.')
+        with bookkeeping.atomic():
+            summary = scheduler.auto_assign(
+                department=options['department'],
+                keep_samples_together=not options['split_samples'],
+                limit=options['limit'],
+                dry_run=options['dry_run'],
+            )
+        for technician_id, count in sorted(summary['technicians'].items()):
+            self.stdout.write(f"technician {technician_id}: {count} test(s)")
+        if summary['unassigned']:
+            self.stdout.write(f"{len(summary['unassigned'])} test(s) have no technician of their test type.")
+        verb = 'Would assign' if options['dry_run'] else 'Assigned'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['planned']} test(s) across {len(summary['samples'])} sample(s)."
+        ))
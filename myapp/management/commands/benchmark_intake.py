@@ -0,0 +1,65 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp.api_views import CustomerSubmitSampleAPIView
+from myapp.models import Ingredient, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Time CustomerSubmitSampleAPIView for submissions of different sizes. "
+        "Every run happens inside a transaction that is rolled back, so the "
+        "database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 50, 500],
+                            help='Samples per request.')
+        parser.add_argument('--parameters', type=int, default=5,
+                            help='Selected parameters per sample.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        view = CustomerSubmitSampleAPIView.as_view()
+        factory = APIRequestFactory()
+
+        self.stdout.write(f"{'samples':>8} {'queries':>8} {'best ms':>10} {'ms/sample':>10}")
+        for size in options['sizes']:
+            timings = []
+            for _ in range(options['repeat']):
+                with transaction.atomic():
+                    user = User.objects.create(username='benchmark-intake', role='Registrar')
+                    parameter_ids = [
+                        Ingredient.objects.create(
+                            name=f'benchmark-intake-{i}', price=Decimal('1500.00'),
+                            test_type='Chemistry' if i % 2 else 'Microbiology',
+                        ).id
+                        for i in range(options['parameters'])
+                    ]
+                    payload = {
+                        'customer': {'first_name': 'Bench', 'last_name': 'Mark',
+                                     'email': 'benchmark-intake@example.com'},
+                        'samples': [
+                            {'name': f'Sample {i}', 'sample_details': 'Benchmark',
+                             'selected_parameters': parameter_ids, 'marking_label_fee': 10000}
+                            for i in range(size)
+                        ],
+                    }
+                    request = factory.post('/api/customer/submit-sample/', payload, format='json')
+                    force_authenticate(request, user=user)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = view(request)
+                        timings.append(((time.perf_counter() - started) * 1000, len(queries)))
+                    if response.status_code != 201:
+                        self.stderr.write(f'unexpected response {response.status_code}: {response.data}')
+                    transaction.set_rollback(True)
+
+            best_ms, query_count = min(timings)
+            self.stdout.write(f'{size:>8} {query_count:>8} {best_ms:>10.1f} {best_ms / size:>10.2f}')
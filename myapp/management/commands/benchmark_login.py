@@ -0,0 +1,117 @@
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from myapp.api_views import login_api
+from myapp.models import User
+
+PASSWORD = 'benchmark-login-password'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login_api throughput while --attackers threads hammer one "
+        "account with wrong passwords and --users threads log in correctly, "
+        "once with the login throttles and once without. Each user and "
+        "attacker has its own client address. Meanwhile the attacked account's "
+        "owner keeps logging in correctly from their own address; 'victim ok' "
+        "is the share of those logins that succeed. The accounts the run "
+        "creates are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--users', type=int, default=2, help='Threads logging in correctly.')
+        parser.add_argument('--attackers', type=int, default=6, help='Threads guessing passwords.')
+
+    def handle(self, *args, **options):
+        run = random.randrange(1 << 30)
+        users = [
+            User.objects.create_user(username=f'benchmark-login-{run}-{i}', email=f'bl-{run}-{i}@example.com',
+                                     password=PASSWORD, role='Registrar')
+            for i in range(options['users'] + 1)
+        ]
+        victim, good = users[0], users[1:]
+        throttled = login_api
+        unthrottled = type('UnthrottledLogin', (login_api.cls,), {'throttle_classes': []}).as_view()
+
+        try:
+            self.stdout.write(f"{'mode':<12} {'good/s':>8} {'good p50 ms':>12} {'good p95 ms':>12} "
+                              f"{'attacks/s':>10} {'refused':>8} {'victim ok':>10}")
+            for mode, view in (('throttled', throttled), ('unthrottled', unthrottled)):
+                # Fresh client addresses per mode, so buckets do not carry over.
+                self._report(mode, *self._run(view, victim, good, options, f'10.{run % 250}.{len(mode)}'))
+        finally:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def _run(self, view, victim, good, options, network):
+        factory = APIRequestFactory()
+        deadline = time.perf_counter() + options['seconds']
+        good_timings = []
+        attack_statuses = Counter()
+        victim_statuses = Counter()
+        lock = threading.Lock()
+
+        def login(payload, address):
+            request = factory.post('/api/auth/login/', payload, format='json', REMOTE_ADDR=address)
+            started = time.perf_counter()
+            response = view(request)
+            return response.status_code, (time.perf_counter() - started) * 1000
+
+        def user_worker(index, user):
+            try:
+                while time.perf_counter() < deadline:
+                    status, ms = login({'email': user.email, 'password': PASSWORD}, f'{network}.{index + 1}')
+                    with lock:
+                        good_timings.append(ms if status == 200 else None)
+            finally:
+                connection.close()
+
+        def victim_worker():
+            try:
+                while time.perf_counter() < deadline:
+                    status, _ = login({'username': victim.username, 'password': PASSWORD}, f'{network}.250')
+                    with lock:
+                        victim_statuses[status] += 1
+            finally:
+                connection.close()
+
+        def attacker_worker(index):
+            try:
+                attempt = 0
+                while time.perf_counter() < deadline:
+                    attempt += 1
+                    payload = {'username': victim.username, 'password': f'guess-{attempt}'}
+                    status, _ = login(payload, f'{network}.{100 + index}')
+                    with lock:
+                        attack_statuses[status] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=user_worker, args=(i, user)) for i, user in enumerate(good)]
+        threads += [threading.Thread(target=attacker_worker, args=(i,)) for i in range(options['attackers'])]
+        threads.append(threading.Thread(target=victim_worker))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return options['seconds'], good_timings, attack_statuses, victim_statuses
+
+    def _report(self, mode, seconds, good_timings, attack_statuses, victim_statuses):
+        succeeded = sorted(ms for ms in good_timings if ms is not None)
+        if len(succeeded) != len(good_timings):
+            self.stderr.write(f'{mode}: {len(good_timings) - len(succeeded)} good logins failed')
+        p50 = statistics.median(succeeded) if succeeded else float('nan')
+        p95 = succeeded[int(len(succeeded) * 0.95)] if succeeded else float('nan')
+        attacks = sum(attack_statuses.values())
+        refused = attack_statuses[429] / attacks if attacks else 0
+        victim_attempts = sum(victim_statuses.values())
+        victim_ok = victim_statuses[200] / victim_attempts if victim_attempts else float('nan')
+        self.stdout.write(f'{mode:<12} {len(succeeded) / seconds:>8.1f} {p50:>12.1f} {p95:>12.1f} '
+                          f'{attacks / seconds:>10.1f} {refused:>8.0%} {victim_ok:>10.0%}')
@@ -0,0 +1,181 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from myapp import bookkeeping, counters, progress
+from myapp.models import Customer, Ingredient, Sample, Test, User
+
+# Indexes added for the role queues (migration 0028).
+QUEUE_INDEXES = {
+    Sample: [
+        'sample_unclaimed_idx',
+        'sample_registrar_recv_idx',
+        'sample_open_status_idx',
+        'sample_received_idx',
+        'sample_control_number_idx',
+    ],
+    Test: [
+        'test_assignee_status_idx',
+        'test_open_status_idx',
+        'test_submitted_idx',
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the query plans of the role-queue queries with and without the "
+        "workflow indexes. Optionally seeds a synthetic lab history first, "
+        "keeping the status counters and sample progress columns in step. "
+        "The plans without indexes come from dropping them in a transaction "
+        "that is rolled back; on PostgreSQL that holds an ACCESS EXCLUSIVE "
+        "lock on myapp_sample and myapp_test, so it only runs with DEBUG on "
+        "or with --i-know."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-tests', type=int, default=0,
+                            help='Number of synthetic tests to insert before explaining (e.g. 1000000).')
+        parser.add_argument('--tests-per-sample', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run EXPLAIN ANALYZE (PostgreSQL) and report timings.')
+        parser.add_argument('--i-know', action='store_true',
+                            help='Run without DEBUG, e.g. against a production copy.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['i_know']:
+            raise CommandError(
+                'This command drops indexes inside a transaction, which locks myapp_sample and myapp_test '
+                'against all reads and writes until it rolls back. Run it against a copy of the database '
+                'with DEBUG on, or pass --i-know.'
+            )
+        if options['seed_tests']:
+            self.seed(options['seed_tests'], options['tests_per_sample'], options['batch_size'])
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE myapp_sample, myapp_test')
+
+        registrar = User.objects.filter(role='Registrar').first()
+        technician = User.objects.filter(role='Technician').first()
+        sample = Sample.objects.exclude(control_number=None).first()
+
+        queries = {
+            'unclaimed_samples': Sample.objects.filter(
+                status='Awaiting Registrar Approval', registrar__isnull=True
+            ).order_by('-date_received', '-id')[:50],
+            'registrar_samples_api': Sample.objects.filter(
+                registrar=registrar
+            ).order_by('-date_received', '-id')[:50],
+            'hod_dashboard': Sample.objects.filter(
+                status__in=['Submitted to HOD', 'Awaiting HOD Review']
+            ).order_by('-date_received', '-id')[:50],
+            'technician_dashboard': Test.objects.filter(
+                assigned_to=technician, status__in=['Pending', 'In Progress']
+            ),
+            'dg_dashboard': Sample.objects.filter(
+                test_set__status='Awaiting DG Review'
+            ).distinct().order_by('-date_received', '-id')[:50],
+            'control_number lookup': Sample.objects.filter(
+                control_number=sample.control_number if sample else 'missing'
+            ),
+            'TestViewSet page': Test.objects.order_by('-submitted_date', '-id')[:50],
+        }
+
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        for label, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {label}'))
+            self.stdout.write('-- without queue indexes')
+            self.stdout.write(self.explain(queryset, explain_options, drop_indexes=True))
+            self.stdout.write('-- with queue indexes')
+            self.stdout.write(self.explain(queryset, explain_options, drop_indexes=False))
+
+    def explain(self, queryset, explain_options, drop_indexes):
+        """
+        EXPLAIN the queryset, optionally inside a transaction that drops the
+        queue indexes first and is rolled back afterwards (DDL is
+        transactional on PostgreSQL and SQLite).
+        """
+        with transaction.atomic():
+            if drop_indexes:
+                with connection.cursor() as cursor:
+                    if connection.vendor == 'postgresql':
+                        # Give up rather than queue behind (and block) live traffic.
+                        cursor.execute("SET LOCAL lock_timeout = '2s'")
+                    for names in QUEUE_INDEXES.values():
+                        for name in names:
+                            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+            started = time.perf_counter()
+            plan = queryset.explain(**explain_options)
+            elapsed = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(True)
+        return f'{plan}\n({elapsed:.1f} ms)\n'
+
+    def seed(self, total_tests, tests_per_sample, batch_size):
+        """
+        Bulk-insert a lab history where most work is already finished. Each
+        batch records its status counters and sample progress columns in
+        the same transaction, as the intake endpoints do.
+        """
+        customer, _ = Customer.objects.get_or_create(email='benchmark@example.com',
+                                                     defaults={'first_name': 'Benchmark'})
+        registrars = [
+            User.objects.get_or_create(username=f'bench-registrar-{i}',
+                                       defaults={'role': 'Registrar'})[0]
+            for i in range(20)
+        ]
+        technicians = [
+            User.objects.get_or_create(username=f'bench-technician-{i}',
+                                       defaults={'role': 'Technician', 'specialization': 'Chemistry'})[0]
+            for i in range(50)
+        ]
+        ingredient, _ = Ingredient.objects.get_or_create(
+            name='Benchmark parameter', defaults={'price': Decimal('1000.00'), 'test_type': 'Chemistry'}
+        )
+
+        total_samples = max(total_tests // tests_per_sample, 1)
+        sample_statuses = ['Completed'] * 90 + ['Sent to DPF'] * 6 + [
+            'Awaiting Registrar Approval', 'Awaiting HOD Review', 'Submitted to HOD', 'In Progress'
+        ]
+        test_statuses = ['Approved'] * 92 + ['Completed'] * 4 + [
+            'Pending', 'In Progress', 'Awaiting HOD Review', 'Awaiting DG Review'
+        ]
+        now = timezone.now()
+
+        created = 0
+        while created < total_samples:
+            size = min(batch_size // tests_per_sample or 1, total_samples - created)
+            with bookkeeping.atomic():
+                samples = Sample.objects.bulk_create([
+                    Sample(
+                        customer=customer,
+                        registrar=(None if status == 'Awaiting Registrar Approval'
+                                   else registrars[(created + i) % len(registrars)]),
+                        status=status,
+                        control_number=f'BENCH-{created + i}',
+                        sample_name='Benchmark sample',
+                    )
+                    for i in range(size)
+                    for status in [sample_statuses[(created + i) % len(sample_statuses)]]
+                ])
+                tests = Test.objects.bulk_create([
+                    Test(
+                        sample=sample,
+                        ingredient=ingredient,
+                        price=ingredient.price,
+                        assigned_to=technicians[(sample.pk + j) % len(technicians)],
+                        status=test_statuses[(sample.pk * tests_per_sample + j) % len(test_statuses)],
+                        submitted_date=now,
+                    )
+                    for sample in samples
+                    for j in range(tests_per_sample)
+                ])
+                counters.record_created(counters.SAMPLE, [(sample.status, '') for sample in samples])
+                counters.record_created(counters.TEST, [(test.status, ingredient.test_type) for test in tests])
+                progress.record((test.sample_id, None, test.status) for test in tests)
+            created += size
+            self.stdout.write(f'seeded {created * tests_per_sample} / {total_samples * tests_per_sample} tests')
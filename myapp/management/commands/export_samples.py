@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream every sample with its tests, prices, results and customer "
+        "as CSV or NDJSON to a file or stdout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=exports.FORMATS, default='csv')
+        parser.add_argument('--date-from', help='First day of date_received (YYYY-MM-DD).')
+        parser.add_argument('--date-to', help='Last day of date_received, inclusive (YYYY-MM-DD).')
+        parser.add_argument('--status', action='append', default=[],
+                            help='Sample status to include; may be repeated.')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout).')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = exports.export_queryset(
+                date_from=options['date_from'],
+                date_to=options['date_to'],
+                statuses=options['status'],
+            )
+        except exports.ExportFilterError as exc:
+            raise CommandError(str(exc))
+
+        path = options['output']
+        out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+        rows = 0
+        try:
+            for chunk in exports.stream(queryset, options['output_format']):
+                out.write(chunk)
+                rows += 1
+        finally:
+            if path:
+                out.close()
+        if path:
+            if options['output_format'] == 'csv':
+                rows -= 1  # header
+            self.stderr.write(f"wrote {rows} rows to {path}")
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myapp.models import WorkflowEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete workflow events older than --days in primary-key chunks. "
+        "Clients whose cursor is older than the retention window should "
+        "reload their dashboard and restart the feed from the current cursor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        while True:
+            ids = list(
+                WorkflowEvent.objects.filter(created_at__lt=cutoff)
+                .order_by('id').values_list('id', flat=True)[:options['chunk_size']]
+            )
+            if not ids:
+                break
+            deleted += WorkflowEvent.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} workflow events."))
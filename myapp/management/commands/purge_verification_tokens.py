@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myapp.models import VerificationToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired VerificationToken rows in primary-key chunks. New "
+        "verification and reset links are signed (myapp/tokens.py) and create "
+        "no rows; --all also deletes the unexpired ones, invalidating the "
+        "old-style links still in people's inboxes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Delete unexpired tokens too.')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        tokens = VerificationToken.objects.all()
+        if not options['all']:
+            tokens = tokens.filter(expires_at__lte=timezone.now())
+        deleted = 0
+        while True:
+            ids = list(tokens.order_by('id').values_list('id', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            deleted += VerificationToken.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} verification tokens."))
@@ -0,0 +1,66 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from myapp import counters, progress
+from myapp.models import Sample, StatusCounter, Test
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the StatusCounter table and the per-sample test progress "
+        "columns from the Sample and Test rows. "
+        "Rows are aggregated in primary-key chunks so no single query scans "
+        "the whole table; run it while the lab is quiet, since transitions "
+        "committed during the rebuild may be counted twice or not at all."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        sample_counts = self.count_in_chunks(
+            Sample.objects.all(), ['status'], chunk_size,
+            key=lambda row: (row['status'], ''),
+        )
+        test_counts = self.count_in_chunks(
+            Test.objects.all(), ['status', 'ingredient__test_type'], chunk_size,
+            key=lambda row: (row['status'], row['ingredient__test_type'] or ''),
+        )
+
+        with transaction.atomic():
+            StatusCounter.objects.all().delete()
+            StatusCounter.objects.bulk_create([
+                StatusCounter(entity=entity, status=status, department=department, count=count)
+                for entity, counts in ((counters.SAMPLE, sample_counts), (counters.TEST, test_counts))
+                for (status, department), count in counts.items()
+            ])
+
+        drifted = 0
+        last_id = Sample.objects.aggregate(last=Max('id'))['last'] or 0
+        for start in range(0, last_id + 1, chunk_size):
+            with transaction.atomic():
+                drifted += progress.rebuild(start, start + chunk_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt counters: {sum(sample_counts.values())} samples, "
+            f"{sum(test_counts.values())} tests; fixed the test progress of {drifted} samples."
+        ))
+
+    def count_in_chunks(self, queryset, fields, chunk_size, key):
+        totals = Counter()
+        last_id = queryset.aggregate(last=Max('id'))['last'] or 0
+        for start in range(0, last_id + 1, chunk_size):
+            chunk = (
+                queryset.filter(id__gte=start, id__lt=start + chunk_size)
+                .values(*fields)
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            for row in chunk:
+                totals[key(row)] += row['n']
+        return totals
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued outbox emails in batches over one connection per "
+        "batch. Runs once by default; use --loop to keep draining."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new messages.')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep when the outbox is empty (with --loop).')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = outbox.send_due(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"sent {sent}, failed {failed}")
+            if sent + failed >= options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from myapp import bookkeeping, counters, events, transitions
+from myapp.models import Customer, Sample, User, WorkflowEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Race --registrars threads claiming the same --samples unclaimed samples "
+        "and check that every sample ends up with exactly one winner. --naive "
+        "runs the old read-then-save claim instead, to show the double claims "
+        "the compare-and-set prevents (under PostgreSQL's READ COMMITTED; SQLite "
+        "serializes the whole read-then-save). Everything the run creates is "
+        "deleted afterwards. --claim-next N drains the samples through "
+        "claim-next batches of N instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=200)
+        parser.add_argument('--registrars', type=int, default=8)
+        parser.add_argument('--naive', action='store_true',
+                            help='Claim with get() + save() instead of a conditional UPDATE.')
+        parser.add_argument('--claim-next', type=int, metavar='N',
+                            help='Each registrar claims batches of N oldest samples until none are left.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError("Threads need a shared database; in-memory SQLite is per connection.")
+
+        if options['claim_next'] and Sample.objects.filter(status='Awaiting Registrar Approval').exists():
+            # claim-next takes the oldest unclaimed samples, whoever's they are.
+            raise CommandError("--claim-next needs a database without other unclaimed samples.")
+
+        registrars, customer, sample_ids = self._setup(options['registrars'], options['samples'])
+        batch = options['claim_next']
+        claim = self._naive_claim if options['naive'] else self._claim
+        wins = Counter()
+        retries = Counter()
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(registrars))
+
+        def attempt(call):
+            while True:
+                try:
+                    return call()
+                except OperationalError as exc:
+                    # SQLite has one writer at a time and gives up on some
+                    # waiting transactions; that is contention, not a lost race.
+                    if connection.vendor != 'sqlite' or 'locked' not in str(exc):
+                        raise
+                    with lock:
+                        retries['busy'] += 1
+
+        def worker(registrar):
+            try:
+                barrier.wait()
+                if batch:
+                    # Keep asking for the next batch until none are left.
+                    while claimed := attempt(lambda: self._claim_next(registrar, batch)):
+                        with lock:
+                            wins.update(claimed)
+                else:
+                    for sample_id in sample_ids:
+                        claimed = attempt(lambda: claim(sample_id, registrar))
+                        with lock:
+                            wins.update(claimed)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(registrar,)) for registrar in registrars]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            claim_events = Counter(
+                WorkflowEvent.objects.filter(sample_id__in=sample_ids, kind=events.SAMPLE_CLAIMED)
+                .values_list('sample_id', flat=True)
+            )
+            unclaimed = Sample.objects.filter(id__in=sample_ids, registrar__isnull=True).count()
+        finally:
+            self._cleanup(registrars, customer, sample_ids)
+
+        for exc in errors:
+            self.stderr.write(f'worker error: {exc!r}')
+        doubles = sum(1 for sample_id in sample_ids if wins[sample_id] > 1)
+        self.stdout.write(
+            f"{len(registrars)} registrars in {elapsed:.2f}s: {sum(wins.values())} reported wins, "
+            f"{doubles} samples claimed more than once, {unclaimed} left unclaimed, "
+            f"{sum(claim_events.values())} claim events, {retries['busy']} busy retries."
+        )
+        if doubles or unclaimed or errors or any(n != 1 for n in claim_events.values()):
+            raise CommandError("Claims were lost or duplicated.")
+        self.stdout.write(self.style.SUCCESS("Every sample was claimed exactly once."))
+
+    def _setup(self, registrar_count, sample_count):
+        with bookkeeping.atomic():
+            registrars = [
+                User.objects.create(username=f'stress-claims-{i}', role='Registrar')
+                for i in range(registrar_count)
+            ]
+            customer = Customer.objects.create(first_name='Stress', last_name='Claims',
+                                               email='stress-claims@example.com')
+            samples = Sample.objects.bulk_create([
+                Sample(customer=customer, sample_name=f'Stress {i}', status='Awaiting Registrar Approval')
+                for i in range(sample_count)
+            ])
+            counters.record_created(counters.SAMPLE, [(sample.status, '') for sample in samples])
+        return registrars, customer, [sample.id for sample in samples]
+
+    def _cleanup(self, registrars, customer, sample_ids):
+        with bookkeeping.atomic():
+            samples = Sample.objects.filter(id__in=sample_ids)
+            counters.record_deleted(counters.SAMPLE, [(status, '') for status in samples.values_list('status', flat=True)])
+            WorkflowEvent.objects.filter(sample_id__in=sample_ids).delete()
+            samples.delete()
+            customer.delete()
+            User.objects.filter(id__in=[registrar.id for registrar in registrars]).delete()
+
+    @staticmethod
+    def _claim(sample_id, registrar):
+        with bookkeeping.atomic():
+            sample = transitions.transition_sample(
+                sample_id, 'Awaiting Registrar Approval', 'Registrar Claimed',
+                kind=events.SAMPLE_CLAIMED, actor=registrar,
+                guards={'registrar__isnull': True}, registrar=registrar,
+            )
+        return [sample_id] if sample else []
+
+    @staticmethod
+    def _claim_next(registrar, batch):
+        with bookkeeping.atomic():
+            return [sample.id for sample in transitions.claim_next_samples(registrar, batch)]
+
+    @staticmethod
+    def _naive_claim(sample_id, registrar):
+        with bookkeeping.atomic():
+            sample = Sample.objects.get(id=sample_id)
+            if sample.status != 'Awaiting Registrar Approval' or sample.registrar_id is not None:
+                return []
+            time.sleep(0)  # yield, as a slower request would
+            sample.status = 'Registrar Claimed'
+            sample.registrar = registrar
+            sample.save()
+            counters.record_transition(counters.SAMPLE, 'Awaiting Registrar Approval', sample.status)
+            events.record(events.SAMPLE_CLAIMED, sample, from_status='Awaiting Registrar Approval',
+                          to_status=sample.status, actor=registrar)
+        return [sample_id]
@@ -0,0 +1,209 @@
+# myapp/metrics.py
+"""
+Per-request SQL and latency instrumentation.
+
+``RequestMetricsMiddleware`` measures every request: the number of SQL
+queries and the time spent in them (through ``connection.execute_wrapper``,
+so it works with DEBUG off), the time spent producing serializer ``.data``
+(which includes any queries the serializer triggers) and the total
+latency. The figures go into in-process histograms per view, which
+``/api/metrics`` serves in the Prometheus text format to Admin users and to
+scrapers holding ``METRICS_TOKEN``. With ``REQUEST_METRICS_SERVER_TIMING``
+set to ``'admin'`` (or ``'all'``) they are also sent back to Admin users
+(or everyone) in a ``Server-Timing`` header; the default is ``'off'``.
+
+Streaming responses (exports, the event stream) are measured until their
+body has been sent; they get no Server-Timing header, since the headers
+go out before the body is produced.
+
+Each worker process keeps its own histograms and labels them with its pid,
+so every series stays monotonic whichever worker a scrape reaches. The
+cost per request is a few clock reads, one dict update under a lock and a
+bisect per histogram.
+"""
+import bisect
+import os
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+from django.utils.crypto import constant_time_compare
+from rest_framework.serializers import BaseSerializer
+
+SERVER_TIMING = getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', 'off')
+TOKEN = getattr(settings, 'METRICS_TOKEN', '')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    'lab_request_duration_seconds': ('Total request latency.', SECONDS_BUCKETS),
+    'lab_request_db_seconds': ('Time spent executing SQL per request.', SECONDS_BUCKETS),
+    'lab_request_serializer_seconds': ('Time spent producing serializer data per request.', SECONDS_BUCKETS),
+    'lab_request_queries': ('SQL queries per request.', QUERY_BUCKETS),
+}
+
+_lock = threading.Lock()
+_state = threading.local()
+# (metric, view) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+_serializer_timer_installed = False
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serializer', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.serializing = False
+
+    def execute(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - started
+            self.queries += 1
+
+
+def observe(metric, view, value):
+    buckets = HISTOGRAMS[metric][1]
+    with _lock:
+        counts = _histograms.get((metric, view))
+        if counts is None:
+            counts = _histograms[(metric, view)] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+
+def render():
+    """All histograms in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = {key: list(counts) for key, counts in _histograms.items()}
+    by_metric = defaultdict(list)
+    for (metric, view), counts in sorted(snapshot.items()):
+        by_metric[metric].append((view, counts))
+
+    pid = os.getpid()
+    lines = []
+    for metric, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for view, counts in by_metric[metric]:
+            labels = f'view="{_escape(view)}",pid="{pid}"'
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{labels}}} {counts[-1]:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def scrape_allowed(request):
+    """Admin users, or a scraper sending ``Authorization: Token <METRICS_TOKEN>``."""
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if TOKEN and scheme == 'Token' and constant_time_compare(credentials.strip(), TOKEN):
+        return True
+    return request.user.is_authenticated and request.user.role == 'Admin'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _install_serializer_timer():
+    """Time the outermost serializer ``.data`` of each measured request."""
+    global _serializer_timer_installed
+    if _serializer_timer_installed:
+        return
+    original = BaseSerializer.data.fget
+
+    def data(self):
+        stats = getattr(_state, 'stats', None)
+        if stats is None or stats.serializing:
+            return original(self)
+        stats.serializing = True
+        started = perf_counter()
+        try:
+            return original(self)
+        finally:
+            stats.serializer += perf_counter() - started
+            stats.serializing = False
+
+    BaseSerializer.data = property(data)
+    _serializer_timer_installed = True
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+def _server_timing_allowed(request):
+    if SERVER_TIMING == 'all':
+        return True
+    if SERVER_TIMING != 'admin':
+        return False
+    # DRF views leave the token-authenticated user on the request.
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and getattr(user, 'role', None) == 'Admin'
+
+
+def _record(view, stats, total):
+    observe('lab_request_duration_seconds', view, total)
+    observe('lab_request_db_seconds', view, stats.db)
+    observe('lab_request_serializer_seconds', view, stats.serializer)
+    observe('lab_request_queries', view, stats.queries)
+
+
+def _measure_stream(content, stats, started, view):
+    """Keep measuring while the body of a streaming response is produced."""
+    try:
+        with connection.execute_wrapper(stats.execute):
+            _state.stats = stats
+            yield from content
+    finally:
+        _state.stats = None
+        _record(view, stats, perf_counter() - started)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_serializer_timer()
+
+    def __call__(self, request):
+        stats = _state.stats = RequestStats()
+        started = perf_counter()
+        try:
+            with connection.execute_wrapper(stats.execute):
+                response = self.get_response(request)
+        finally:
+            _state.stats = None
+
+        view = _view_name(request)
+        if response.streaming:
+            response.streaming_content = _measure_stream(response.streaming_content, stats, started, view)
+            return response
+
+        total = perf_counter() - started
+        _record(view, stats, total)
+        if _server_timing_allowed(request):
+            response['Server-Timing'] = (
+                f'db;dur={stats.db * 1000:.1f};desc="{stats.queries} queries", '
+                f'ser;dur={stats.serializer * 1000:.1f}, total;dur={total * 1000:.1f}'
+            )
+        return response
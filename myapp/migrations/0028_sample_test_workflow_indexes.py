@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0027_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(condition=models.Q(('registrar__isnull', True), ('status', 'Awaiting Registrar Approval')), fields=['date_received', 'id'], name='sample_unclaimed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['registrar', 'date_received', 'id'], name='sample_registrar_recv_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(condition=models.Q(('status__in', ('Registered', 'Awaiting Registrar Approval', 'Registrar Claimed', 'Awaiting HOD Review', 'Submitted to HOD', 'In Progress'))), fields=['status', 'date_received', 'id'], name='sample_open_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['date_received', 'id'], name='sample_received_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(fields=['control_number'], name='sample_control_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['assigned_to', 'status'], name='test_assignee_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(condition=models.Q(('status__in', ('Pending', 'In Progress', 'Awaiting HOD Review', 'Awaiting DG Review'))), fields=['status', 'sample'], name='test_open_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['submitted_date', 'id'], name='test_submitted_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counters(apps, schema_editor):
+    Sample = apps.get_model('myapp', 'Sample')
+    Test = apps.get_model('myapp', 'Test')
+    StatusCounter = apps.get_model('myapp', 'StatusCounter')
+
+    counters = [
+        StatusCounter(entity='sample', status=row['status'], department='', count=row['n'])
+        for row in Sample.objects.values('status').annotate(n=Count('id'))
+    ]
+    counters += [
+        StatusCounter(
+            entity='test', status=row['status'],
+            department=row['ingredient__test_type'] or '', count=row['n'],
+        )
+        for row in Test.objects.values('status', 'ingredient__test_type').annotate(n=Count('id'))
+    ]
+    StatusCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0028_sample_test_workflow_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('sample', 'Sample'), ('test', 'Test')], max_length=20)),
+                ('status', models.CharField(max_length=50)),
+                ('department', models.CharField(blank=True, default='', max_length=50)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entity', 'status', 'department'), name='unique_status_counter')],
+            },
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
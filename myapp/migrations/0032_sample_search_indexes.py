@@ -0,0 +1,75 @@
+from django.db import migrations
+
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX IF NOT EXISTS sample_search_document_idx ON myapp_sample
+    USING gin (to_tsvector('simple'::regconfig,
+        coalesce(sample_name, '') || ' ' || coalesce(sample_details, '')))
+    """,
+    "CREATE INDEX IF NOT EXISTS sample_control_number_trgm_idx ON myapp_sample USING gin (control_number gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS sample_laboratory_number_trgm_idx ON myapp_sample USING gin (laboratory_number gin_trgm_ops)",
+]
+POSTGRESQL_REVERSE = [
+    "DROP INDEX IF EXISTS sample_search_document_idx",
+    "DROP INDEX IF EXISTS sample_control_number_trgm_idx",
+    "DROP INDEX IF EXISTS sample_laboratory_number_trgm_idx",
+]
+
+SQLITE_COLUMNS = "sample_name, sample_details, control_number, laboratory_number"
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS myapp_sample_fts USING fts5(
+        {SQLITE_COLUMNS}, content='myapp_sample', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS myapp_sample_fts_ai AFTER INSERT ON myapp_sample BEGIN
+        INSERT INTO myapp_sample_fts(rowid, {SQLITE_COLUMNS})
+        VALUES (new.id, new.sample_name, new.sample_details, new.control_number, new.laboratory_number);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS myapp_sample_fts_ad AFTER DELETE ON myapp_sample BEGIN
+        INSERT INTO myapp_sample_fts(myapp_sample_fts, rowid, {SQLITE_COLUMNS})
+        VALUES ('delete', old.id, old.sample_name, old.sample_details, old.control_number, old.laboratory_number);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS myapp_sample_fts_au AFTER UPDATE ON myapp_sample BEGIN
+        INSERT INTO myapp_sample_fts(myapp_sample_fts, rowid, {SQLITE_COLUMNS})
+        VALUES ('delete', old.id, old.sample_name, old.sample_details, old.control_number, old.laboratory_number);
+        INSERT INTO myapp_sample_fts(rowid, {SQLITE_COLUMNS})
+        VALUES (new.id, new.sample_name, new.sample_details, new.control_number, new.laboratory_number);
+    END
+    """,
+    "INSERT INTO myapp_sample_fts(myapp_sample_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS myapp_sample_fts_ai",
+    "DROP TRIGGER IF EXISTS myapp_sample_fts_ad",
+    "DROP TRIGGER IF EXISTS myapp_sample_fts_au",
+    "DROP TABLE IF EXISTS myapp_sample_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0031_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRESQL_REVERSE, 'sqlite': SQLITE_REVERSE}),
+        ),
+    ]
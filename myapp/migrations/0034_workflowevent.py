@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0033_test_priority_work_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=50)),
+                ('sample_id', models.BigIntegerField()),
+                ('test_id', models.BigIntegerField(blank=True, null=True)),
+                ('from_status', models.CharField(blank=True, default='', max_length=50)),
+                ('to_status', models.CharField(blank=True, default='', max_length=50)),
+                ('department', models.CharField(blank=True, default='', max_length=50)),
+                ('registrar_id', models.BigIntegerField(blank=True, null=True)),
+                ('assignee_id', models.BigIntegerField(blank=True, null=True)),
+                ('actor_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'id'], name='event_kind_idx'), models.Index(fields=['registrar_id', 'id'], name='event_registrar_idx'), models.Index(fields=['assignee_id', 'id'], name='event_assignee_idx'), models.Index(fields=['created_at'], name='event_created_idx')],
+            },
+        ),
+    ]
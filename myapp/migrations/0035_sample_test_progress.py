@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:31
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+PROGRESS_STATUSES = {
+    'tests_open': ['Pending', 'In Progress'],
+    'tests_awaiting_hod': ['Awaiting HOD Review'],
+    'tests_awaiting_dg': ['Awaiting DG Review'],
+    'tests_approved': ['Approved', 'Completed'],
+}
+
+
+def populate_progress(apps, schema_editor):
+    Sample = apps.get_model('myapp', 'Sample')
+    Test = apps.get_model('myapp', 'Test')
+
+    def count(statuses=None):
+        tests = Test.objects.filter(sample=OuterRef('pk'))
+        if statuses:
+            tests = tests.filter(status__in=statuses)
+        return Coalesce(Subquery(tests.order_by().values('sample').annotate(n=Count('id')).values('n')), 0)
+
+    Sample.objects.update(
+        tests_total=count(),
+        **{field: count(statuses) for field, statuses in PROGRESS_STATUSES.items()},
+    )
+
+
+def install_search_triggers(apps, schema_editor):
+    """
+    Adding or removing columns makes SQLite rebuild myapp_sample, which
+    drops the full-text search triggers of 0032; put them back.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in import_module('myapp.migrations.0032_sample_search_indexes').SQLITE_FORWARD:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0034_workflowevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, install_search_triggers),
+        migrations.AddField(
+            model_name='sample',
+            name='tests_approved',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='tests_awaiting_dg',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='tests_awaiting_hod',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='tests_open',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sample',
+            name='tests_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='sample',
+            index=models.Index(condition=models.Q(('tests_awaiting_dg__gt', 0)), fields=['date_received', 'id'], name='sample_awaiting_dg_idx'),
+        ),
+        migrations.RunPython(populate_progress, migrations.RunPython.noop),
+        migrations.RunPython(install_search_triggers, migrations.RunPython.noop),
+    ]
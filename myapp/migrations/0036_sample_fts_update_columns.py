@@ -0,0 +1,40 @@
+from django.db import migrations
+
+SQLITE_COLUMNS = "sample_name, sample_details, control_number, laboratory_number"
+
+
+def _update_trigger(columns=None):
+    # Without a column list the trigger rewrites the trigram index on every
+    # status change and progress update, i.e. on almost every workflow write.
+    of_columns = f" OF {columns}" if columns else ""
+    return f"""
+    CREATE TRIGGER myapp_sample_fts_au AFTER UPDATE{of_columns} ON myapp_sample BEGIN
+        INSERT INTO myapp_sample_fts(myapp_sample_fts, rowid, {SQLITE_COLUMNS})
+        VALUES ('delete', old.id, old.sample_name, old.sample_details, old.control_number, old.laboratory_number);
+        INSERT INTO myapp_sample_fts(rowid, {SQLITE_COLUMNS})
+        VALUES (new.id, new.sample_name, new.sample_details, new.control_number, new.laboratory_number);
+    END
+    """
+
+
+SQLITE_FORWARD = ["DROP TRIGGER IF EXISTS myapp_sample_fts_au", _update_trigger(SQLITE_COLUMNS)]
+SQLITE_REVERSE = ["DROP TRIGGER IF EXISTS myapp_sample_fts_au", _update_trigger()]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0035_sample_test_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(SQLITE_FORWARD), _run(SQLITE_REVERSE)),
+    ]
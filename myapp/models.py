@@ -1,6 +1,7 @@
 from decimal import Decimal
 from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 import logging
@@ -20,6 +21,8 @@ class User(AbstractUser):
         ('Technician', 'Laboratory Technician'),
           ('Director', 'Director General'), 
     )
+    # 'Director' is the stored value; older accounts carry the label instead.
+    DIRECTOR_ROLES = ('Director', 'Director General')
 
     SPECIALIZATION_CHOICES = (
         ('Chemistry', 'Chemistry'),
@@ -51,6 +54,12 @@ class Department(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        # A HOD sees the tests whose Ingredient.test_type equals this name.
+        test_types = [value for value, _ in Ingredient.TEST_TYPE_CHOICES]
+        if self.name not in test_types:
+            raise ValidationError({'name': f"Department name must be one of the test types: {', '.join(test_types)}."})
+
 class Division(models.Model):
     name = models.CharField(max_length=100)
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
@@ -108,6 +117,20 @@ class Ingredient(models.Model):
 
 # myapp/models.py
 
+# Statuses a sample/test can still leave; finished rows stay out of the
+# partial indexes on the open queues.
+SAMPLE_OPEN_STATUSES = (
+    'Registered',
+    'Awaiting Registrar Approval',
+    'Registrar Claimed',
+    'Awaiting HOD Review',
+    'Submitted to HOD',
+    'In Progress',
+)
+TEST_OPEN_STATUSES = ('Pending', 'In Progress', 'Awaiting HOD Review', 'Awaiting DG Review')
+# Tests a technician can act on; rejected results go back to 'Pending'.
+TECHNICIAN_QUEUE_STATUSES = ('Pending', 'In Progress')
+
 
 class Sample(models.Model):
     STATUS_CHOICES = (
@@ -184,6 +207,40 @@ class Sample(models.Model):
         help_text="Detailed description of the sample."
     )
 
+    # 🔹 Test progress, kept in step with test_set by myapp/progress.py
+    tests_total = models.IntegerField(default=0, editable=False)
+    tests_open = models.IntegerField(default=0, editable=False)            # Pending / In Progress
+    tests_awaiting_hod = models.IntegerField(default=0, editable=False)
+    tests_awaiting_dg = models.IntegerField(default=0, editable=False)
+    tests_approved = models.IntegerField(default=0, editable=False)        # Approved / Completed
+
+    class Meta:
+        indexes = [
+            # unclaimed_samples / registrar_samples_api intake queue
+            models.Index(
+                fields=['date_received', 'id'],
+                condition=models.Q(status='Awaiting Registrar Approval', registrar__isnull=True),
+                name='sample_unclaimed_idx',
+            ),
+            # registrar_samples_api / registrar_dashboard "my samples"
+            models.Index(fields=['registrar', 'date_received', 'id'], name='sample_registrar_recv_idx'),
+            # hod_dashboard and the other open-status queues
+            models.Index(
+                fields=['status', 'date_received', 'id'],
+                condition=models.Q(status__in=SAMPLE_OPEN_STATUSES),
+                name='sample_open_status_idx',
+            ),
+            # SampleViewSet keyset pages
+            models.Index(fields=['date_received', 'id'], name='sample_received_idx'),
+            models.Index(fields=['control_number'], name='sample_control_number_idx'),
+            # dg_dashboard: samples with at least one test awaiting DG review
+            models.Index(
+                fields=['date_received', 'id'],
+                condition=models.Q(tests_awaiting_dg__gt=0),
+                name='sample_awaiting_dg_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.control_number or 'No Ctrl#'} - {self.sample_name or self.sample_details or 'Unnamed Sample'}"
 
@@ -199,6 +256,11 @@ class Test(models.Model):
         ('Completed', 'Completed'),
         ('Approved', 'Approved'),  # Added
     )
+    PRIORITY_CHOICES = (
+        (0, 'Normal'),
+        (1, 'High'),
+        (2, 'Urgent'),
+    )
     sample = models.ForeignKey(Sample, on_delete=models.CASCADE, related_name='test_set')
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, null=True, blank=True)
     assigned_to = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_tests')
@@ -208,6 +270,27 @@ class Test(models.Model):
     approved_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='approved_tests')
     approved_date = models.DateTimeField(null=True, blank=True)
     submitted_date = models.DateTimeField(null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=0)
+
+    class Meta:
+        indexes = [
+            # technician_dashboard
+            models.Index(fields=['assigned_to', 'status'], name='test_assignee_status_idx'),
+            # technician_queue: open work by priority, oldest first
+            models.Index(
+                fields=['assigned_to', '-priority', 'id'],
+                condition=models.Q(status__in=TECHNICIAN_QUEUE_STATUSES),
+                name='test_work_queue_idx',
+            ),
+            # dg_dashboard, hod_accept_result and the review queues
+            models.Index(
+                fields=['status', 'sample'],
+                condition=models.Q(status__in=TEST_OPEN_STATUSES),
+                name='test_open_status_idx',
+            ),
+            # TestViewSet keyset pages
+            models.Index(fields=['submitted_date', 'id'], name='test_submitted_idx'),
+        ]
 
     def __str__(self):
         ingredient_name = self.ingredient.name if self.ingredient else "N/A"
@@ -243,6 +326,83 @@ class Result(models.Model):
 
 
 
+class StatusCounter(models.Model):
+    """
+    Running number of samples/tests per status (and, for tests, per
+    department, i.e. the ingredient's test type). Maintained in the same
+    transaction as every status change; see myapp/counters.py.
+    """
+    ENTITY_CHOICES = (
+        ('sample', 'Sample'),
+        ('test', 'Test'),
+    )
+    entity = models.CharField(max_length=20, choices=ENTITY_CHOICES)
+    status = models.CharField(max_length=50)
+    department = models.CharField(max_length=50, blank=True, default='')
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity', 'status', 'department'],
+                name='unique_status_counter'
+            )
+        ]
+
+    def __str__(self):
+        department = f" / {self.department}" if self.department else ""
+        return f"{self.entity}: {self.status}{department} = {self.count}"
+
+
+class ChangeWatermark(models.Model):
+    """
+    Monotonic version number for a named piece of shared state (the
+    ingredient catalog, a role queue, ...). Writers bump it in the same
+    transaction as the change; readers compare it with what they cached.
+    See myapp/watermarks.py.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} @ {self.version}"
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be delivered. Views write rows in their own
+    transaction; the ``send_outbox`` command delivers them (myapp/outbox.py).
+    """
+    STATUS_CHOICES = (
+        ('Pending', 'Pending'),
+        ('Sent', 'Sent'),
+        ('Failed', 'Failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='Pending'),
+                name='outbox_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
 class VerificationToken(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     token = models.CharField(max_length=255, unique=True)
@@ -251,3 +411,33 @@ class VerificationToken(models.Model):
 
     def is_valid(self):
         return timezone.now() < self.expires_at
+
+
+class WorkflowEvent(models.Model):
+    """
+    Append-only record of a workflow transition, served as a change feed by
+    /api/events/ (see myapp/events.py). Plain ids instead of foreign keys so
+    the feed survives deletes and inserts never take locks on other rows.
+    """
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=50)
+    sample_id = models.BigIntegerField()
+    test_id = models.BigIntegerField(null=True, blank=True)
+    from_status = models.CharField(max_length=50, blank=True, default='')
+    to_status = models.CharField(max_length=50, blank=True, default='')
+    department = models.CharField(max_length=50, blank=True, default='')
+    registrar_id = models.BigIntegerField(null=True, blank=True)
+    assignee_id = models.BigIntegerField(null=True, blank=True)
+    actor_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'id'], name='event_kind_idx'),
+            models.Index(fields=['registrar_id', 'id'], name='event_registrar_idx'),
+            models.Index(fields=['assignee_id', 'id'], name='event_assignee_idx'),
+            models.Index(fields=['created_at'], name='event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} sample={self.sample_id} test={self.test_id}"
@@ -0,0 +1,139 @@
+# myapp/outbox.py
+"""
+Transactional email outbox.
+
+Request handlers call ``enqueue()`` instead of ``send_mail()``: the message
+is stored in the same transaction as the change that caused it, and the
+``send_outbox`` management command delivers it later over one reused
+connection of the configured EMAIL_BACKEND, retrying with exponential
+backoff.
+"""
+import logging
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+RETRY_BASE_SECONDS = getattr(settings, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+RETRY_MAX_SECONDS = getattr(settings, 'OUTBOX_RETRY_MAX_SECONDS', 6 * 60 * 60)
+# How long a claimed message stays invisible to other workers while it is
+# being sent; a crashed worker's messages become due again afterwards.
+CLAIM_SECONDS = getattr(settings, 'OUTBOX_CLAIM_SECONDS', 5 * 60)
+
+
+def enqueue(subject, message, from_email, recipient_list):
+    """Queue an email; same arguments as django.core.mail.send_mail."""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim_due(batch_size):
+    """
+    Lock up to ``batch_size`` due messages and push their next attempt into
+    the future so concurrent workers skip them; returns the claimed rows.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='Pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if messages:
+            OutboxEmail.objects.filter(id__in=[m.id for m in messages]).update(
+                next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+            )
+    return messages
+
+
+def deliver(messages, connection=None):
+    """
+    Send ``messages`` over a single backend connection and record the
+    outcome of each. Returns (sent, failed) counts. Never raises for a
+    delivery problem: if the connection cannot be opened (or reopened after
+    the server dropped it), every message not yet sent is recorded as a
+    failed attempt and retried with backoff.
+    """
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as exc:
+        _record_failures(messages, exc)
+        return 0, len(messages)
+    try:
+        for index, message in enumerate(messages):
+            email = EmailMessage(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email,
+                to=message.recipients,
+                connection=connection,
+            )
+            try:
+                email.send()
+            except Exception as exc:
+                failed += 1
+                _record_failure(message, exc)
+                if isinstance(exc, SMTPServerDisconnected):
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception as reconnect_exc:
+                        rest = messages[index + 1:]
+                        _record_failures(rest, reconnect_exc)
+                        failed += len(rest)
+                        break
+                continue
+            sent += 1
+            message.status = 'Sent'
+            message.sent_at = timezone.now()
+            message.attempts += 1
+            message.last_error = ''
+            message.save(update_fields=['status', 'sent_at', 'attempts', 'last_error'])
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _record_failures(messages, exc):
+    for message in messages:
+        _record_failure(message, exc)
+
+
+def _record_failure(message, exc):
+    message.attempts += 1
+    message.last_error = f"{type(exc).__name__}: {exc}"
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'Failed'
+        logger.error("Giving up on outbox email %s after %s attempts: %s",
+                     message.id, message.attempts, message.last_error)
+    else:
+        message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
+        logger.warning("Outbox email %s failed (attempt %s): %s",
+                       message.id, message.attempts, message.last_error)
+    message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_due(batch_size=100):
+    """Claim and deliver one batch of due messages."""
+    messages = claim_due(batch_size)
+    if not messages:
+        return 0, 0
+    return deliver(messages)
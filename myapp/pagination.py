@@ -0,0 +1,196 @@
+# myapp/pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full ordering tuple.
+
+    DRF's CursorPagination only seeks on the first ordering field and falls
+    back to OFFSET for ties, and it cannot page over nullable columns. This
+    class seeks on the whole ``ordering`` tuple with a few indexed range
+    scans (see ``_seek``), so a page costs the same no matter how deep it
+    is. The last ordering field must be unique (normally ``id``). NULLs sort
+    where the database puts them natively (largest on PostgreSQL, smallest
+    on SQLite), so a plain b-tree index on the ordering columns serves every
+    page.
+
+    Cursors are opaque base64 tokens holding the boundary row's ordering
+    values and the direction of travel.
+    """
+    ordering = ('-id',)
+    page_size = getattr(settings, 'API_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+    def __init__(self, cursor_query_param=None):
+        if cursor_query_param:
+            self.cursor_query_param = cursor_query_param
+
+    # ---------------- Ordering ----------------
+    def _columns(self):
+        return [
+            (field[1:], True) if field.startswith('-') else (field, False)
+            for field in self.ordering
+        ]
+
+    def _field(self, name):
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        model = self.model
+        *path, last = name.split('__')
+        for attr in path:
+            model = model._meta.get_field(attr).related_model
+        return model._meta.pk if last == 'id' else model._meta.get_field(last)
+
+    def _order_by(self, reverse):
+        return [
+            f'-{name}' if descending != reverse else name
+            for name, descending in self._columns()
+        ]
+
+    def _seek(self, position, reverse):
+        """
+        Rows strictly after ``position`` in travel order, as a list of
+        conditions whose rows follow each other in that order: the rows
+        tying on every column but the last come first, then those tying on
+        one column fewer, and so on. Each condition is equalities on a
+        prefix of the ordering columns plus one range (or IS [NOT] NULL) on
+        the next, i.e. one contiguous stretch of an index on the ordering
+        columns, so no page has to skip over the rows before it.
+        """
+        columns = self._columns()
+        conditions = []
+        for depth in range(len(columns) - 1, -1, -1):
+            prefix = Q()
+            for (name, _), value in zip(columns[:depth], position):
+                prefix &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+            (name, descending), value = columns[depth], position[depth]
+            ascending = descending == reverse
+            nulls_at_end = self.nulls_largest == ascending
+            if value is None:
+                # Inside the NULLs: only non-NULL values can still follow.
+                if not nulls_at_end:
+                    conditions.append(prefix & Q(**{f'{name}__isnull': False}))
+            else:
+                conditions.append(prefix & Q(**{f'{name}__{"gt" if ascending else "lt"}': value}))
+                if nulls_at_end and self._field(name).null:
+                    conditions.append(prefix & Q(**{f'{name}__isnull': True}))
+        return conditions
+
+    def _position(self, instance):
+        position = []
+        for name, _ in self._columns():
+            value = instance
+            for attr in name.split('__'):
+                value = getattr(value, 'pk' if attr == 'id' else attr) if value is not None else None
+            position.append(value)
+        return position
+
+    # ---------------- Paging ----------------
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.nulls_largest = connections[queryset.db].features.nulls_order_largest
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['r']
+
+        queryset = queryset.order_by(*self._order_by(reverse))
+        limit = self.page_size + 1
+        if cursor is None:
+            results = list(queryset[:limit])
+        else:
+            # Usually the first one or two conditions fill the page.
+            results = []
+            for condition in self._seek(cursor['p'], reverse):
+                results.extend(queryset.filter(condition)[:limit - len(results)])
+                if len(results) == limit:
+                    break
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = cursor is not None, has_more
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor({'p': self._position(self.page[-1]), 'r': False})
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor({'p': self._position(self.page[0]), 'r': True})
+
+    def get_links(self):
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+
+    # ---------------- Cursor encoding ----------------
+    def encode_cursor(self, cursor):
+        position = [
+            value.isoformat() if isinstance(value, (datetime, date))
+            else str(value) if isinstance(value, Decimal)
+            else value
+            for value in cursor['p']
+        ]
+        payload = json.dumps({'p': position, 'r': int(cursor['r'])}, separators=(',', ':'))
+        encoded = urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+            raw_position = payload['p']
+            if len(raw_position) != len(self.ordering):
+                raise ValueError
+            position = [
+                None if value is None else self._field(name).to_python(value)
+                for (name, _), value in zip(self._columns(), raw_position)
+            ]
+            return {'p': position, 'r': bool(payload.get('r'))}
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class SamplePagination(KeysetPagination):
+    ordering = ('-date_received', '-id')
+
+
+class TestPagination(KeysetPagination):
+    ordering = ('-submitted_date', '-id')
+
+
+class WorkQueuePagination(KeysetPagination):
+    """Technician work queue: highest priority first, then oldest."""
+    ordering = ('-priority', 'id')
+
+
+class SearchPagination(KeysetPagination):
+    """Pages over the ``rank`` annotation added by myapp.search."""
+    ordering = ('-rank', '-id')
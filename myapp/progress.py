@@ -0,0 +1,111 @@
+# myapp/progress.py
+"""
+Per-sample test progress columns (Sample.tests_total, tests_open,
+tests_awaiting_hod, tests_awaiting_dg, tests_approved).
+
+Every place that creates, deletes or moves a Test calls ``record()`` in the
+same transaction, next to the StatusCounter bookkeeping. The columns are
+changed with ``F()`` increments, so concurrent transitions of tests of one
+sample queue on the sample row instead of overwriting each other. Inside
+``bookkeeping.atomic()`` the increments are written at the end of the
+transaction, so a caller deciding on the new values (is this the last open
+test?) reads the columns under the row lock first and adds its own change,
+as ``transitions.submit_results()`` does: when the last two open tests are
+submitted at once, exactly one of them sees ``tests_open`` reach zero.
+``rebuild_status_counters`` recomputes the columns after edits that bypass
+the API (e.g. the Django admin).
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Q
+
+from . import bookkeeping
+from .models import Sample, Test
+
+TOTAL_FIELD = 'tests_total'
+STATUS_FIELDS = {
+    'Pending': 'tests_open',
+    'In Progress': 'tests_open',
+    'Awaiting HOD Review': 'tests_awaiting_hod',
+    'Awaiting DG Review': 'tests_awaiting_dg',
+    'Approved': 'tests_approved',
+    'Completed': 'tests_approved',
+}
+FIELDS = (TOTAL_FIELD, 'tests_open', 'tests_awaiting_hod', 'tests_awaiting_dg', 'tests_approved')
+
+
+def record(changes):
+    """
+    Apply ``changes``, an iterable of (sample_id, old_status, new_status)
+    with None for a created (old) or deleted (new) test.
+    """
+    deltas = Counter()
+    for sample_id, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        if old_status is None:
+            deltas[(sample_id, TOTAL_FIELD)] += 1
+        elif old_status in STATUS_FIELDS:
+            deltas[(sample_id, STATUS_FIELDS[old_status])] -= 1
+        if new_status is None:
+            deltas[(sample_id, TOTAL_FIELD)] -= 1
+        elif new_status in STATUS_FIELDS:
+            deltas[(sample_id, STATUS_FIELDS[new_status])] += 1
+    if not bookkeeping.collect(bookkeeping.PROGRESS, deltas):
+        _write(deltas)
+
+
+@bookkeeping.writer(bookkeeping.PROGRESS)
+def _write(deltas):
+    """
+    Write {(sample_id, field): n}. Samples whose net change is the same
+    share one UPDATE; with several samples their rows are locked in id
+    order first, since the UPDATEs themselves are not.
+    """
+    by_sample = defaultdict(Counter)
+    for (sample_id, field), n in deltas.items():
+        by_sample[sample_id][field] += n
+    by_delta = defaultdict(list)
+    for sample_id, delta in by_sample.items():
+        delta = tuple(sorted((field, n) for field, n in delta.items() if n))
+        if delta:
+            by_delta[delta].append(sample_id)
+    if len(by_delta) > 1:
+        list(Sample.objects.select_for_update().filter(id__in=sorted(by_sample)).order_by('id').values_list('id'))
+    for delta, sample_ids in by_delta.items():
+        Sample.objects.filter(id__in=sorted(sample_ids)).update(
+            **{field: F(field) + n for field, n in delta}
+        )
+
+
+def rebuild(start=0, stop=None):
+    """
+    Recompute the progress columns of samples with ``start <= id < stop``
+    from their tests; returns how many were out of step. Must run inside
+    ``transaction.atomic()``.
+    """
+    id_range = {'id__gte': start} if stop is None else {'id__gte': start, 'id__lt': stop}
+    samples = list(Sample.objects.select_for_update().filter(**id_range).only('id', *FIELDS))
+    counts = (
+        Test.objects.filter(**{f'sample_{lookup}': value for lookup, value in id_range.items()})
+        .values('sample_id')
+        .order_by()
+        .annotate(
+            tests_total=Count('id'),
+            **{
+                field: Count('id', filter=Q(status__in=[s for s, f in STATUS_FIELDS.items() if f == field]))
+                for field in FIELDS[1:]
+            },
+        )
+    )
+    by_sample = {row.pop('sample_id'): row for row in counts}
+
+    updated = []
+    for sample in samples:
+        row = by_sample.get(sample.id, {})
+        if any(getattr(sample, field) != row.get(field, 0) for field in FIELDS):
+            for field in FIELDS:
+                setattr(sample, field, row.get(field, 0))
+            updated.append(sample)
+    Sample.objects.bulk_update(updated, FIELDS, batch_size=1000)
+    return len(updated)
@@ -0,0 +1,117 @@
+# myapp/queues.py
+"""
+Change watermarks for polled work queues and dashboards, and conditional
+GET on top of them.
+
+Every handler that moves a test into, out of or within a queue bumps that
+queue's watermark in the same transaction. A poll derives its ETag from the
+watermarks (read in one query) before touching the queue, so an unchanged
+queue is answered with 304 without evaluating or serializing anything.
+Reading the versions before the data means a change racing with the poll
+can only make the ETag older than the body, which costs one extra 200 on
+the next poll, never a missed update.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from . import watermarks
+from .catalog import CATALOG_KEY
+
+UNCLAIMED_QUEUE = 'queue:unclaimed'
+HOD_QUEUE = 'queue:hod'
+DG_QUEUE = 'queue:dg'
+
+UNCLAIMED_STATUS = 'Awaiting Registrar Approval'
+HOD_REVIEW_STATUS = 'Awaiting HOD Review'
+HOD_QUEUE_STATUSES = ('Submitted to HOD', HOD_REVIEW_STATUS)
+DG_REVIEW_STATUS = 'Awaiting DG Review'
+
+
+def technician_key(user_id):
+    return f'technician-queue:{user_id}'
+
+
+def touch_technicians(*user_ids):
+    """Bump the work queues of the given technicians (None is ignored)."""
+    keys = {technician_key(user_id) for user_id in user_ids if user_id}
+    if keys:
+        watermarks.bump(*keys)
+
+
+def registrar_key(user_id):
+    return f'queue:registrar:{user_id}'
+
+
+def touch_samples(*samples, old_status=None, old_registrar_id=None, dg=False):
+    """
+    Bump the dashboards that list any of ``samples`` before or after a
+    change: the unclaimed and HOD queues by sample status, the registrar's
+    own list, and the DG queue when ``dg`` is set (a test of the sample
+    entered or left DG review, or that cannot be ruled out).
+    """
+    keys = {DG_QUEUE} if dg else set()
+    for sample in samples:
+        statuses = {sample.status, old_status}
+        if UNCLAIMED_STATUS in statuses:
+            keys.add(UNCLAIMED_QUEUE)
+        if statuses.intersection(HOD_QUEUE_STATUSES):
+            keys.add(HOD_QUEUE)
+        for registrar_id in (sample.registrar_id, old_registrar_id):
+            if registrar_id:
+                keys.add(registrar_key(registrar_id))
+    if keys:
+        watermarks.bump(*keys)
+
+
+def touch_test(test, old_status=None):
+    """Bump the dashboards showing the sample of ``test`` after a test change."""
+    touch_samples(test.sample, dg=DG_REVIEW_STATUS in (test.status, old_status))
+
+
+def _validators(request, keys):
+    """
+    (ETag, Last-Modified) for ``request`` over the watermarks ``keys`` plus
+    the ingredient catalog, which most queue rows embed, read in one query.
+    The query string is part of the ETag because it selects the page.
+    """
+    keys = [*keys, CATALOG_KEY]
+    rows = watermarks.snapshot(*keys)
+    state = ';'.join(f'{key}={rows[key][0]}' for key in keys)
+    digest = hashlib.sha1(f'{request.user.pk}|{request.get_full_path()}|{state}'.encode()).hexdigest()
+    changed = [updated_at for _, updated_at in rows.values() if updated_at]
+    return quote_etag(digest[:32]), max(changed) if changed else None
+
+
+def _not_modified(request, etag, last_modified):
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if client_etags:
+        return etag in client_etags or '*' in client_etags
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and last_modified is not None and int(last_modified.timestamp()) <= since
+
+
+def conditional(request, keys, build_response):
+    """
+    Return 304 if the client's validators still match the watermarks
+    ``keys``; otherwise call ``build_response()``. If-None-Match takes
+    precedence over If-Modified-Since.
+
+    HTTP dates only have one-second resolution, so Last-Modified is only
+    sent once the last change is a full second old; a later change then
+    always falls in a later second.
+    """
+    etag, last_modified = _validators(request, keys)
+    if _not_modified(request, etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = build_response()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        if last_modified and last_modified <= timezone.now() - timedelta(seconds=1):
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
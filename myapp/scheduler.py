@@ -0,0 +1,119 @@
+# myapp/scheduler.py
+"""
+Workload-aware auto-assignment of unassigned tests.
+
+A run reads the assignable tests and every technician's open-test count in
+one query each, then plans in memory: per test type, a heap of technicians
+keyed by their current load hands each piece of work to the least loaded
+technician whose specialization matches the test's ``Ingredient.test_type``.
+With ``keep_samples_together`` the tests of one sample and test type go to
+the same technician as one piece of work. The plan is committed through
+``assignments.assign_tests()``, i.e. with bulk writes.
+
+Planned tests are locked with ``SKIP LOCKED``, so concurrent runs plan
+disjoint sets of tests instead of handing out the same test twice.
+
+A run that assigns only part of a sample (``department``, ``limit``, or no
+technician for one test type) moves the sample to In Progress, so the
+tests it left behind are picked up from In Progress samples too.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.db.models import Count, Q
+
+from . import assignments
+from .catalog import get_catalog
+from .models import TECHNICIAN_QUEUE_STATUSES, Test, User
+from .queues import HOD_QUEUE_STATUSES
+
+UNASSIGNED_STATUS = 'Pending'
+ASSIGNABLE_SAMPLE_STATUSES = (*HOD_QUEUE_STATUSES, assignments.ASSIGNED_STATUS)
+
+
+def assignable_tests(department=None, limit=None):
+    """
+    (sample_id, test_id, ingredient_id) of unassigned tests whose sample is
+    in the HOD queue or already partly assigned, oldest sample first. Locks
+    the rows it returns.
+    """
+    tests = Test.objects.filter(
+        status=UNASSIGNED_STATUS, assigned_to__isnull=True, sample__status__in=ASSIGNABLE_SAMPLE_STATUSES,
+    )
+    if department:
+        tests = tests.filter(ingredient__test_type=department)
+    tests = (
+        tests.select_for_update(skip_locked=True, of=('self',))
+        .order_by('sample__date_received', 'sample_id', 'id')
+        .values_list('sample_id', 'id', 'ingredient_id')
+    )
+    return list(tests[:limit] if limit else tests)
+
+
+def technician_loads(department=None):
+    """{technician id: (specialization, open tests)} for active technicians."""
+    technicians = User.objects.filter(role='Technician', is_active=True, specialization__gt='')
+    if department:
+        technicians = technicians.filter(specialization=department)
+    technicians = technicians.annotate(
+        open_tests=Count('assigned_tests', filter=Q(assigned_tests__status__in=TECHNICIAN_QUEUE_STATUSES)),
+    )
+    return {
+        technician_id: (specialization, open_tests)
+        for technician_id, specialization, open_tests
+        in technicians.values_list('id', 'specialization', 'open_tests')
+    }
+
+
+def plan(tests, loads, keep_samples_together=True):
+    """
+    Balance ``tests`` (from assignable_tests) over ``loads`` (from
+    technician_loads). Returns (rows, unassigned): assignment rows for
+    assignments.assign_tests() and the ids of tests no technician can take.
+    """
+    catalog = get_catalog()
+    heaps = defaultdict(list)
+    for technician_id, (specialization, open_tests) in loads.items():
+        heaps[specialization].append((open_tests, technician_id))
+    for heap in heaps.values():
+        heapq.heapify(heap)
+
+    # Pieces of work in queue order: one per sample and test type when
+    # keeping samples together, else one per test.
+    pieces = defaultdict(list)
+    for sample_id, test_id, ingredient_id in tests:
+        department = catalog.test_type(ingredient_id)
+        key = (sample_id, department) if keep_samples_together else (sample_id, department, test_id)
+        pieces[key].append(test_id)
+
+    rows, unassigned = [], []
+    for key, test_ids in pieces.items():
+        sample_id, department = key[0], key[1]
+        heap = heaps.get(department)
+        if not heap:
+            unassigned.extend(test_ids)
+            continue
+        load, technician_id = heap[0]
+        heapq.heapreplace(heap, (load + len(test_ids), technician_id))
+        rows.extend((sample_id, test_id, technician_id) for test_id in test_ids)
+    return rows, unassigned
+
+
+def auto_assign(actor=None, department=None, keep_samples_together=True, limit=None, dry_run=False):
+    """
+    Plan and commit one scheduling run. Must run inside
+    ``bookkeeping.atomic()``; with ``dry_run`` nothing is written.
+    """
+    loads = technician_loads(department)
+    rows, unassigned = plan(assignable_tests(department, limit), loads, keep_samples_together)
+    if rows and not dry_run:
+        roster = {technician_id: specialization for technician_id, (specialization, _) in loads.items()}
+        summary = assignments.assign_tests(rows, actor, roster=roster)
+    else:
+        summary = {
+            'assigned': 0,
+            'samples': sorted({sample_id for sample_id, _, _ in rows}),
+            'technicians': dict(Counter(technician_id for _, _, technician_id in rows)),
+        }
+    summary.update(planned=len(rows), unassigned=unassigned, dry_run=dry_run)
+    return summary
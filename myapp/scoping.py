@@ -0,0 +1,98 @@
+# myapp/scoping.py
+"""
+Role-scoped querysets.
+
+Each function narrows a queryset to the rows ``user`` may see, as one
+more condition in the same SQL statement:
+
+- Admin and Director (either spelling, ``User.DIRECTOR_ROLES``): everything.
+- Technician: the tests assigned to them and those tests' samples.
+- Registrar: samples they registered or that nobody has claimed yet, and
+  every customer (intake looks up returning customers).
+- HOD: tests of their department (``Ingredient.test_type`` equal to the
+  department's name) and samples assigned to them. A department whose name
+  is not a test type would match no tests; ``Department.clean`` rejects
+  such names and the ``myapp.E001`` check reports existing ones.
+- HODv: samples assigned to a HODv of their division.
+- Anyone else: nothing.
+
+A user's department or division is resolved inside the query (their own
+``department``/``division`` or the one they head), so scoping costs no
+extra round trip and works with the claims-built ``request.user``.
+Customers and payments follow the samples in scope.
+"""
+from django.db.models import Q
+
+from .models import Customer, Department, Division, Payment, Sample, Test, User
+
+FULL_ACCESS_ROLES = ('Admin', *User.DIRECTOR_ROLES)
+
+
+def _department_names(user):
+    return Department.objects.filter(Q(user=user.pk) | Q(hod=user.pk)).values('name')
+
+
+def _division_ids(user):
+    return Division.objects.filter(Q(user=user.pk) | Q(hodv=user.pk)).values('id')
+
+
+def _sample_filter(user, prefix=''):
+    """
+    Q over Sample fields (``prefix`` for a relation to Sample), None for no
+    restriction, or False when the role sees no samples.
+    """
+    role = user.role
+    if role in FULL_ACCESS_ROLES:
+        return None
+    if role == 'Technician':
+        return Q(**{f'{prefix}id__in': Test.objects.filter(assigned_to=user.pk).values('sample_id')})
+    if role == 'Registrar':
+        return Q(**{f'{prefix}registrar': user.pk}) | Q(**{f'{prefix}registrar__isnull': True})
+    if role == 'HOD':
+        in_department = Test.objects.filter(ingredient__test_type__in=_department_names(user)).values('sample_id')
+        return Q(**{f'{prefix}assigned_to_hod': user.pk}) | Q(**{f'{prefix}id__in': in_department})
+    if role == 'HODv':
+        return (Q(**{f'{prefix}assigned_to_hodv': user.pk})
+                | Q(**{f'{prefix}assigned_to_hodv__division__in': _division_ids(user)}))
+    return False
+
+
+def _apply(queryset, condition):
+    if condition is None:
+        return queryset
+    if condition is False:
+        return queryset.none()
+    return queryset.filter(condition)
+
+
+def samples(user, queryset=None):
+    """Samples ``user`` may see."""
+    return _apply(Sample.objects.all() if queryset is None else queryset, _sample_filter(user))
+
+
+def tests(user, queryset=None):
+    """Tests ``user`` may see: a HOD only the department's tests, not whole samples."""
+    queryset = Test.objects.all() if queryset is None else queryset
+    if user.role == 'Technician':
+        return queryset.filter(assigned_to=user.pk)
+    if user.role == 'HOD':
+        return queryset.filter(
+            Q(sample__assigned_to_hod=user.pk) | Q(ingredient__test_type__in=_department_names(user))
+        )
+    return _apply(queryset, _sample_filter(user, 'sample__'))
+
+
+def customers(user, queryset=None):
+    """Customers of the samples ``user`` may see; registrars see all."""
+    queryset = Customer.objects.all() if queryset is None else queryset
+    if user.role == 'Registrar':
+        return queryset
+    condition = _sample_filter(user)
+    if condition in (None, False):
+        return _apply(queryset, condition)
+    return queryset.filter(id__in=Sample.objects.filter(condition).values('customer_id'))
+
+
+def payments(user, queryset=None):
+    """Payments of the samples ``user`` may see."""
+    return _apply(Payment.objects.all() if queryset is None else queryset, _sample_filter(user, 'sample__'))
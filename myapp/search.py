@@ -0,0 +1,180 @@
+# myapp/search.py
+"""
+Ranked sample search over sample_name/sample_details (words) and
+control_number/laboratory_number (fragments). Every term of a search must
+match one of the four columns, so "soil 2024" finds a soil sample whose
+laboratory number contains 2024.
+
+PostgreSQL uses the GIN indexes created by migration 0032: a 'simple'
+tsvector over name + details and pg_trgm indexes on the two numbers, so
+both the word match and the ``ILIKE '%fragment%'`` match are index scans.
+SQLite uses the ``myapp_sample_fts`` FTS5 table (trigram tokenizer, kept in
+sync by triggers). Other backends fall back to unranked ``icontains``.
+
+``search_samples()`` annotates ``rank`` (higher is better) so results can be
+paged with SearchPagination on ('-rank', '-id'). Only the newest
+``SAMPLE_SEARCH_CANDIDATES`` matches are ranked: ranking is per row, so a
+term that matches most of the table would otherwise cost time in
+proportion to the table.
+
+On SQLite, adding or removing a column of myapp_sample rebuilds the table
+and drops the FTS5 triggers; ``install_sqlite_triggers`` (run after every
+``migrate``) puts them back.
+"""
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Sample
+
+TABLE = Sample._meta.db_table
+FTS_TABLE = f'{TABLE}_fts'
+CANDIDATES = getattr(settings, 'SAMPLE_SEARCH_CANDIDATES', 1000)
+
+PG_QUERY = "plainto_tsquery('simple'::regconfig, %s)"
+
+# Column weights of the SQLite rank.
+RANK_WEIGHTS = (
+    ('control_number', 4.0),
+    ('laboratory_number', 4.0),
+    ('sample_name', 2.0),
+    ('sample_details', 1.0),
+)
+
+
+def search_samples(queryset, terms):
+    """Filter ``queryset`` to samples matching ``terms`` and annotate ``rank``."""
+    terms = ' '.join(terms.split())
+    if not terms:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return _search_postgresql(queryset, terms)
+    if vendor == 'sqlite':
+        return _search_sqlite(queryset, terms)
+    return _search_fallback(queryset, terms)
+
+
+def _newest(queryset, condition):
+    """``queryset`` narrowed to the newest CANDIDATES rows matching ``condition``."""
+    return queryset.filter(id__in=queryset.filter(condition).order_by('-id').values('id')[:CANDIDATES])
+
+
+def _like_pattern(word):
+    escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _pg_document(qualifier=''):
+    """
+    Must match the expression of sample_search_document_idx exactly, or the
+    planner will not use the index. Match conditions run inside a subquery
+    in which Django aliases the table, so they leave columns unqualified.
+    """
+    return (
+        f"to_tsvector('simple'::regconfig, coalesce({qualifier}\"sample_name\", '') || ' ' || "
+        f"coalesce({qualifier}\"sample_details\", ''))"
+    )
+
+
+def _search_postgresql(queryset, terms):
+    # One condition per term: its word in the document or its fragment in
+    # either number. Each is a BitmapOr of GIN scans, ANDed together.
+    document, ranked_document = _pg_document(), _pg_document(f'"{TABLE}".')
+    condition_sql, condition_params, rank_sql, rank_params = [], [], [], []
+    for word in terms.split():
+        pattern = _like_pattern(word)
+        condition_sql.append(
+            f'({document} @@ {PG_QUERY} OR "control_number" ILIKE %s OR "laboratory_number" ILIKE %s)'
+        )
+        condition_params += [word, pattern, pattern]
+        rank_sql.append(
+            f'ts_rank({ranked_document}, {PG_QUERY}) + greatest('
+            f'similarity(coalesce("{TABLE}"."control_number", \'\'), %s), '
+            f'similarity(coalesce("{TABLE}"."laboratory_number", \'\'), %s))'
+        )
+        rank_params += [word, word, word]
+    condition = RawSQL('(' + ' AND '.join(condition_sql) + ')', condition_params, output_field=BooleanField())
+    rank = RawSQL('(' + ' + '.join(rank_sql) + ')', rank_params, output_field=FloatField())
+    return _newest(queryset, condition).annotate(rank=rank)
+
+
+def _fts5_query(terms):
+    """
+    Quote each term so user input is never parsed as FTS5 syntax. The
+    trigram tokenizer cannot match terms shorter than three characters, so
+    those are left out (and matched with LIKE instead).
+    """
+    words = [word for word in terms.split() if len(word) >= 3]
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def _search_sqlite(queryset, terms):
+    match = _fts5_query(terms)
+    if not match:
+        return _search_fallback(queryset, terms)
+    short_words = [word for word in terms.split() if len(word) < 3]
+    if not short_words and not queryset.query.has_filters():
+        # Unscoped: FTS5 walks its rowids newest first and stops at the cap,
+        # instead of listing every match for _newest() to sort.
+        candidates = RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s',
+            (match, CANDIDATES),
+        )
+        return queryset.filter(id__in=candidates).annotate(rank=_sqlite_rank(terms))
+
+    condition = Q(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,)))
+    for word in short_words:
+        condition &= _contains(word)
+    return _newest(queryset, condition).annotate(rank=_sqlite_rank(terms))
+
+
+def _sqlite_rank(terms):
+    # FTS5 can only compute bm25() inside its own MATCH scan; as a
+    # correlated subquery that would rescan the index for every row. Rank
+    # instead by which columns contain each term, from the row itself.
+    rank_sql, rank_params = [], []
+    for word in terms.split():
+        for column, weight in RANK_WEIGHTS:
+            rank_sql.append(f'(instr(lower(coalesce("{TABLE}"."{column}", \'\')), %s) > 0) * {weight}')
+            rank_params.append(word.lower())
+    return RawSQL('(' + ' + '.join(rank_sql) + ')', rank_params, output_field=FloatField())
+
+
+def _contains(word):
+    return (
+        Q(sample_name__icontains=word) | Q(sample_details__icontains=word)
+        | Q(control_number__icontains=word) | Q(laboratory_number__icontains=word)
+    )
+
+
+def _search_fallback(queryset, terms):
+    condition = Q()
+    for word in terms.split():
+        condition &= _contains(word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def install_sqlite_triggers(using='default', **kwargs):
+    """
+    Recreate the FTS5 table and triggers of migration 0032 (with the update
+    trigger narrowed by 0036) if a table rebuild dropped them.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f'{FTS_TABLE}_%'],
+        )
+        if cursor.fetchone()[0] == 3:
+            return
+        if TABLE not in connection.introspection.table_names(cursor):
+            return  # migrated backwards past 0001
+        for migration in ('0032_sample_search_indexes', '0036_sample_fts_update_columns'):
+            for statement in import_module(f'myapp.migrations.{migration}').SQLITE_FORWARD:
+                cursor.execute(statement)
@@ -2,8 +2,7 @@
 from decimal import Decimal
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import transaction
+from django.db.models import Prefetch
 
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.encoding import force_bytes, force_str
@@ -11,11 +10,65 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.core.mail import send_mail
 from django.conf import settings
 
+from . import bookkeeping, counters, events, queues
+from .catalog import get_catalog
 from .models import (
     User, Department, Division, Customer, Sample,
     Test, Payment, Result, Ingredient
 )
 
+# ---------------- Eager loading ----------------
+def _is_under(lookup, prefix):
+    return bool(prefix) and (lookup == prefix or lookup.startswith(prefix + "__"))
+
+
+class EagerLoadingMixin:
+    """
+    Lets a serializer declare the related rows it reads so callers can load
+    them up front instead of issuing one query per object.
+
+    ``prefetch_related_fields`` entries are plain lookups or
+    ``(lookup, SerializerClass)`` pairs; a pair prefetches the relation with
+    the nested serializer's own plan.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, exclude=None):
+        """
+        Apply this serializer's plan to ``queryset``. ``exclude`` drops the
+        lookups that point back at the parent of a nested prefetch, since
+        Django already fills that relation in.
+        """
+        select = [f for f in cls.select_related_fields if not _is_under(f, exclude)]
+        if select:
+            queryset = queryset.select_related(*select)
+
+        prefetches = []
+        for entry in cls.prefetch_related_fields:
+            if isinstance(entry, str):
+                if not _is_under(entry, exclude):
+                    prefetches.append(entry)
+                continue
+            lookup, nested = entry
+            relation = queryset.model._meta.get_field(lookup)
+            back_reference = relation.field.name if relation.one_to_many else None
+            nested_queryset = nested.setup_eager_loading(
+                relation.related_model._default_manager.all(), exclude=back_reference
+            )
+            prefetches.append(Prefetch(lookup, queryset=nested_queryset))
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset
+
+    @classmethod
+    def reload_eagerly(cls, instance):
+        """Re-read a single instance with this serializer's plan applied."""
+        queryset = type(instance)._default_manager.filter(pk=instance.pk)
+        return cls.setup_eager_loading(queryset).get()
+
+
 # ---------------- Authentication ----------------
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField(required=False, allow_blank=True)
@@ -32,17 +85,14 @@ class LoginSerializer(serializers.Serializer):
         if not password:
             raise serializers.ValidationError("A password is required.")
 
-        user = None
+        # One user lookup and one password hash per attempt (EmailBackend
+        # handles the email path).
         if username:
             user = authenticate(request=self.context.get('request'),
                                 username=username, password=password)
-        elif email:
-            try:
-                user_obj = User.objects.get(email__iexact=email)
-                user = authenticate(request=self.context.get('request'),
-                                    username=user_obj.username, password=password)
-            except ObjectDoesNotExist:
-                pass
+        else:
+            user = authenticate(request=self.context.get('request'),
+                                email=email, password=password)
 
         if user is None:
             raise serializers.ValidationError("Invalid credentials provided.")
@@ -54,10 +104,12 @@ class LoginSerializer(serializers.Serializer):
 
 
 # ---------------- User / Department / Division ----------------
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     department_name = serializers.SerializerMethodField()
     division_name = serializers.SerializerMethodField()
 
+    select_related_fields = ("department", "division")
+
     class Meta:
         model = User
         fields = [
@@ -97,6 +149,13 @@ class DepartmentSerializer(serializers.ModelSerializer):
         model = Department
         fields = '__all__'
 
+    def validate_name(self, value):
+        # HOD scoping matches Ingredient.test_type against this name.
+        test_types = [choice for choice, _ in Ingredient.TEST_TYPE_CHOICES]
+        if value not in test_types:
+            raise serializers.ValidationError(f"Must be one of the test types: {', '.join(test_types)}.")
+        return value
+
 
 class DivisionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -139,18 +198,24 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'price', 'test_type']
 
 
-class TestSerializer(serializers.ModelSerializer):
-    ingredient = IngredientSerializer()
+class TestSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    ingredient = serializers.SerializerMethodField()
     assigned_to_name = serializers.CharField(source='assigned_to.username', read_only=True)
     sample = serializers.SerializerMethodField()
 
+    # The ingredient comes from the in-process catalog, not a join.
+    select_related_fields = ("assigned_to", "sample__registrar")
+
     class Meta:
         model = Test
         fields = [
             'id', 'sample', 'ingredient', 'assigned_to',
-            'assigned_to_name', 'results', 'price', 'status', 'submitted_date'
+            'assigned_to_name', 'results', 'price', 'status', 'priority', 'submitted_date'
         ]
 
+    def get_ingredient(self, obj):
+        return get_catalog().serialized.get(obj.ingredient_id)
+
     def get_sample(self, obj):
         sample = obj.sample
         if not sample:
@@ -166,45 +231,58 @@ class TestSerializer(serializers.ModelSerializer):
         }
 
 
-class SimpleTestSerializer(serializers.ModelSerializer):
-    ingredient_name = serializers.CharField(source='ingredient.name', read_only=True)
-    ingredient_price = serializers.DecimalField(source='ingredient.price',
-                                                max_digits=12, decimal_places=2,
-                                                read_only=True)
+class SimpleTestSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    ingredient_name = serializers.SerializerMethodField()
+    ingredient_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Test
         fields = ['id', 'ingredient_name', 'ingredient_price', 'status']
 
+    def get_ingredient_name(self, obj):
+        ingredient = get_catalog().serialized.get(obj.ingredient_id)
+        return ingredient["name"] if ingredient else None
+
+    def get_ingredient_price(self, obj):
+        ingredient = get_catalog().serialized.get(obj.ingredient_id)
+        return ingredient["price"] if ingredient else None
+
 
 # ---------------- Payments / Results ----------------
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     sample_control_number = serializers.CharField(source='sample.control_number',
                                                   read_only=True)
 
+    select_related_fields = ("sample",)
+
     class Meta:
         model = Payment
         fields = '__all__'
 
 
-class ResultSerializer(serializers.ModelSerializer):
+class ResultSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     test_ingredient_name = serializers.CharField(source='test.ingredient.name',
                                                  read_only=True)
     sample_control_number = serializers.CharField(source='test.sample.control_number',
                                                   read_only=True)
 
+    select_related_fields = ("test__ingredient", "test__sample")
+
     class Meta:
         model = Result
         fields = '__all__'
 
 
 # ---------------- Samples ----------------
-class UnclaimedSampleSerializer(serializers.ModelSerializer):
+class UnclaimedSampleSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     customer_details = serializers.SerializerMethodField()
     payment = PaymentSerializer(read_only=True)
     tests = SimpleTestSerializer(many=True, source="test_set", read_only=True)
     sample_name = serializers.SerializerMethodField()
 
+    select_related_fields = ("customer", "payment")
+    prefetch_related_fields = (("test_set", SimpleTestSerializer),)
+
     class Meta:
         model = Sample
         fields = [
@@ -272,13 +350,16 @@ class UnclaimedSampleSerializer(serializers.ModelSerializer):
 
 
 
-class SampleDashboardSerializer(serializers.ModelSerializer):
+class SampleDashboardSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     customer_details = serializers.SerializerMethodField()
     registrar_name = serializers.CharField(source="registrar.username", read_only=True)
     payment_status = serializers.CharField(source="payment.status", read_only=True)
     tests = TestSerializer(many=True, source="test_set", read_only=True)
     sample_name = serializers.CharField(read_only=True)
 
+    select_related_fields = ("customer", "registrar", "payment")
+    prefetch_related_fields = (("test_set", TestSerializer),)
+
     class Meta:
         model = Sample
         fields = [
@@ -292,6 +373,11 @@ class SampleDashboardSerializer(serializers.ModelSerializer):
             "status",
             "payment_status",
             "tests",
+            "tests_total",
+            "tests_open",
+            "tests_awaiting_hod",
+            "tests_awaiting_dg",
+            "tests_approved",
         ]
 
     def get_customer_details(self, obj):
@@ -330,18 +416,22 @@ class SampleDashboardSerializer(serializers.ModelSerializer):
 
 
 
-class FullSampleSerializer(serializers.ModelSerializer):
+class FullSampleSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     tests = TestSerializer(source="test_set", many=True, read_only=True)
     payment = PaymentSerializer(read_only=True)
     sample_name = serializers.CharField(read_only=True)
     claimed_by = serializers.SerializerMethodField()
 
+    select_related_fields = ("customer", "registrar", "payment")
+    prefetch_related_fields = (("test_set", TestSerializer),)
+
     class Meta:
         model = Sample
         fields = [
             "id", "control_number", "laboratory_number", "sample_name", "sample_details",
             "status", "date_received", "customer", "tests", "payment", "claimed_by",
+            "tests_total", "tests_open", "tests_awaiting_hod", "tests_awaiting_dg", "tests_approved",
         ]
 
     def get_claimed_by(self, obj):
@@ -385,7 +475,7 @@ class RegisterSampleSerializer(serializers.Serializer):
         child=SampleSubmissionSerializer(), allow_empty=False, required=True
     )
 
-    @transaction.atomic
+    @bookkeeping.atomic()
     def create(self, validated_data):
         request = self.context["request"]
         customer_data = validated_data.pop("customer")
@@ -410,47 +500,68 @@ class RegisterSampleSerializer(serializers.Serializer):
             },
         )
 
-        created_samples = []
-        for sample_data in samples_data:
-            sample = Sample.objects.create(
+        # --- Resolve every selected ingredient once ---
+        all_ingredient_ids = [
+            ing for s in samples_data for ing in s.get("selected_ingredients", [])
+        ]
+        ingredients = get_catalog().ingredients
+
+        test_counts = [
+            sum(1 for ingredient_id in sample_data.get("selected_ingredients", []) if ingredient_id in ingredients)
+            for sample_data in samples_data
+        ]
+        created_samples = Sample.objects.bulk_create([
+            Sample(
                 customer=customer,
                 registrar=request.user,
                 sample_name=sample_data.get("sample_name", ""),
                 sample_details=sample_data.get("sample_details", ""),
                 status="Awaiting HOD Review",
+                # Every test below starts Pending.
+                tests_total=test_count,
+                tests_open=test_count,
             )
-
-            # --- Create Tests ---
-            for ingredient_id in sample_data.get("selected_ingredients", []):
-                try:
-                    ingredient = Ingredient.objects.get(id=ingredient_id)
-                    Test.objects.create(
-                        sample=sample,
-                        ingredient=ingredient,
-                        price=ingredient.price,
-                        status="Pending",
-                    )
-                except Ingredient.DoesNotExist:
-                    continue
-
-            created_samples.append(sample)
+            for sample_data, test_count in zip(samples_data, test_counts)
+        ])
+
+        # --- Create Tests (unknown ingredient ids are skipped) ---
+        created_tests = Test.objects.bulk_create([
+            Test(
+                sample=sample,
+                ingredient_id=ingredient_id,
+                price=ingredients[ingredient_id].price,
+                status="Pending",
+            )
+            for sample, sample_data in zip(created_samples, samples_data)
+            for ingredient_id in sample_data.get("selected_ingredients", [])
+            if ingredient_id in ingredients
+        ])
+
+        counters.apply(
+            counters.created(counters.SAMPLE, [(sample.status, "") for sample in created_samples]),
+            counters.created(counters.TEST, [
+                (test.status, ingredients[test.ingredient_id].test_type) for test in created_tests
+            ]),
+        )
+        queues.touch_samples(*created_samples)
+        events.record_many(
+            events.build(events.SAMPLE_REGISTERED, sample, to_status=sample.status, actor=request.user)
+            for sample in created_samples
+        )
 
         # --- Payment ---
         MARKING_FEE = Decimal("10000.00")
-        all_ingredient_ids = [
-            ing for s in samples_data for ing in s.get("selected_ingredients", [])
-        ]
         total_ingredients_price = sum(
-            Ingredient.objects.filter(id__in=all_ingredient_ids)
-            .values_list("price", flat=True),
+            (ingredients[ing].price for ing in set(all_ingredient_ids) if ing in ingredients),
             Decimal("0.00"),
         )
         total_amount = (MARKING_FEE * Decimal(len(samples_data))) + total_ingredients_price
 
         if created_samples:
-            Payment.objects.update_or_create(
+            Payment.objects.create(
                 sample=created_samples[0],
-                defaults={"amount_due": total_amount, "status": "Pending"},
+                amount_due=total_amount,
+                status="Pending",
             )
 
         return created_samples
@@ -462,14 +573,22 @@ class TechnicianIngredientSerializer(serializers.ModelSerializer):
         model = Ingredient
         fields = ["id", "name", "test_type"]
 
-class TechnicianDashboardSerializer(serializers.ModelSerializer):
-    ingredient = TechnicianIngredientSerializer()
+class TechnicianDashboardSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    ingredient = serializers.SerializerMethodField()
     sample = serializers.SerializerMethodField()
     assigned_by_hod = serializers.SerializerMethodField()
 
+    select_related_fields = ("assigned_to", "sample__registrar")
+
     class Meta:
         model = Test
-        fields = ["id", "ingredient", "status", "sample", "assigned_by_hod"]
+        fields = ["id", "ingredient", "status", "priority", "sample", "assigned_by_hod"]
+
+    def get_ingredient(self, obj):
+        ingredient = get_catalog().serialized.get(obj.ingredient_id)
+        if not ingredient:
+            return None
+        return {field: ingredient[field] for field in TechnicianIngredientSerializer.Meta.fields}
 
     def get_sample(self, obj):
         sample = obj.sample
@@ -481,7 +600,7 @@ class TechnicianDashboardSerializer(serializers.ModelSerializer):
             "sample_details": sample.sample_details,   # ✅ Sample Details
             "date_received": sample.date_received,     # ✅ Assigned Date
             "registrar_name": sample.registrar.username if sample.registrar else None,  # ✅ Submitted By
-            "customer": {"id": sample.customer.id} if sample.customer else None,
+            "customer": {"id": sample.customer_id} if sample.customer_id else None,
             "control_number": sample.control_number,   # ✅ Use as Sample Code
         }
 
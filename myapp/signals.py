@@ -0,0 +1,22 @@
+# myapp/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication, catalog
+from .models import Ingredient, User
+
+
+@receiver(post_save, sender=Ingredient, dispatch_uid='myapp.ingredient_saved')
+@receiver(post_delete, sender=Ingredient, dispatch_uid='myapp.ingredient_deleted')
+def ingredient_changed(sender, **kwargs):
+    """Any change to an ingredient invalidates every worker's catalog cache."""
+    catalog.invalidate()
+
+
+@receiver(post_save, sender=User, dispatch_uid='myapp.user_saved')
+@receiver(post_delete, sender=User, dispatch_uid='myapp.user_deleted')
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """A change to a user's token claims invalidates every worker's user cache."""
+    if update_fields is not None and not set(update_fields) & set(authentication.STAMP_FIELDS):
+        return  # e.g. last_login on every login
+    authentication.invalidate(instance.pk)
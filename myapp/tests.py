@@ -1,3 +1,1230 @@
-from django.test import TestCase
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException, SMTPServerDisconnected
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import MD5PasswordHasher
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.signals import request_started
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import (
+    authentication, bookkeeping, catalog, checks, counters, events, metrics, outbox, progress, queues, scheduler,
+    scoping, search, throttling, tokens, transitions, watermarks,
+)
+from .models import (
+    Customer, Department, Division, Ingredient, OutboxEmail, Payment, Result, Sample, StatusCounter, Test, User,
+    WorkflowEvent,
+)
+from .pagination import SamplePagination, TestPagination, WorkQueuePagination
+
+
+# ---------------- Fixtures ----------------
+def make_user(username, role, password=None, **fields):
+    # No password (an unusable one) unless a test logs in: hashing is slow.
+    return User.objects.create_user(username=username, password=password, role=role,
+                                    email=f'{username}@example.com', **fields)
+
+
+def make_ingredient(name='Lead', test_type='Chemistry'):
+    return Ingredient.objects.create(name=name, price=Decimal('100.00'), test_type=test_type)
+
+
+def make_sample(customer=None, **fields):
+    if customer is None:
+        customer = Customer.objects.create(first_name='Test', last_name='Customer', email='c@example.com')
+    fields.setdefault('sample_name', 'Sample')
+    return Sample.objects.create(customer=customer, **fields)
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+# ---------------- Keyset pagination ----------------
+class KeysetPaginationTests(TestCase):
+    factory = APIRequestFactory()
+
+    def walk(self, pagination_class, queryset, backward_from_end=False):
+        """Ids of every page, following next links (then previous links back)."""
+        pages, url = [], '/items/?page_size=3'
+        while url:
+            paginator = pagination_class()
+            page = paginator.paginate_queryset(queryset, Request(self.factory.get(url)))
+            pages.append([row.id for row in page])
+            url = paginator.get_next_link()
+        if backward_from_end:
+            back, url = [], paginator.get_previous_link()
+            while url:
+                paginator = pagination_class()
+                back.insert(0, [row.id for row in paginator.paginate_queryset(queryset, Request(self.factory.get(url)))])
+                url = paginator.get_previous_link()
+            return pages, back
+        return pages
+
+    def test_pages_cover_ties_in_order(self):
+        customer = Customer.objects.create(first_name='A', last_name='B')
+        samples = [make_sample(customer) for _ in range(11)]
+        same = timezone.now() - timedelta(days=1)
+        Sample.objects.filter(id__in=[s.id for s in samples[2:9]]).update(date_received=same)
+
+        expected = list(Sample.objects.order_by('-date_received', '-id').values_list('id', flat=True))
+        pages, back = self.walk(SamplePagination, Sample.objects.all(), backward_from_end=True)
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(page) == 3 for page in pages[:-1]))
+        self.assertEqual(sum(back, []), expected[:len(sum(back, []))])
+
+    def test_pages_cover_nulls_in_native_order(self):
+        sample = make_sample()
+        now = timezone.now()
+        for i in range(10):
+            Test.objects.create(sample=sample, submitted_date=None if i % 3 == 0 else now - timedelta(hours=i % 2))
+
+        nulls_largest = connection.features.nulls_order_largest
+        rows = list(Test.objects.values_list('submitted_date', 'id'))
+        # Native descending order: NULLs first where they sort largest.
+        expected = [test_id for _, test_id in sorted(
+            rows, key=lambda row: ((row[0] is None) == nulls_largest, row[0] or now, row[1]), reverse=True,
+        )]
+        pages = self.walk(TestPagination, Test.objects.all())
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_work_queue_pages_within_large_tie_groups(self):
+        sample = make_sample()
+        tests = [Test(sample=sample, priority=i % 2) for i in range(14)]
+        Test.objects.bulk_create(tests)
+        expected = list(Test.objects.order_by('-priority', 'id').values_list('id', flat=True))
+        self.assertEqual(sum(self.walk(WorkQueuePagination, Test.objects.all()), []), expected)
+
+    def test_every_seek_condition_is_an_index_range(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plan text is SQLite-specific')
+        sample = make_sample()
+        paginator = SamplePagination()
+        paginator.paginate_queryset(Sample.objects.all(), Request(self.factory.get('/items/')))
+        queryset = Sample.objects.order_by(*paginator._order_by(False))
+        for condition in paginator._seek([sample.date_received, sample.id], False):
+            plan = queryset.filter(condition).explain()
+            self.assertIn('SEARCH', plan)
+            self.assertNotIn('SCAN myapp_sample', plan)
+
+
+# ---------------- Auto-assignment ----------------
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.hod = make_user('hod', 'HOD')
+        self.chem_tech = make_user('chem', 'Technician', specialization='Chemistry')
+        self.sample = make_sample(status='Awaiting HOD Review')
+        self.chem = Test.objects.create(sample=self.sample, ingredient=make_ingredient('Lead', 'Chemistry'))
+        self.micro = Test.objects.create(sample=self.sample, ingredient=make_ingredient('E.coli', 'Microbiology'))
+
+    def test_tests_left_unassigned_are_picked_up_by_a_later_run(self):
+        # Only Chemistry can be staffed; the sample moves to In Progress anyway.
+        summary = scheduler.auto_assign(self.hod)
+        self.assertEqual(summary['assigned'], 1)
+        self.assertEqual(summary['unassigned'], [self.micro.id])
+        self.sample.refresh_from_db()
+        self.assertEqual(self.sample.status, 'In Progress')
+
+        micro_tech = make_user('micro', 'Technician', specialization='Microbiology')
+        summary = scheduler.auto_assign(self.hod, department='Microbiology')
+        self.assertEqual(summary['assigned'], 1)
+        self.micro.refresh_from_db()
+        self.assertEqual((self.micro.assigned_to_id, self.micro.status), (micro_tech.id, 'In Progress'))
+
+    def test_department_run_leaves_the_other_department_assignable(self):
+        make_user('micro', 'Technician', specialization='Microbiology')
+        scheduler.auto_assign(self.hod, department='Chemistry')
+        self.assertEqual([test_id for _, test_id, _ in scheduler.assignable_tests()], [self.micro.id])
+
+    def test_runs_never_pull_tests_out_of_review(self):
+        make_user('micro', 'Technician', specialization='Microbiology')
+        Test.objects.filter(id=self.chem.id).update(status='Awaiting HOD Review', assigned_to=self.chem_tech)
+        Test.objects.filter(id=self.micro.id).update(status='Awaiting DG Review')
+        self.assertEqual(scheduler.assignable_tests(), [])
+        self.assertEqual(scheduler.auto_assign(self.hod)['assigned'], 0)
+        self.assertEqual(list(Test.objects.order_by('id').values_list('status', flat=True)),
+                         ['Awaiting HOD Review', 'Awaiting DG Review'])
+
+    def test_a_batch_may_send_reviewed_tests_back_to_work(self):
+        # HODs may reassign a test under review, as assign-technician does; its bookkeeping follows.
+        Test.objects.filter(id=self.chem.id).update(status='Awaiting DG Review', assigned_to=self.chem_tech)
+        self.sample.status = 'Submitted to Director'
+        self.sample.save()
+        call_command('rebuild_status_counters', stdout=StringIO())
+        dg_queue = watermarks.current(queues.DG_QUEUE)
+        response = client_for(self.hod).post('/api/hod/assign-batch/', {'assignments': [
+            {'sample': self.sample.id, 'test': self.chem.id, 'technician': self.chem_tech.id}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+        self.sample.refresh_from_db()
+        self.assertEqual((self.sample.status, self.sample.tests_open, self.sample.tests_awaiting_dg),
+                         ('In Progress', 2, 0))
+        self.assertEqual(Test.objects.get(id=self.chem.id).status, 'In Progress')
+        self.assertGreater(watermarks.current(queues.DG_QUEUE), dg_queue)
+        self.assertEqual(progress.rebuild(), 0)
+        self.assertEqual(
+            {(row.entity, row.status, row.department): row.count for row in StatusCounter.objects.exclude(count=0)},
+            {('sample', 'In Progress', ''): 1, ('test', 'In Progress', 'Chemistry'): 1,
+             ('test', 'Pending', 'Microbiology'): 1},
+        )
+
+
+# ---------------- Email outbox ----------------
+class FailingBackend(LocmemBackend):
+    """locmem backend whose open() or send fails on demand."""
+
+    def __init__(self, open_error=None, send_errors=(), reopen_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.open_error, self.send_errors, self.reopen_error = open_error, list(send_errors), reopen_error
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+        error = self.open_error if self.opened == 1 else self.reopen_error
+        if error:
+            raise error
+
+    def send_messages(self, messages):
+        if self.send_errors:
+            raise self.send_errors.pop(0)
+        return super().send_messages(messages)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.messages = [outbox.enqueue(f'Subject {i}', 'Body', 'lab@example.com', [f'u{i}@example.com'])
+                         for i in range(3)]
+
+    def assertRetrying(self, message, attempts):
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('Pending', attempts))
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+    def test_due_messages_are_sent_once(self):
+        self.assertEqual(outbox.send_due(), (3, 0))
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [f'u{i}@example.com' for i in range(3)])
+        self.assertEqual(set(OutboxEmail.objects.values_list('status', flat=True)), {'Sent'})
+        self.assertEqual(outbox.send_due(), (0, 0))
+
+    def test_failed_send_backs_off_then_gives_up(self):
+        message = self.messages[0]
+        for attempt in range(1, outbox.MAX_ATTEMPTS + 1):
+            message.refresh_from_db()
+            with self.assertLogs('myapp.outbox', 'WARNING'):
+                outbox.deliver([message], FailingBackend(send_errors=[SMTPException('rejected')]))
+            if attempt < outbox.MAX_ATTEMPTS:
+                self.assertRetrying(message, attempt)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('Failed', outbox.MAX_ATTEMPTS))
+        self.assertIn('rejected', message.last_error)
+
+    def test_unreachable_server_records_a_retry_for_the_whole_batch(self):
+        claimed = outbox.claim_due(10)
+        with self.assertLogs('myapp.outbox', 'WARNING'):
+            sent_failed = outbox.deliver(claimed, FailingBackend(open_error=ConnectionRefusedError()))
+        self.assertEqual(sent_failed, (0, 3))
+        for message in self.messages:
+            self.assertRetrying(message, 1)
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_reconnect_records_the_rest_of_the_batch(self):
+        backend = FailingBackend(send_errors=[SMTPServerDisconnected()], reopen_error=ConnectionRefusedError())
+        with self.assertLogs('myapp.outbox', 'WARNING'):
+            self.assertEqual(outbox.deliver(outbox.claim_due(10), backend), (0, 3))
+        for message in self.messages:
+            self.assertRetrying(message, 1)
+
+    def test_messages_of_a_crashed_worker_are_reclaimed(self):
+        self.assertEqual(len(outbox.claim_due(10)), 3)  # the worker dies before delivering
+        self.assertEqual(outbox.send_due(), (0, 0))
+        later = timezone.now() + timedelta(seconds=outbox.CLAIM_SECONDS + 1)
+        with mock.patch('myapp.outbox.timezone.now', return_value=later):
+            self.assertEqual(outbox.send_due(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+
+# ---------------- Request metrics ----------------
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.admin = make_user('admin', 'Admin')
+        self.registrar = make_user('registrar', 'Registrar')
+        make_sample(registrar=self.registrar)
+
+    def series(self, metric, view):
+        for line in metrics.render().splitlines():
+            if line.startswith(f'{metric}_sum{{view="{view}"'):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_scrape_needs_admin_or_token(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/api/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(client_for(self.registrar).get('/api/metrics').status_code, 403)
+        self.assertEqual(client_for(self.admin).get('/api/metrics').status_code, 200)
+        with mock.patch.object(metrics, 'TOKEN', 'scrape-secret'):
+            self.assertEqual(anonymous.get('/api/metrics', HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+            response = anonymous.get('/api/metrics', HTTP_AUTHORIZATION='Token scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE lab_request_queries histogram', response.content.decode())
+
+    def test_queries_are_counted_per_view(self):
+        with self.assertNumQueries(2) as queries:  # samples, their tests
+            client_for(self.registrar).get('/api/samples/')
+        self.assertEqual(self.series('lab_request_queries', 'sample-list'), len(queries.captured_queries))
+
+    def test_server_timing_only_for_admins_by_default(self):
+        with mock.patch.object(metrics, 'SERVER_TIMING', 'admin'):
+            self.assertNotIn('Server-Timing', client_for(self.registrar).get('/api/samples/'))
+            self.assertIn('queries', client_for(self.admin).get('/api/samples/')['Server-Timing'])
+        with mock.patch.object(metrics, 'SERVER_TIMING', 'off'):
+            self.assertNotIn('Server-Timing', client_for(self.admin).get('/api/samples/'))
+
+    def test_streaming_responses_are_measured_until_consumed(self):
+        response = client_for(self.admin).get('/api/export/samples/?output=ndjson')
+        self.assertTrue(response.streaming)
+        self.assertIsNone(self.series('lab_request_queries', 'export-samples'))
+        b''.join(response.streaming_content)
+        self.assertGreater(self.series('lab_request_queries', 'export-samples'), 0)
+
+
+# ---------------- Role scoping ----------------
+class ScopingTests(TestCase):
+    def setUp(self):
+        self.registrar = make_user('registrar', 'Registrar')
+        self.tech = make_user('tech', 'Technician')
+        self.hod = make_user('hod', 'HOD')
+        self.department = Department.objects.create(name='Chemistry', hod=self.hod)
+        self.hodv = make_user('hodv', 'HODv')
+        Division.objects.create(name='Metals', department=self.department, hodv=self.hodv)
+
+        self.chem_sample = make_sample(registrar=self.registrar)
+        self.chem = Test.objects.create(sample=self.chem_sample, ingredient=make_ingredient('Lead', 'Chemistry'),
+                                        assigned_to=self.tech)
+        self.micro_sample = make_sample(registrar=make_user('other', 'Registrar'), assigned_to_hodv=self.hodv)
+        self.micro = Test.objects.create(sample=self.micro_sample, ingredient=make_ingredient('E.coli', 'Microbiology'))
+
+    def ids(self, queryset):
+        return sorted(queryset.values_list('id', flat=True))
+
+    def test_each_role_sees_its_own_rows(self):
+        both = sorted([self.chem_sample.id, self.micro_sample.id])
+        for role in ('Admin', *User.DIRECTOR_ROLES):
+            self.assertEqual(self.ids(scoping.samples(make_user(f'u-{role}', role))), both, role)
+        self.assertEqual(self.ids(scoping.samples(self.registrar)), [self.chem_sample.id])
+        self.assertEqual(self.ids(scoping.tests(self.tech)), [self.chem.id])
+        self.assertEqual(self.ids(scoping.tests(self.hod)), [self.chem.id])
+        self.assertEqual(self.ids(scoping.samples(self.hodv)), [self.micro_sample.id])
+        self.assertEqual(self.ids(scoping.customers(self.tech)), [self.chem_sample.customer_id])
+        self.assertFalse(scoping.samples(make_user('nobody', 'Accountant')).exists())
+
+    def test_department_names_must_be_test_types(self):
+        self.assertEqual(checks.check_department_names(None, databases=['default']), [])
+        Department.objects.create(name='Chem Lab')
+        errors = checks.check_department_names(None, databases=['default'])
+        self.assertEqual([error.id for error in errors], ['myapp.E001'])
+        with self.assertRaises(ValidationError):
+            Department(name='Chem Lab').clean()
+        response = client_for(make_user('admin', 'Admin')).post('/api/departments/', {'name': 'Chem Lab'})
+        self.assertEqual(response.status_code, 400)
+
+
+# ---------------- Login throttling ----------------
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        caches[throttling.CACHE_ALIAS].clear()
+        self.addCleanup(caches[throttling.CACHE_ALIAS].clear)
+        self.owner = make_user('owner', 'Registrar', password='right-password')
+
+    def login(self, password, address, username='owner', proxy=None):
+        """A login from ``address``, directly or (``proxy`` set) through a proxy adding X-Forwarded-For."""
+        if proxy is None:
+            extra = {'REMOTE_ADDR': address}
+        else:
+            extra = {'REMOTE_ADDR': proxy, 'HTTP_X_FORWARDED_FOR': f'198.51.100.1, {address}'}
+        return APIClient().post('/api/auth/login/', {'username': username, 'password': password},
+                                format='json', **extra)
+
+    def test_throttled_attempts_are_refused_before_hashing(self):
+        capacity = throttling.LoginAccountAddressThrottle().capacity
+        with mock.patch.object(MD5PasswordHasher, 'verify', autospec=True, return_value=False) as verify:
+            for _ in range(capacity):
+                self.assertNotEqual(self.login('guess', '10.0.0.1').status_code, 429)
+            self.assertEqual(verify.call_count, capacity)
+            response = self.login('guess', '10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(verify.call_count, capacity)
+
+    def test_guessing_from_elsewhere_does_not_lock_the_owner_out(self):
+        for _ in range(throttling.LoginAccountAddressThrottle().capacity + 1):
+            self.login('guess', '10.0.0.1')
+        self.assertEqual(self.login('guess', '10.0.0.1').status_code, 429)
+        self.assertEqual(self.login('right-password', '10.0.0.2').status_code, 200)
+
+    def test_clients_behind_the_proxy_get_their_own_buckets(self):
+        # Every request reaches Django from nginx on loopback.
+        for attempt in range(throttling.LoginIPThrottle().capacity + 1):
+            self.login('guess', '203.0.113.7', username=f'user{attempt}', proxy='127.0.0.1')
+        self.assertEqual(self.login('guess', '203.0.113.7', proxy='127.0.0.1').status_code, 429)
+        # The left-most (client-supplied) X-Forwarded-For entry does not pick the bucket.
+        self.assertEqual(self.login('right-password', '203.0.113.8', proxy='127.0.0.1').status_code, 200)
+
+    def test_guesses_against_one_account_are_capped_across_addresses(self):
+        with mock.patch.dict(throttling.RATES, {'login-account': (3, 1 / 60)}):
+            statuses = [self.login('guess', f'10.0.1.{n}').status_code for n in range(4)]
+        self.assertEqual(statuses, [400, 400, 400, 429])
+
+
+# ---------------- Sample search ----------------
+class SearchTests(TestCase):
+    def setUp(self):
+        self.soil = make_sample(sample_name='Soil', laboratory_number='LAB-2024-17')
+        self.water = make_sample(sample_name='Water', laboratory_number='LAB-2023-18')
+
+    def found(self, terms, queryset=None):
+        return sorted(search.search_samples(Sample.objects.all() if queryset is None else queryset, terms)
+                      .values_list('id', flat=True))
+
+    def test_every_term_may_match_a_different_column(self):
+        self.assertEqual(self.found('soil 2024'), [self.soil.id])
+        self.assertEqual(self.found('soil 17'), [self.soil.id])
+        self.assertEqual(self.found('soil 2023'), [])
+        self.assertEqual(self.found('LAB 18'), [self.water.id])
+
+    def test_scoped_searches_rank_their_own_newest_matches(self):
+        registrar = make_user('registrar', 'Registrar')
+        own = make_sample(sample_name='Soil', registrar=registrar)
+        for _ in range(3):
+            make_sample(sample_name='Soil', registrar=make_user(f'other{_}', 'Registrar'))
+        with mock.patch.object(search, 'CANDIDATES', 2):
+            self.assertEqual(self.found('soil', scoping.samples(registrar)), [self.soil.id, own.id])
+            self.assertEqual(len(self.found('soil')), 2)
+
+    def test_triggers_dropped_by_a_table_rebuild_are_reinstalled(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the FTS5 index is SQLite-only')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.FTS_TABLE}_ai')
+        search.install_sqlite_triggers()
+        self.assertEqual(self.found('clay'), [])
+        clay = make_sample(sample_name='Clay')
+        self.assertEqual(self.found('clay'), [clay.id])
+
+    def test_only_searched_columns_reindex_a_sample(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('the FTS5 index is SQLite-only')
+
+        def update_trigger():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [f'{search.FTS_TABLE}_au'])
+                return ' '.join(cursor.fetchone()[0].split())
+
+        self.assertIn('AFTER UPDATE OF sample_name, sample_details, control_number, laboratory_number ON',
+                      update_trigger())
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.FTS_TABLE}_au')
+        search.install_sqlite_triggers()
+        self.assertIn('AFTER UPDATE OF', update_trigger())
+
+        Sample.objects.filter(id=self.soil.id).update(status='In Progress', tests_open=F('tests_open') + 1)
+        Sample.objects.filter(id=self.water.id).update(sample_name='Clay')
+        self.assertEqual((self.found('soil'), self.found('water'), self.found('clay')),
+                         ([self.soil.id], [], [self.water.id]))
+
+
+# ---------------- Compare-and-set transitions ----------------
+class TransitionTests(TestCase):
+    def setUp(self):
+        self.first = make_user('first', 'Registrar')
+        self.second = make_user('second', 'Registrar')
+
+    def claim(self, sample, registrar):
+        return transitions.transition_sample(
+            sample.id, 'Awaiting Registrar Approval', 'Registrar Claimed', kind=events.SAMPLE_CLAIMED,
+            actor=registrar, guards={'registrar__isnull': True}, registrar=registrar,
+        )
+
+    def test_only_one_of_two_claims_wins(self):
+        sample = make_sample(status='Awaiting Registrar Approval')
+        self.assertEqual(self.claim(sample, self.first).registrar_id, self.first.id)
+        self.assertIsNone(self.claim(sample, self.second))
+        sample.refresh_from_db()
+        self.assertEqual((sample.status, sample.registrar_id), ('Registrar Claimed', self.first.id))
+
+    def test_claim_next_hands_out_disjoint_batches(self):
+        samples = [make_sample(status='Awaiting Registrar Approval') for _ in range(5)]
+        first = transitions.claim_next_samples(self.first, 3)
+        second = transitions.claim_next_samples(self.second, 3)
+        self.assertEqual([s.id for s in first], [s.id for s in samples[:3]])
+        self.assertEqual([s.id for s in second], [s.id for s in samples[3:]])
+        self.assertEqual(transitions.claim_next_samples(self.first, 3), [])
+
+    def test_update_returning_filters_across_relations(self):
+        ready, other = make_sample(status='In Progress'), make_sample(status='Completed')
+        tests = [Test.objects.create(sample=sample, status='Pending') for sample in (ready, other)]
+        rows = transitions.update_returning(
+            Test, {'sample__status': 'In Progress', 'status': 'Pending'}, {'status': 'In Progress'}, ('id', 'status'),
+        )
+        self.assertEqual(rows, [{'id': tests[0].id, 'status': 'In Progress'}])
+        self.assertEqual(Test.objects.get(id=tests[1].id).status, 'Pending')
+        self.assertEqual(transitions.update_returning(Test, {'id__in': []}, {'status': 'Pending'}, ('id',)), [])
+
+
+# ---------------- Status counters ----------------
+class BookkeepingAssertions:
+    def assertCountersMatchRows(self):
+        expected = Counter((counters.SAMPLE, status, '') for status in Sample.objects.values_list('status', flat=True))
+        expected.update((counters.TEST, status, department or '')
+                        for status, department in Test.objects.values_list('status', 'ingredient__test_type'))
+        actual = {(row.entity, row.status, row.department): row.count
+                  for row in StatusCounter.objects.exclude(count=0)}
+        self.assertEqual(actual, dict(expected))
+
+    def assertProgressMatchesRows(self):
+        self.assertEqual(progress.rebuild(), 0)
+
+    def rebuild_bookkeeping(self):
+        """Counters and progress columns for rows a test created directly."""
+        call_command('rebuild_status_counters', stdout=StringIO())
+
+
+class CounterTests(BookkeepingAssertions, TestCase):
+
+    def test_counters_follow_the_workflow(self):
+        chem, micro = make_ingredient('Lead', 'Chemistry'), make_ingredient('E.coli', 'Microbiology')
+        hod, admin = make_user('hod', 'HOD'), make_user('admin', 'Admin')
+        tech = make_user('tech', 'Technician', specialization='Chemistry')
+        response = client_for(make_user('customer', 'Registrar')).post('/api/customer/submit-sample/', {
+            'customer': {'first_name': 'A', 'last_name': 'B', 'email': 'ab@example.com'},
+            'samples': [{'name': 'One', 'selected_parameters': [chem.id]},
+                        {'name': 'Two', 'selected_parameters': [chem.id, micro.id]}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertCountersMatchRows()
+
+        one, two = Sample.objects.order_by('id')
+        Sample.objects.filter(id=one.id).update(status='Awaiting HOD Review')
+        counters.record_transition(counters.SAMPLE, 'Awaiting Registrar Approval', 'Awaiting HOD Review')
+        test = one.test_set.get()
+        response = client_for(hod).post(f'/api/hod/assign-technician/{one.id}/',
+                                        {'technician_ids': [tech.id], 'test_ids': [test.id]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        response = client_for(tech).post(f'/api/technician/submit-result/{test.id}/', {'results': 'ok'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Sample.objects.get(id=one.id).status, 'Awaiting HOD Review')
+        self.assertCountersMatchRows()
+
+        self.assertEqual(client_for(admin).delete(f'/api/samples/{two.id}/').status_code, 204)
+        self.assertCountersMatchRows()
+
+    def test_parameters_must_be_a_list_of_ids(self):
+        chem = make_ingredient('Lead', 'Chemistry')
+        client = client_for(make_user('customer', 'Registrar'))
+        for parameters in (f'{chem.id}', {'id': chem.id}, [chem.id, 'lead']):
+            response = client.post('/api/customer/submit-sample/', {
+                'customer': {'first_name': 'A', 'last_name': 'B', 'email': 'ab@example.com'},
+                'samples': [{'name': 'One', 'selected_parameters': [chem.id]},
+                            {'name': 'Two', 'selected_parameters': parameters}],
+            }, format='json')
+            self.assertEqual(response.status_code, 400, parameters)
+            self.assertEqual([outcome['status'] for outcome in response.data['samples']], ['accepted', 'rejected'])
+        self.assertFalse(Sample.objects.exists())
+        self.assertCountersMatchRows()
+
+    def test_benchmark_seed_keeps_bookkeeping_in_step(self):
+        call_command('benchmark_queue_indexes', seed_tests=40, tests_per_sample=4, batch_size=12, i_know=True,
+                     stdout=StringIO())
+        self.assertEqual(Test.objects.count(), 40)
+        self.assertCountersMatchRows()
+        self.assertProgressMatchesRows()
+
+    def test_deferred_changes_are_written_in_key_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            with bookkeeping.atomic():
+                counters.record_transition(counters.TEST, 'Pending', 'In Progress', 'Chemistry')
+                counters.record_transition(counters.SAMPLE, 'Awaiting HOD Review', 'In Progress')
+                self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        entities = [query['sql'].split("\"entity\" = '")[1].split("'")[0]
+                    for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(entities, ['sample', 'sample', 'test', 'test'])
+
+
+# ---------------- Shared-row lock order ----------------
+def shared_writes(queries):
+    """
+    (rank in bookkeeping.ORDER, key) of each UPDATE of a row every workflow
+    transaction shares. (An INSERT only follows an UPDATE of the same key.)
+    """
+    writes = []
+    for query in queries:
+        sql = query['sql']
+        if sql.startswith('UPDATE "myapp_sample"') and '"tests_' in sql.split(' WHERE ')[0]:
+            writes.append((0, ''))
+        elif sql.startswith('UPDATE "myapp_statuscounter"'):
+            writes.append((1, ''))
+        elif sql.startswith('UPDATE "myapp_changewatermark"'):
+            writes.append((2, sql.split('"key" = \'')[1].split("'")[0]))
+    return writes
+
+
+class LockOrderFixture:
+    """A sample whose last open test is being submitted while its other test is reviewed."""
+
+    def setUp(self):
+        super().setUp()
+        self.chem = make_ingredient('Lead', 'Chemistry')
+        self.hod = make_user('hod', 'HOD')
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        self.other = make_user('other', 'Technician', specialization='Chemistry')
+
+    def make_pair(self):
+        """(sample, its last open test, its test awaiting HOD review), with progress and counters set."""
+        sample = make_sample(status='In Progress', tests_total=2, tests_open=1, tests_awaiting_hod=1)
+        open_test = Test.objects.create(sample=sample, ingredient=self.chem, status='In Progress',
+                                        assigned_to=self.tech)
+        reviewed = Test.objects.create(sample=sample, ingredient=self.chem, status='Awaiting HOD Review',
+                                       assigned_to=self.other)
+        return sample, open_test, reviewed
+
+    def submit(self, test):
+        return client_for(self.tech).post(f'/api/technician/submit-result/{test.id}/', {'results': 'ok'},
+                                          format='json')
+
+    def accept(self, test):
+        return client_for(self.hod).post(f'/api/hod/accept-result/{test.id}/')
+
+    def reject(self, test):
+        return client_for(self.hod).post(f'/api/hod/reject-result/{test.id}/', {'reassigned_to': self.tech.id},
+                                         format='json')
+
+    def assign(self, sample, test):
+        return client_for(self.hod).post(f'/api/hod/assign-technician/{sample.id}/',
+                                         {'technician_ids': [self.tech.id], 'test_ids': [test.id]}, format='json')
+
+
+class LockOrderTests(LockOrderFixture, TestCase):
+    def assertWritesInOrder(self, call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        self.assertEqual(response.status_code, 200, response.data)
+        writes = shared_writes(queries)
+        self.assertTrue(writes)
+        self.assertEqual(writes, sorted(writes))
+
+    def test_every_workflow_write_takes_shared_rows_in_one_order(self):
+        sample, open_test, reviewed = self.make_pair()
+        self.assertWritesInOrder(lambda: self.submit(open_test))
+        self.assertWritesInOrder(lambda: self.accept(reviewed))
+        self.assertWritesInOrder(lambda: self.reject(open_test))
+        pending = Test.objects.create(sample=make_sample(), ingredient=self.chem, status='Pending')
+        self.assertWritesInOrder(lambda: self.assign(pending.sample, pending))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row locks that can deadlock')
+class ConcurrentLockOrderTests(LockOrderFixture, TransactionTestCase):
+    ROUNDS = 20
+
+    def race(self, *calls):
+        errors, barrier = [], threading.Barrier(len(calls))
+
+        def run(call):
+            try:
+                barrier.wait()
+                response = call()
+                if response.status_code >= 500:
+                    errors.append(response.status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_last_submission_races_review_of_the_same_sample(self):
+        for review in (self.accept, self.reject):
+            for _ in range(self.ROUNDS):
+                sample, open_test, reviewed = self.make_pair()
+                self.race(lambda: self.submit(open_test), lambda: review(reviewed))
+                sample.refresh_from_db()
+                self.assertEqual(sample.tests_open, Test.objects.filter(
+                    sample=sample, status__in=['Pending', 'In Progress']).count())
+
+    def test_two_last_submissions_move_the_sample_once(self):
+        for _ in range(self.ROUNDS):
+            sample = make_sample(status='In Progress', tests_total=2, tests_open=2)
+            first, second = [Test.objects.create(sample=sample, ingredient=self.chem, status='In Progress',
+                                                 assigned_to=self.tech) for _ in range(2)]
+            self.race(lambda: self.submit(first), lambda: self.submit(second))
+            sample.refresh_from_db()
+            self.assertEqual((sample.status, sample.tests_open, sample.tests_awaiting_hod),
+                             ('Awaiting HOD Review', 0, 2))
+            self.assertEqual(WorkflowEvent.objects.filter(
+                sample_id=sample.id, kind=events.SAMPLE_RESULTS_READY).count(), 1)
+
+    def test_assignment_races_a_rejection_to_the_same_technician(self):
+        for _ in range(self.ROUNDS):
+            _, _, reviewed = self.make_pair()
+            pending = Test.objects.create(sample=make_sample(), ingredient=self.chem, status='Pending')
+            self.race(lambda: self.assign(pending.sample, pending), lambda: self.reject(reviewed))
+
+
+# ---------------- Workflow event feed ----------------
+class EventFeedTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'Admin')
+        self.sample = make_sample()
+
+    def record(self, count):
+        return [events.record(events.SAMPLE_SUBMITTED, self.sample) for _ in range(count)]
+
+    def test_recording_takes_no_shared_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.record(1)
+        self.assertEqual([q['sql'].split()[0] for q in queries], ['INSERT'])
+
+    def test_readers_stop_at_a_recent_gap_until_it_settles(self):
+        first, in_flight, last = self.record(3)
+        in_flight.delete()  # as if its transaction had not committed yet
+        start = first.id - 1
+        batch, cursor = events.read(events.visible_to(self.admin), start, 10)
+        self.assertEqual(([e.id for e in batch], cursor), ([first.id], first.id))
+
+        settled = timezone.now() - timedelta(seconds=events.SETTLE_SECONDS + 1)
+        WorkflowEvent.objects.filter(id=last.id).update(created_at=settled)
+        batch, cursor = events.read(events.visible_to(self.admin), start, 10)
+        self.assertEqual(([e.id for e in batch], cursor), ([first.id, last.id], last.id))
+
+    def test_cursor_moves_past_events_the_reader_cannot_see(self):
+        technician = make_user('tech', 'Technician')
+        since = events.current_cursor()
+        self.record(2)
+        response = client_for(technician).get(f'/api/events/?since={since}')
+        self.assertEqual((response.data['events'], response.data['cursor']), ([], events.latest_id()))
+
+    def test_sync_workers_do_not_wait_or_stream(self):
+        client = client_for(self.admin)
+        started = timezone.now()
+        response = client.get(f'/api/events/?since={events.current_cursor()}&wait=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(timezone.now() - started, timedelta(seconds=1))
+        self.assertEqual(client.get('/api/events/', HTTP_ACCEPT='text/event-stream').status_code, 503)
+        with mock.patch.object(events, 'BLOCKING_WORKERS', True):
+            response = client.get('/api/events/', HTTP_ACCEPT='text/event-stream')
+        self.assertTrue(response.streaming)
+        response.close()
+
+
+# ---------------- Claims tokens ----------------
+class ClaimsTokenTests(TestCase):
+    def test_refresh_restamps_claims_from_the_current_row(self):
+        user = make_user('analyst', 'Technician')
+        refresh = authentication.LabRefreshToken.for_user(user)
+        User.objects.filter(id=user.id).update(role='Admin')
+        authentication.invalidate(user.id)
+
+        response = APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        access = authentication.AccessToken(response.data['access'])
+        row = authentication.current_user(user.id)
+        self.assertEqual((access['role'], access['ver']), ('Admin', row['ver']))
+        self.assertNotEqual(access['ver'], refresh['ver'])
+
+    def test_refresh_refuses_deactivated_users(self):
+        user = make_user('analyst', 'Technician')
+        refresh = authentication.LabRefreshToken.for_user(user)
+        user.is_active = False
+        user.save()
+        response = APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+# ---------------- Signed tokens ----------------
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        self.user = make_user('analyst', 'Technician')
+
+    def test_verification_token_round_trip(self):
+        token = tokens.make_verification_token(self.user)
+        self.assertEqual(tokens.read_verification_token(token), (self.user.pk, self.user.email))
+        self.assertIsNone(tokens.legacy_token(token))
+
+    def test_expired_tokens_are_rejected(self):
+        verify = tokens.make_verification_token(self.user)
+        reset = tokens.make_reset_token(self.user)
+        later = time.time() + max(tokens.VERIFY_MAX_AGE, settings.PASSWORD_RESET_TIMEOUT) + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            self.assertIsNone(tokens.read_verification_token(verify))
+            self.assertIsNone(tokens.read_reset_token(reset))
+
+    def test_tampered_tokens_are_rejected(self):
+        for token in (tokens.make_verification_token(self.user), tokens.make_reset_token(self.user)):
+            payload, _, signature = token.rpartition(':')
+            forged = payload + ':' + ('A' if signature[0] != 'A' else 'B') + signature[1:]
+            self.assertIsNone(tokens.read_verification_token(forged))
+            self.assertIsNone(tokens.read_reset_token(forged))
+        # A valid token for one purpose is not accepted for the other.
+        self.assertIsNone(tokens.read_reset_token(tokens.make_verification_token(self.user)))
+
+    def test_reset_token_stops_working_once_the_password_changes(self):
+        token = tokens.make_reset_token(self.user)
+        self.assertEqual(tokens.read_reset_token(token), self.user)
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertIsNone(tokens.read_reset_token(token))
+
+
+# ---------------- Bulk review ----------------
+class BulkReviewTests(BookkeepingAssertions, TestCase):
+    def setUp(self):
+        self.hod = make_user('hod', 'HOD')
+        Department.objects.create(name='Chemistry', hod=self.hod)
+        self.director = make_user('director', 'Director')
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        self.chem = make_ingredient('Lead', 'Chemistry')
+
+    def make_tests(self, sample_status, *statuses):
+        sample = make_sample(status=sample_status)
+        tests = [Test.objects.create(sample=sample, ingredient=self.chem, status=status, assigned_to=self.tech)
+                 for status in statuses]
+        self.rebuild_bookkeeping()
+        return sample, tests
+
+    def review(self, user, stage, **body):
+        response = client_for(user).post(f'/api/{stage}/bulk-review/', body, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def statuses(self, tests):
+        return list(Test.objects.filter(id__in=[test.id for test in tests]).order_by('id')
+                    .values_list('status', flat=True))
+
+    def test_hod_accepts_and_rejects_a_partial_batch(self):
+        sample, (first, second, done) = self.make_tests(
+            'Awaiting HOD Review', 'Awaiting HOD Review', 'Awaiting HOD Review', 'Awaiting DG Review')
+        data = self.review(self.hod, 'hod', action='approve', test_ids=[first.id, done.id])
+        self.assertEqual((data['approved'], data['skipped']), ([first.id], [done.id]))
+        data = self.review(self.hod, 'hod', action='reject', test_ids=[second.id, first.id])
+        self.assertEqual((data['rejected'], data['skipped']), ([second.id], [first.id]))
+
+        self.assertEqual(self.statuses([first, second, done]),
+                         ['Awaiting DG Review', 'Pending', 'Awaiting DG Review'])
+        self.assertEqual(Test.objects.get(id=second.id).assigned_to_id, self.tech.id)
+        self.assertEqual(Test.objects.get(id=first.id).approved_by_id, self.hod.id)
+        self.assertCountersMatchRows()
+        self.assertProgressMatchesRows()
+
+    def test_dg_rejection_returns_the_sample_to_the_hod(self):
+        sample, (first, second, done) = self.make_tests(
+            'Submitted to Director', 'Awaiting DG Review', 'Awaiting DG Review', 'Approved')
+        data = self.review(self.director, 'dg', action='approve', test_ids=[first.id, done.id])
+        self.assertEqual((data['approved'], data['skipped']), ([first.id], [done.id]))
+        self.assertEqual(Sample.objects.get(id=sample.id).status, 'Submitted to Director')
+
+        hod_queue = watermarks.current(queues.HOD_QUEUE)
+        data = self.review(self.director, 'dg', action='reject', sample_id=sample.id)
+        self.assertEqual((data['rejected'], data['skipped']), ([second.id], [first.id, done.id]))
+        self.assertEqual(self.statuses([first, second, done]), ['Approved', 'Awaiting HOD Review', 'Approved'])
+        self.assertEqual(Sample.objects.get(id=sample.id).status, 'Awaiting HOD Review')
+        self.assertGreater(watermarks.current(queues.HOD_QUEUE), hod_queue)
+        self.assertTrue(WorkflowEvent.objects.filter(sample_id=sample.id, kind=events.SAMPLE_RETURNED_TO_HOD).exists())
+        self.assertCountersMatchRows()
+        self.assertProgressMatchesRows()
+
+        # The HOD sees the sample again and can send it back to the Director.
+        listed = client_for(self.hod).get('/api/dashboard/hod/').data['results']
+        self.assertEqual([row['id'] for row in listed], [sample.id])
+        self.review(self.hod, 'hod', action='approve', test_ids=[second.id])
+        response = client_for(self.hod).post(f'/api/hod/submit-to-director/{sample.id}/')
+        self.assertEqual(response.status_code, 200, response.data)
+
+
+# ---------------- Conditional queue polling ----------------
+class ConditionalQueueTests(BookkeepingAssertions, TestCase):
+    def setUp(self):
+        self.hod = make_user('hod', 'HOD')
+        Department.objects.create(name='Chemistry', hod=self.hod)
+        self.director = make_user('director', 'Director')
+        self.registrar = make_user('registrar', 'Registrar')
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        self.sample = make_sample(status='Awaiting HOD Review')
+        self.test = Test.objects.create(sample=self.sample, ingredient=make_ingredient('Lead', 'Chemistry'),
+                                        status='Pending')
+        self.rebuild_bookkeeping()
+
+    def poll(self, user, url, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        response = client_for(user).get(url, **headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def etag(self, user, url):
+        response = self.poll(user, url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_queues_answer_304(self):
+        for user, url in ((self.hod, '/api/dashboard/hod/'), (self.director, '/api/dashboard/dg/'),
+                          (self.tech, '/api/technician/queue/'), (self.registrar, '/api/unclaimed-samples/')):
+            etag = self.etag(user, url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.poll(user, url, etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(len(queries), 1, url)  # the watermarks only
+
+    def test_every_transition_of_a_queue_changes_its_etag(self):
+        queue, hod_queue, dg_queue = '/api/technician/queue/', '/api/dashboard/hod/', '/api/dashboard/dg/'
+        steps = [
+            (lambda: client_for(self.hod).post('/api/hod/assign-batch/', {'assignments': [
+                {'sample': self.sample.id, 'test': self.test.id, 'technician': self.tech.id}]}, format='json'),
+             [(self.tech, queue), (self.hod, hod_queue)]),
+            (lambda: client_for(self.tech).post(f'/api/technician/submit-result/{self.test.id}/',
+                                                {'results': 'ok'}, format='json'),
+             [(self.tech, queue), (self.hod, hod_queue)]),
+            (lambda: client_for(self.hod).post(f'/api/hod/accept-result/{self.test.id}/'),
+             [(self.hod, hod_queue), (self.director, dg_queue)]),
+            (lambda: client_for(self.director).post('/api/dg/bulk-review/',
+                                                    {'action': 'reject', 'test_ids': [self.test.id]}, format='json'),
+             [(self.hod, hod_queue), (self.director, dg_queue)]),
+        ]
+        for step, (change, polled) in enumerate(steps):
+            before = {url: self.etag(user, url) for user, url in polled}
+            self.assertEqual(change().status_code, 200, step)
+            for user, url in polled:
+                response = self.poll(user, url, before[url])
+                self.assertEqual(response.status_code, 200, (step, url))
+                self.assertNotEqual(response['ETag'], before[url], (step, url))
+
+    def test_an_etag_is_never_valid_for_another_user(self):
+        other = make_user('other', 'Technician', specialization='Chemistry')
+        for first, second, url in ((self.tech, other, '/api/technician/queue/'),
+                                   (self.hod, make_user('hod2', 'HOD'), '/api/dashboard/hod/'),
+                                   (self.director, make_user('dg2', 'Director General'), '/api/dashboard/dg/')):
+            etag = self.etag(first, url)
+            response = self.poll(second, url, etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+# ---------------- Technician work queue ----------------
+class TechnicianQueueTests(TestCase):
+    def setUp(self):
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        other = make_user('other', 'Technician', specialization='Chemistry')
+        sample, lead = make_sample(status='In Progress'), make_ingredient('Lead', 'Chemistry')
+
+        def test(status, priority=0, technician=self.tech):
+            return Test.objects.create(sample=sample, ingredient=lead, assigned_to=technician, status=status,
+                                       priority=priority).id
+
+        self.normal_pending = test('Pending')
+        self.urgent_in_progress = test('In Progress', priority=2)
+        self.high_pending = test('Pending', priority=1)
+        self.urgent_pending = test('Pending', priority=2)
+        self.normal_in_progress = test('In Progress')
+        for status in ('Awaiting HOD Review', 'Awaiting DG Review', 'Completed', 'Approved'):
+            test(status, priority=2)
+        test('Pending', priority=2, technician=other)
+
+    def queue(self, query='', user=None):
+        return client_for(user or self.tech).get(f'/api/technician/queue/{query}')
+
+    def ids(self, query=''):
+        response = self.queue(query)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['id'] for row in response.data['results']]
+
+    def test_only_own_open_tests_by_priority_then_age(self):
+        self.assertEqual(self.ids(), [self.urgent_in_progress, self.urgent_pending, self.high_pending,
+                                      self.normal_pending, self.normal_in_progress])
+
+    def test_status_and_priority_filters(self):
+        self.assertEqual(self.ids('?status=In Progress'), [self.urgent_in_progress, self.normal_in_progress])
+        self.assertEqual(self.ids('?priority=2'), [self.urgent_in_progress, self.urgent_pending])
+        self.assertEqual(self.ids('?status=Pending&priority=0'), [self.normal_pending])
+        for query in ('?status=Completed', '?priority=3', '?priority=high'):
+            self.assertEqual(self.queue(query).status_code, 400, query)
+
+    def test_keyset_pages_cover_the_queue_once(self):
+        pages, url = [], '/api/technician/queue/?page_size=2'
+        while url:
+            response = client_for(self.tech).get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        self.assertEqual(pages, [[self.urgent_in_progress, self.urgent_pending],
+                                 [self.high_pending, self.normal_pending], [self.normal_in_progress]])
+
+    def test_other_roles_are_refused(self):
+        for role in ('HOD', 'Director', 'Registrar', 'Customer', 'Admin'):
+            self.assertEqual(self.queue(user=make_user(role.lower(), role)).status_code, 403, role)
+
+
+# ---------------- Sample test progress ----------------
+class ProgressTests(BookkeepingAssertions, TestCase):
+    def setUp(self):
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        self.hod = make_user('hod', 'HOD')
+        self.chem = make_ingredient('Lead', 'Chemistry')
+        self.sample = make_sample(status='In Progress')
+        self.first, self.second = [
+            Test.objects.create(sample=self.sample, ingredient=self.chem, status='In Progress', assigned_to=self.tech)
+            for _ in range(2)
+        ]
+        self.rebuild_bookkeeping()
+
+    def submit(self, test):
+        return client_for(self.tech).post(f'/api/technician/submit-result/{test.id}/', {'results': 'ok'},
+                                          format='json')
+
+    def submit_batch(self, *tests):
+        return client_for(self.tech).post('/api/technician/submit-results/', {
+            'results': [{'test': test.id, 'results': 'ok'} for test in tests],
+        }, format='json')
+
+    def assertProgress(self, status, tests_open, tests_awaiting_hod, ready_events):
+        sample = Sample.objects.get(id=self.sample.id)
+        self.assertEqual((sample.status, sample.tests_total, sample.tests_open, sample.tests_awaiting_hod),
+                         (status, 2, tests_open, tests_awaiting_hod))
+        self.assertEqual(WorkflowEvent.objects.filter(
+            sample_id=sample.id, kind=events.SAMPLE_RESULTS_READY).count(), ready_events)
+        self.assertCountersMatchRows()
+        self.assertProgressMatchesRows()
+
+    def test_the_last_submission_moves_the_sample_exactly_once(self):
+        self.assertEqual(self.submit(self.first).status_code, 200)
+        self.assertProgress('In Progress', 1, 1, 0)
+        self.assertEqual(self.submit(self.first).status_code, 404)  # a repeat finds nothing open
+        self.assertProgress('In Progress', 1, 1, 0)
+        self.assertEqual(self.submit(self.second).status_code, 200)
+        self.assertProgress('Awaiting HOD Review', 0, 2, 1)
+
+        # A rejected result comes back and is submitted again: the sample is already with the HOD.
+        response = client_for(self.hod).post('/api/hod/bulk-review/',
+                                             {'action': 'reject', 'test_ids': [self.second.id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertProgress('Awaiting HOD Review', 1, 1, 1)
+        self.assertEqual(self.submit(self.second).status_code, 200)
+        self.assertProgress('Awaiting HOD Review', 0, 2, 1)
+
+    def test_both_last_tests_in_one_batch_move_the_sample_once(self):
+        response = self.submit_batch(self.first, self.second)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['samples'], [{'id': self.sample.id, 'status': 'Awaiting HOD Review'}])
+        self.assertProgress('Awaiting HOD Review', 0, 2, 1)
+
+    def test_a_batch_failing_partway_changes_nothing(self):
+        foreign = Test.objects.create(sample=make_sample(), ingredient=self.chem, status='In Progress',
+                                      assigned_to=make_user('other', 'Technician', specialization='Chemistry'))
+        self.rebuild_bookkeeping()
+        response = self.submit_batch(self.first, self.second, foreign)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['errors'], [{'test': foreign.id, 'error': mock.ANY}])
+        self.assertEqual(set(Test.objects.filter(sample=self.sample).values_list('status', flat=True)),
+                         {'In Progress'})
+        self.assertProgress('In Progress', 2, 0, 0)
+        self.assertFalse(WorkflowEvent.objects.filter(sample_id=self.sample.id).exists())
+
+        # A failure after the writes began (here: writing the events) rolls everything back too.
+        with mock.patch.object(events, 'record_many', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.submit_batch(self.first, self.second)
+        self.assertProgress('In Progress', 2, 0, 0)
+
+
+# ---------------- Ingredient catalog ----------------
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'Admin')
+        self.registrar = make_user('registrar', 'Registrar')
+        self.lead = make_ingredient('Lead', 'Chemistry')
+
+    def register(self, *ingredients):
+        response = client_for(self.registrar).post('/api/registrar/register-sample/', {
+            'customer': {'first_name': 'A', 'last_name': 'B', 'email': 'ab@example.com'},
+            'samples': [{'sample_name': 'Soil', 'sample_details': 'Topsoil',
+                         'selected_ingredients': [ingredient.id for ingredient in ingredients]}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        sample_id = response.data['samples'][0]['id']
+        return dict(Test.objects.filter(sample_id=sample_id).values_list('ingredient_id', 'price'))
+
+    def test_intake_charges_the_price_after_an_ingredient_edit(self):
+        self.assertEqual(self.register(self.lead), {self.lead.id: Decimal('100.00')})
+        response = client_for(self.admin).patch(f'/api/ingredients/{self.lead.id}/', {'price': '150.00'},
+                                                format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.register(self.lead), {self.lead.id: Decimal('150.00')})
+
+    def test_created_and_deleted_ingredients_reach_the_cached_catalog(self):
+        self.register(self.lead)  # warm the catalog
+        response = client_for(self.admin).post('/api/ingredients/', {
+            'name': 'E.coli', 'price': '80.00', 'test_type': 'Microbiology'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        ecoli = Ingredient.objects.get(id=response.data['id'])
+        self.assertEqual(self.register(self.lead, ecoli), {self.lead.id: Decimal('100.00'),
+                                                           ecoli.id: Decimal('80.00')})
+
+        self.assertEqual(client_for(self.admin).delete(f'/api/ingredients/{ecoli.id}/').status_code, 204)
+        self.assertEqual(self.register(self.lead, ecoli), {self.lead.id: Decimal('100.00')})
+
+    def listed_prices(self):
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['price'] for item in response.data}
+
+    def test_listing_is_served_from_the_cache(self):
+        self.listed_prices()  # warm the catalog
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.listed_prices(), {self.lead.id: '100.00'})
+        self.assertEqual(len(queries), 1)  # the watermark lookup only
+        self.assertIn('myapp_changewatermark', queries[0]['sql'])
+
+    def test_watermark_is_checked_once_per_request(self):
+        catalog.get_catalog()  # warm the catalog
+        request_started.send(sender=self.__class__)
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                catalog.get_catalog()
+        request_started.send(sender=self.__class__)
+        with self.assertNumQueries(1):
+            catalog.get_catalog()
+
+    def test_bulk_updates_are_seen_once_the_watermark_moves(self):
+        self.listed_prices()  # warm the catalog
+        Ingredient.objects.filter(id=self.lead.id).update(price=Decimal('120.00'))
+        self.assertEqual(self.listed_prices(), {self.lead.id: '100.00'})  # signals bypassed, still cached
+
+        catalog.invalidate()
+        self.assertEqual(self.listed_prices(), {self.lead.id: '120.00'})
+
+        # Another worker's invalidate() only reaches this one through the watermark.
+        Ingredient.objects.filter(id=self.lead.id).update(price=Decimal('130.00'))
+        watermarks.bump(catalog.CATALOG_KEY)
+        self.assertEqual(self.listed_prices(), {self.lead.id: '130.00'})
+        self.assertEqual(self.register(self.lead), {self.lead.id: Decimal('130.00')})
+
+
+# ---------------- Eager loading ----------------
+class EagerLoadingTests(BookkeepingAssertions, TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'Admin')
+        self.hod = make_user('hod', 'HOD')
+        self.department = Department.objects.create(name='Chemistry', hod=self.hod)
+        self.division = Division.objects.create(name='Metals', department=self.department)
+        self.director = make_user('director', 'Director')
+        self.tech = make_user('tech', 'Technician', specialization='Chemistry')
+        self.registrar = make_user('registrar', 'Registrar')
+        self.chem = make_ingredient('Lead', 'Chemistry')
+        self.rounds = 0
+
+    def populate(self, rounds):
+        """Per round: a sample in the HOD queue with a test for each queue, and an unclaimed sample."""
+        for _ in range(rounds):
+            n = self.rounds = self.rounds + 1
+            other = make_user(f'tech{n}', 'Technician', specialization='Chemistry',
+                              department=self.department, division=self.division)
+            customer = Customer.objects.create(first_name='C', last_name=str(n), email=f'c{n}@example.com')
+            queued = make_sample(customer, status='Awaiting HOD Review',
+                                 registrar=make_user(f'registrar{n}', 'Registrar'))
+            Payment.objects.create(sample=queued, amount_due=Decimal('10.00'))
+            open_test = Test.objects.create(sample=queued, ingredient=self.chem, status='Pending',
+                                            assigned_to=self.tech)
+            Test.objects.create(sample=queued, ingredient=self.chem, status='Awaiting DG Review', assigned_to=other)
+            Result.objects.create(sample=queued, test=open_test, result_data='ok')
+
+            unclaimed = make_sample(customer, status='Awaiting Registrar Approval')
+            Payment.objects.create(sample=unclaimed, amount_due=Decimal('10.00'))
+            Test.objects.create(sample=unclaimed, ingredient=self.chem, status='Pending')
+        self.rebuild_bookkeeping()
+
+    def test_list_endpoints_cost_the_same_queries_at_any_size(self):
+        endpoints = [
+            (self.admin, '/api/users/'), (self.admin, '/api/samples/'), (self.admin, '/api/tests/'),
+            (self.admin, '/api/payments/'), (self.admin, '/api/results/'),
+            (self.hod, '/api/dashboard/hod/'), (self.director, '/api/dashboard/dg/'),
+            (self.tech, '/api/technician/queue/'), (self.tech, '/api/dashboard/technician/'),
+            (self.registrar, '/api/unclaimed-samples/'), (self.registrar, '/api/registrar-samples/'),
+        ]
+        self.populate(1)
+        small = {}
+        for user, url in endpoints:
+            client = client_for(user)
+            self.assertEqual(client.get(url).status_code, 200, url)  # warm the catalog
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            small[url] = (len(queries), len(response.content))
+
+        self.populate(4)
+        for user, url in endpoints:
+            queries, size = small[url]
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                response = client_for(user).get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertGreater(len(response.content), size, url)  # the list did grow
+
+
+# ---------------- Registrar intake ----------------
+class RegistrarIntakeTests(BookkeepingAssertions, TestCase):
+    def setUp(self):
+        self.registrar = make_user('registrar', 'Registrar')
+        self.lead = make_ingredient('Lead', 'Chemistry')
+        self.ecoli = make_ingredient('E.coli', 'Microbiology')
+        Ingredient.objects.filter(id=self.ecoli.id).update(price=Decimal('80.00'))
+        catalog.invalidate()
+
+    def register(self, *selections):
+        return client_for(self.registrar).post('/api/registrar/register-sample/', {
+            'customer': {'first_name': 'A', 'last_name': 'B', 'email': 'ab@example.com'},
+            'samples': [{'sample_name': f'Sample {n}', 'sample_details': 'Soil', 'selected_ingredients': ids}
+                        for n, ids in enumerate(selections)],
+        }, format='json')
+
+    def test_tests_and_payment_are_priced_from_one_catalog_read(self):
+        response = self.register([self.lead.id, self.ecoli.id], [self.lead.id, 999999])
+        self.assertEqual(response.status_code, 201, response.data)
+        samples = Sample.objects.order_by('id')
+        self.assertEqual(
+            [sorted(sample.test_set.values_list('ingredient_id', 'price')) for sample in samples],
+            [[(self.lead.id, Decimal('100.00')), (self.ecoli.id, Decimal('80.00'))],
+             [(self.lead.id, Decimal('100.00'))]],
+        )  # the unknown ingredient is skipped
+        # Two marking fees plus each distinct ingredient once.
+        self.assertEqual(Payment.objects.get().amount_due, Decimal('20180.00'))
+        self.assertEqual([(s.tests_total, s.tests_open) for s in samples], [(2, 2), (1, 1)])
+        self.assertCountersMatchRows()
+        self.assertProgressMatchesRows()
+
+    def test_query_count_does_not_grow_with_samples_or_tests(self):
+        tests = [self.lead.id, self.ecoli.id]
+        self.register(tests)  # warm the catalog
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.register(tests).status_code, 201)
+        with self.assertNumQueries(len(queries)):
+            response = self.register(*[tests] * 10)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['samples']), 10)
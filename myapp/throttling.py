@@ -0,0 +1,132 @@
+# myapp/throttling.py
+"""
+Token-bucket throttles for the login endpoints.
+
+Each client IP, each account (the username or email being tried) from
+each IP, and each account overall has a bucket of ``capacity`` attempts
+that refills at ``refill_rate`` attempts per second. Every login attempt
+takes one token from each before the credentials are looked at, so a
+brute-force burst is answered with 429 without a user lookup or password
+hash; a successful login gives its tokens back, so legitimate users behind
+one address do not use up each other's budget. The tight per-account bucket
+is per address, so guessing an account's password from one place does not
+lock its owner out; the looser account-wide bucket caps the guesses against
+one account spread over many addresses.
+
+The client IP is DRF's ``get_ident()``: behind the nginx proxy every
+request comes from loopback, so ``REST_FRAMEWORK['NUM_PROXIES']`` must
+count the proxies that append to X-Forwarded-For (see settings).
+
+Buckets live in the ``LOGIN_THROTTLE_CACHE`` cache (a file-based cache
+shared by every worker on the host, see settings). Updates are serialized
+within a worker; across workers the read-modify-write is not atomic, so a
+few extra attempts can slip through under contention, but the buckets still
+cap the sustained rate.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+CACHE_ALIAS = getattr(settings, 'LOGIN_THROTTLE_CACHE', 'throttle')
+RATES = getattr(settings, 'LOGIN_THROTTLE_RATES', {})
+
+_lock = threading.Lock()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base class: subclasses set ``scope`` and implement ``get_ident_key()``."""
+    scope = None
+    capacity = 10
+    refill_rate = 0.1
+
+    def __init__(self):
+        self.capacity, self.refill_rate = RATES.get(self.scope, (self.capacity, self.refill_rate))
+        self.cache = caches[CACHE_ALIAS]
+        self.deficit = 0
+
+    def get_ident_key(self, request):
+        """What the bucket belongs to, or None to not throttle ``request``."""
+        raise NotImplementedError
+
+    def cache_key(self, request):
+        ident = self.get_ident_key(request)
+        if ident is None:
+            return None
+        return f'throttle:{self.scope}:{hashlib.sha1(ident.encode()).hexdigest()}'
+
+    def _take(self, key, amount):
+        """Add ``amount`` tokens (negative to take) if the bucket allows; returns the new level or None."""
+        with _lock:
+            now = time.time()
+            tokens, updated = self.cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.refill_rate)
+            if tokens + amount < 0:
+                self.deficit = -(tokens + amount)
+                return None
+            tokens = min(self.capacity, tokens + amount)
+            # Drop the bucket once it would be full again.
+            refill_seconds = math.ceil((self.capacity - tokens) / self.refill_rate) + 1
+            self.cache.set(key, (tokens, now), timeout=refill_seconds)
+            return tokens
+
+    def allow_request(self, request, view):
+        key = self.cache_key(request)
+        return key is None or self._take(key, -1) is not None
+
+    def wait(self):
+        return self.deficit / self.refill_rate
+
+    def refund(self, request):
+        key = self.cache_key(request)
+        if key is not None:
+            self._take(key, 1)
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'login-ip'
+    capacity = 20
+    refill_rate = 0.5
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+def _account(request):
+    data = request.data if hasattr(request.data, 'get') else {}
+    account = data.get('username') or data.get('email')
+    if not isinstance(account, str) or not account.strip():
+        return None
+    return account.strip().lower()
+
+
+class LoginAccountAddressThrottle(TokenBucketThrottle):
+    scope = 'login-account-ip'
+    capacity = 5
+    refill_rate = 1 / 60
+
+    def get_ident_key(self, request):
+        account = _account(request)
+        return None if account is None else f'{account}|{self.get_ident(request)}'
+
+
+class LoginAccountThrottle(TokenBucketThrottle):
+    scope = 'login-account'
+    capacity = 50
+    refill_rate = 1 / 60
+
+    def get_ident_key(self, request):
+        return _account(request)
+
+
+LOGIN_THROTTLES = [LoginIPThrottle, LoginAccountAddressThrottle, LoginAccountThrottle]
+
+
+def login_succeeded(request):
+    """Give back the tokens a successful login attempt took."""
+    for throttle_class in LOGIN_THROTTLES:
+        throttle_class().refund(request)
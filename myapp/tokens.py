@@ -0,0 +1,59 @@
+# myapp/tokens.py
+"""
+Signed, timestamped tokens for email verification and password reset links.
+
+Issuing a token writes nothing and a forged, tampered or expired token is
+rejected from its signature alone, without a query. Verifying an email is
+idempotent, so its token needs no single-use marker. A reset token also
+embeds Django's PasswordResetTokenGenerator hash of the user's password
+and last login, so it stops working as soon as the password changes; that
+is the single-use marker, kept in the user row instead of a token table.
+
+Tokens from the old VerificationToken table are still honoured until they
+expire (they never contain ``:``); ``purge_verification_tokens`` removes
+the rows.
+"""
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core import signing
+from django.utils import timezone
+
+from .models import User, VerificationToken
+
+VERIFY_SALT = 'myapp.tokens.verify-email'
+RESET_SALT = 'myapp.tokens.reset-password'
+VERIFY_MAX_AGE = getattr(settings, 'EMAIL_VERIFICATION_TIMEOUT', 60 * 60 * 24)
+
+
+def make_verification_token(user):
+    return signing.dumps({'u': user.pk, 'e': user.email}, salt=VERIFY_SALT)
+
+
+def read_verification_token(token):
+    """(user id, email) the token verifies, or None."""
+    try:
+        payload = signing.loads(token, salt=VERIFY_SALT, max_age=VERIFY_MAX_AGE)
+        return payload['u'], payload['e']
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+
+def make_reset_token(user):
+    return signing.dumps({'u': user.pk, 't': default_token_generator.make_token(user)}, salt=RESET_SALT)
+
+
+def read_reset_token(token):
+    """The user whose password ``token`` may reset, or None."""
+    try:
+        payload = signing.loads(token, salt=RESET_SALT, max_age=settings.PASSWORD_RESET_TIMEOUT)
+        user = User.objects.get(pk=payload['u'])
+    except (signing.BadSignature, KeyError, TypeError, User.DoesNotExist):
+        return None
+    return user if default_token_generator.check_token(user, payload['t']) else None
+
+
+def legacy_token(token):
+    """An unexpired VerificationToken row for an old-style token, or None."""
+    if ':' in token:
+        return None
+    return VerificationToken.objects.select_related('user').filter(token=token, expires_at__gt=timezone.now()).first()
@@ -0,0 +1,331 @@
+# myapp/transitions.py
+"""
+Compare-and-set workflow transitions for Sample and Test.
+
+Each transition is a single ``UPDATE ... SET <changed columns> WHERE id = ?
+AND status = ? [AND guards]``. The row count says whether this request won:
+two registrars claiming the same sample both send the UPDATE, the database
+serializes them on the row lock, and the loser matches zero rows because the
+status no longer fits. On PostgreSQL and SQLite >= 3.35 the columns needed
+for the follow-up bookkeeping come back through ``RETURNING`` in the same
+statement; elsewhere they are read afterwards.
+
+The winner then records the status counters, queue watermarks and workflow
+event in the same transaction, so callers must run inside
+``bookkeeping.atomic()``. The batch variants below put the same guard on
+many rows in one statement and report only the rows that actually moved.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import sql
+from django.utils import timezone
+
+from . import counters, events, progress, queues
+from .catalog import get_catalog
+from .models import TECHNICIAN_QUEUE_STATUSES, Sample, Test
+
+SAMPLE_COLUMNS = ('id', 'status', 'registrar_id')
+TEST_COLUMNS = ('id', 'status', 'sample_id', 'ingredient_id', 'assigned_to_id')
+
+CLAIM_NEXT_MAX_BATCH = getattr(settings, 'CLAIM_NEXT_MAX_BATCH', 50)
+RESULTS_MAX_BATCH = getattr(settings, 'RESULTS_MAX_BATCH', 200)
+REVIEW_MAX_BATCH = getattr(settings, 'REVIEW_MAX_BATCH', 500)
+
+
+class BatchRejected(ValueError):
+    """A batch was rejected as a whole; ``errors`` lists the offending rows."""
+
+    def __init__(self, errors):
+        super().__init__('Batch rejected.')
+        self.errors = errors
+
+
+def _supports_update_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    # SQLite gained RETURNING together with the INSERT support Django probes.
+    return connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+
+
+def update_returning(model, filters, changes, returning):
+    """
+    ``UPDATE model SET **changes WHERE **filters`` as one statement.
+    Returns the ``returning`` columns of every updated row as dicts.
+
+    ``filters`` may follow relations: the update compiler's
+    ``pre_sql_setup()`` (run by ``as_sql()``) turns joined conditions into
+    ``pk IN (subquery)``. ``changes`` must be fields of ``model`` itself;
+    parent-model fields would need a second UPDATE that RETURNING cannot
+    cover, so they raise ValueError.
+    """
+    queryset = model._default_manager.filter(**filters)
+    connection = connections[queryset.db]
+    if not _supports_update_returning(connection):
+        # Lock the matching rows so the re-read sees exactly what we changed.
+        pks = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return []
+        model._default_manager.filter(pk__in=pks).update(**changes)
+        return list(model._default_manager.filter(pk__in=pks).values(*returning))
+
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(changes)
+    if query.related_updates:
+        raise ValueError(f'update_returning() can only change fields of {model.__name__} itself.')
+    try:
+        update_sql, params = query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return []  # e.g. id__in=[]
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in returning)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{update_sql} RETURNING {columns}', params)
+        return [dict(zip(returning, row)) for row in cursor.fetchall()]
+
+
+def compare_and_set(model, filters, changes, returning):
+    """
+    ``update_returning()`` for filters matching at most one row. Returns
+    that row's ``returning`` columns, or None if nothing matched.
+    """
+    rows = update_returning(model, filters, changes, returning)
+    return rows[0] if rows else None
+
+
+def transition_sample(sample_id, from_status, to_status, *, kind, actor=None, guards=None, **changes):
+    """
+    Move a sample from ``from_status`` to ``to_status`` (also setting
+    ``changes``) if it is still in ``from_status``. Returns a partial Sample
+    (SAMPLE_COLUMNS only) if this call won, else None.
+    """
+    row = compare_and_set(
+        Sample,
+        {'id': sample_id, 'status': from_status, **(guards or {})},
+        {'status': to_status, **changes},
+        SAMPLE_COLUMNS,
+    )
+    if row is None:
+        return None
+    sample = Sample(**row)
+    counters.record_transition(counters.SAMPLE, from_status, to_status)
+    queues.touch_samples(sample, old_status=from_status)
+    events.record(kind, sample, from_status=from_status, to_status=to_status, actor=actor)
+    return sample
+
+
+def transition_test(test_id, from_statuses, to_status, *, kind, actor=None, guards=None,
+                    previous_assignee_id=None, **changes):
+    """
+    Move a test from any of ``from_statuses`` to ``to_status``. Each
+    candidate status is tried as its own compare-and-set, so the counters
+    always know which status the test actually left. Returns a partial Test
+    (TEST_COLUMNS, with ``sample`` set to a partial Sample) or None.
+    """
+    if isinstance(from_statuses, str):
+        from_statuses = (from_statuses,)
+    for from_status in from_statuses:
+        row = compare_and_set(
+            Test,
+            {'id': test_id, 'status': from_status, **(guards or {})},
+            {'status': to_status, **changes},
+            TEST_COLUMNS,
+        )
+        if row is not None:
+            break
+    else:
+        return None
+
+    test = Test(**row)
+    test.sample = Sample.objects.only(*SAMPLE_COLUMNS).get(id=test.sample_id)
+    counters.record_transition(counters.TEST, from_status, to_status, get_catalog().test_type(test.ingredient_id))
+    progress.record([(test.sample_id, from_status, to_status)])
+    queues.touch_technicians(previous_assignee_id, test.assigned_to_id)
+    queues.touch_test(test, old_status=from_status)
+    events.record(kind, test.sample, test, from_status, to_status, actor)
+    return test
+
+
+def claim_next_samples(registrar, limit):
+    """
+    Hand ``registrar`` up to ``limit`` of the oldest unclaimed samples.
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` passes over rows another caller is
+    claiming right now, so concurrent callers get disjoint batches without
+    waiting on each other. Returns partial Samples (SAMPLE_COLUMNS), oldest
+    first; must run inside ``bookkeeping.atomic()``.
+    """
+    from_status, to_status = queues.UNCLAIMED_STATUS, 'Registrar Claimed'
+    candidates = Sample.objects.filter(status=from_status, registrar__isnull=True)
+    ids = list(
+        candidates.select_for_update(skip_locked=True)
+        .order_by('date_received', 'id').values_list('id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+    # The guard repeats the filter for backends without row locks (SQLite),
+    # where two callers may have picked the same rows.
+    candidates.filter(id__in=ids).update(status=to_status, registrar=registrar)
+    samples = list(
+        Sample.objects.filter(id__in=ids, status=to_status, registrar=registrar)
+        .order_by('date_received', 'id').only(*SAMPLE_COLUMNS)
+    )
+    if samples:
+        counters.record_transitions(counters.SAMPLE, [(from_status, to_status, '')] * len(samples))
+        queues.touch_samples(*samples, old_status=from_status)
+        events.record_many(
+            events.build(events.SAMPLE_CLAIMED, sample, from_status=from_status, to_status=to_status,
+                         actor=registrar)
+            for sample in samples
+        )
+    return samples
+
+
+def submit_results(technician, results_by_test):
+    """
+    Record ``results_by_test`` ({test id: results}) for open tests assigned
+    to ``technician`` and move them to HOD review; a sample whose last open
+    test this was follows. Ownership is checked for the whole batch in one
+    query and nothing is written unless every test qualifies. Returns
+    (tests, samples): the submitted tests and the affected samples as
+    partial instances. Must run inside ``bookkeeping.atomic()``.
+    """
+    to_status, now = 'Awaiting HOD Review', timezone.now()
+    tests = {
+        test.id: test
+        for test in Test.objects.select_for_update()
+        .filter(id__in=list(results_by_test), assigned_to=technician, status__in=TECHNICIAN_QUEUE_STATUSES)
+        .only(*TEST_COLUMNS)
+    }
+    missing = [test_id for test_id in results_by_test if test_id not in tests]
+    if missing:
+        raise BatchRejected([
+            {'test': test_id, 'error': 'Test not found, not assigned to you or not open.'}
+            for test_id in missing
+        ])
+
+    catalog = get_catalog()
+    test_changes = []
+    for test_id, results in results_by_test.items():
+        test = tests[test_id]
+        test_changes.append((test.status, to_status, catalog.test_type(test.ingredient_id)))
+        test.status, test.results, test.submitted_date = to_status, results, now
+    submitted = [tests[test_id] for test_id in results_by_test]
+    Test.objects.bulk_update(submitted, ['status', 'results', 'submitted_date'], batch_size=RESULTS_MAX_BATCH)
+
+    # Completion is decided once per sample from its progress columns,
+    # read under the row lock: every submitted test leaves tests_open.
+    submitted_per_sample = Counter(test.sample_id for test in submitted)
+    before = list(
+        Sample.objects.select_for_update().filter(id__in=submitted_per_sample)
+        .order_by('id').only(*SAMPLE_COLUMNS, 'tests_open')
+    )
+    progress.record((test.sample_id, from_status, to_status)
+                    for test, (from_status, _, _) in zip(submitted, test_changes))
+    ready = [
+        sample for sample in before
+        if sample.tests_open <= submitted_per_sample[sample.id] and sample.status != to_status
+    ]
+    ready_ids = {sample.id for sample in ready}
+    if ready:
+        Sample.objects.filter(id__in=ready_ids).update(status=to_status)
+    after = [
+        Sample(id=sample.id, registrar_id=sample.registrar_id,
+               status=to_status if sample.id in ready_ids else sample.status)
+        for sample in before
+    ]
+    samples = {sample.id: sample for sample in after}
+
+    counters.apply(
+        counters.moved(counters.TEST, test_changes),
+        counters.moved(counters.SAMPLE, [(sample.status, to_status, '') for sample in ready]),
+    )
+    queues.touch_technicians(technician.id)
+    queues.touch_samples(*before, *after)
+    events.record_many([
+        *(
+            events.build(events.TEST_RESULT_SUBMITTED, samples[test.sample_id], test, from_status, to_status,
+                         technician, department)
+            for test, (from_status, _, department) in zip(submitted, test_changes)
+        ),
+        *(
+            events.build(events.SAMPLE_RESULTS_READY, samples[sample.id], from_status=sample.status,
+                         to_status=to_status, actor=technician)
+            for sample in ready
+        ),
+    ])
+    return submitted, after
+
+
+def transition_tests(filters, from_status, to_status, *, kind, actor=None, **changes):
+    """
+    Set-based transition_test(): one guarded UPDATE moves every test
+    matching ``filters`` that is still in ``from_status``. Returns the
+    partial Tests that moved; tests that had already moved are left alone.
+    """
+    rows = update_returning(Test, {**filters, 'status': from_status}, {'status': to_status, **changes}, TEST_COLUMNS)
+    if not rows:
+        return []
+    tests = [Test(**row) for row in rows]
+    samples = Sample.objects.only(*SAMPLE_COLUMNS).in_bulk({test.sample_id for test in tests})
+    catalog = get_catalog()
+    departments = []
+    for test in tests:
+        test.sample = samples[test.sample_id]
+        departments.append(catalog.test_type(test.ingredient_id))
+
+    counters.record_transitions(
+        counters.TEST, [(from_status, to_status, department) for department in departments]
+    )
+    progress.record((test.sample_id, from_status, to_status) for test in tests)
+    queues.touch_technicians(*{test.assigned_to_id for test in tests})
+    queues.touch_samples(*samples.values(), dg=queues.DG_REVIEW_STATUS in (from_status, to_status))
+    events.record_many(
+        events.build(kind, test.sample, test, from_status, to_status, actor, department)
+        for test, department in zip(tests, departments)
+    )
+    return tests
+
+
+DIRECTOR_STATUS = 'Submitted to Director'
+
+# Bulk review: (stage, action) -> (from status, to status, event kind, approves?).
+REVIEWS = {
+    ('hod', 'approve'): ('Awaiting HOD Review', 'Awaiting DG Review', events.TEST_ACCEPTED, True),
+    ('hod', 'reject'): ('Awaiting HOD Review', 'Pending', events.TEST_REJECTED, False),
+    ('dg', 'approve'): ('Awaiting DG Review', 'Approved', events.TEST_APPROVED, True),
+    ('dg', 'reject'): ('Awaiting DG Review', 'Awaiting HOD Review', events.TEST_REJECTED, False),
+}
+
+
+def review_tests(stage, action, actor, test_ids=None, sample_id=None):
+    """
+    Approve or reject, at the HOD or DG ``stage``, the tests ``test_ids``
+    or every test of ``sample_id`` that is still awaiting that stage.
+    HOD rejections go back to the same technician; DG rejections go back
+    to the HOD and clear the HOD's sign-off, and their samples return from
+    the Director to the HOD queue so they can be submitted again. Returns
+    (moved ids, skipped ids), skipped being the requested tests that had
+    already moved or do not exist.
+    """
+    from_status, to_status, kind, approves = REVIEWS[(stage, action)]
+    if approves:
+        changes = {'approved_by': actor, 'approved_date': timezone.now()}
+    elif stage == 'dg':
+        changes = {'approved_by': None, 'approved_date': None}
+    else:
+        changes = {}
+    filters = {'id__in': test_ids} if sample_id is None else {'sample_id': sample_id}
+    tests = transition_tests(filters, from_status, to_status, kind=kind, actor=actor, **changes)
+    if stage == 'dg' and not approves:
+        for rejected_sample_id in sorted({test.sample_id for test in tests}):
+            transition_sample(
+                rejected_sample_id, DIRECTOR_STATUS, queues.HOD_REVIEW_STATUS,
+                kind=events.SAMPLE_RETURNED_TO_HOD, actor=actor,
+            )
+    moved = sorted(test.id for test in tests)
+    if sample_id is None:
+        requested = set(test_ids)
+    else:
+        requested = set(Test.objects.filter(sample_id=sample_id).values_list('id', flat=True))
+    return moved, sorted(requested.difference(moved))
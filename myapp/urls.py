@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 from . import api_views
 from .api_views import (
     # Auth
@@ -8,17 +8,18 @@ from .api_views import (
     forgot_password_api, reset_password_api,
     get_current_user,
     # Dashboards
-    admin_dashboard, registrar_dashboard, technician_dashboard,
-    hod_dashboard, dg_dashboard,
+    admin_dashboard, registrar_dashboard, technician_dashboard, technician_queue,
+    hod_dashboard, dg_dashboard, status_facets, export_samples, workflow_events,
+    metrics_api,
     # Registrar workflows
     registrar_samples_api, registrar_register_sample,
-    registrar_submit_to_hod, registrar_claim_sample, unclaimed_samples,
+    registrar_submit_to_hod, registrar_claim_sample, registrar_claim_next, unclaimed_samples,
     # HOD workflows
-    hod_assign_technician, list_technicians,
-    hod_accept_result, hod_reject_result,
+    hod_assign_technician, hod_assign_batch, hod_auto_assign, list_technicians,
+    hod_accept_result, hod_reject_result, hod_bulk_review, dg_bulk_review,
     submit_to_director,
     # Technician workflows
-    CustomerSubmitSampleAPIView, technician_submit_result,
+    CustomerSubmitSampleAPIView, technician_submit_result, technician_submit_results,
     # ViewSets
     UserViewSet, DepartmentViewSet, DivisionViewSet,
     CustomerViewSet, SampleViewSet, TestViewSet,
@@ -49,8 +50,13 @@ urlpatterns = [
     path('api/dashboard/admin/', admin_dashboard, name='admin_dashboard'),
     path('api/dashboard/registrar/', registrar_dashboard, name='registrar_dashboard'),
     path('api/dashboard/technician/', technician_dashboard, name='technician_dashboard'),
+    path('api/technician/queue/', technician_queue, name='technician_queue'),
     path('api/dashboard/hod/', hod_dashboard, name='hod_dashboard'),
     path('api/dashboard/dg/', dg_dashboard, name='dg-dashboard'),
+    path('api/dashboard/facets/', status_facets, name='status-facets'),
+    path('api/export/samples/', export_samples, name='export-samples'),
+    path('api/events/', workflow_events, name='workflow-events'),
+    path('api/metrics', metrics_api, name='metrics'),
     # Customer & Registrar workflows
     path('api/customer/submit-sample/', CustomerSubmitSampleAPIView.as_view(), name='customer_submit_sample'),
     path('api/registrar-samples/', registrar_samples_api, name='registrar_samples_api'),
@@ -58,18 +64,24 @@ urlpatterns = [
     path('api/registrar/register-sample/', registrar_register_sample, name='registrar_register_sample'),
     path('api/registrar/submit-to-hod/<int:sample_id>/', registrar_submit_to_hod, name='registrar_submit_to_hod'),
     path('api/claim-sample/<int:sample_id>/', registrar_claim_sample, name='registrar_claim_sample'),
+    path('api/registrar/claim-next/', registrar_claim_next, name='registrar_claim_next'),
     # HOD workflows
     path('api/hod/assign-technician/<int:sample_id>/', hod_assign_technician, name='hod_assign_technician'),
+    path('api/hod/assign-batch/', hod_assign_batch, name='hod_assign_batch'),
+    path('api/hod/auto-assign/', hod_auto_assign, name='hod_auto_assign'),
     path('api/technicians/', list_technicians, name='list_technicians'),
     path('api/hod/accept-result/<int:test_id>/', hod_accept_result, name='hod-accept-result'),
     path('api/hod/reject-result/<int:test_id>/', hod_reject_result, name='hod-reject-result'),
+    path('api/hod/bulk-review/', hod_bulk_review, name='hod_bulk_review'),
     path('api/submit-to-director/<int:test_id>/', submit_to_director, name='submit-to-director'),
     # Technician workflows
     path('api/technician/submit-result/<int:test_id>/', technician_submit_result, name='technician_submit_result'),
+    path('api/technician/submit-results/', technician_submit_results, name='technician_submit_results'),
     # JWT Authentication
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', api_views.TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/dg/approve-result/<int:test_id>/', api_views.dg_approve_result, name='dg_approve_result'),
+    path('api/dg/bulk-review/', dg_bulk_review, name='dg_bulk_review'),
 
     # HOD → Director
 path("api/hod/submit-to-director/<int:sample_id>/", api_views.hod_submit_to_director, name="hod_submit_to_director"),
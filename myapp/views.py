@@ -11,6 +11,7 @@ import random
 from django.contrib.auth.hashers import make_password
 from decimal import Decimal
 
+from .authentication import LabRefreshToken
 from .models import User, Department, Division, Customer, Sample, Test, Payment, Result, Ingredient
 from .serializers import (
     LoginSerializer, UserSerializer, DepartmentSerializer, DivisionSerializer,
@@ -34,7 +35,7 @@ def login_api(request):
     serializer = LoginSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
     user = serializer.validated_data['user']
-    refresh = RefreshToken.for_user(user)
+    refresh = LabRefreshToken.for_user(user)
     user_data = UserSerializer(user).data
     return Response({
         'success': True,
@@ -126,7 +127,7 @@ def registrar_dashboard(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def director_dashboard(request):
-    if request.user.role != 'Director':
+    if request.user.role not in User.DIRECTOR_ROLES:
         return Response({'success': False, 'message': 'Access denied. Director role required.'}, status=status.HTTP_403_FORBIDDEN)
     pending_samples = Sample.objects.filter(status='Awaiting Director Confirmation')
     return Response({
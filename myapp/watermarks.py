@@ -0,0 +1,59 @@
+# myapp/watermarks.py
+"""
+Named change watermarks.
+
+A watermark is a counter that goes up every time the state it names
+changes. Readers that keep a derived copy (a cache, an ETag) only need to
+compare one indexed row with the version they saw last.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import bookkeeping
+from .models import ChangeWatermark
+
+
+def current(key):
+    """Current version of ``key`` (0 if it has never been bumped)."""
+    return ChangeWatermark.objects.filter(key=key).values_list('version', flat=True).first() or 0
+
+
+def snapshot(*keys):
+    """
+    Version and last change time of several watermarks in one query, as
+    {key: (version, updated_at)}; (0, None) for keys never bumped.
+    """
+    rows = dict.fromkeys(keys, (0, None))
+    for key, version, updated_at in ChangeWatermark.objects.filter(key__in=keys).values_list(
+        'key', 'version', 'updated_at'
+    ):
+        rows[key] = (version, updated_at)
+    return rows
+
+
+def bump(*keys):
+    """
+    Advance the given watermarks. Call it inside the transaction that makes
+    the change so readers never see the new version without the new data;
+    inside ``bookkeeping.atomic()`` they advance once, at the end of it.
+    """
+    changes = Counter(dict.fromkeys(keys, 1))
+    if not bookkeeping.collect(bookkeeping.WATERMARKS, changes):
+        _write(changes)
+
+
+@bookkeeping.writer(bookkeeping.WATERMARKS)
+def _write(keys):
+    now = timezone.now()
+    for key in sorted(keys):
+        if ChangeWatermark.objects.filter(key=key).update(version=F('version') + 1, updated_at=now):
+            continue
+        try:
+            with transaction.atomic():
+                ChangeWatermark.objects.create(key=key, version=1)
+        except IntegrityError:
+            # Another transaction created the row first.
+            ChangeWatermark.objects.filter(key=key).update(version=F('version') + 1, updated_at=now)